@@ -1,5 +1,5 @@
 from flask import Blueprint, make_response, request, current_app
-import logging, asyncio
+import logging
 import os
 import secrets
 import base64
@@ -11,6 +11,7 @@ from configops.database.db import (
     db,
     Workspace,
     Worker,
+    WorkerInventory,
     ManagedObjects,
     GroupPermission,
     Group,
@@ -18,14 +19,18 @@ from configops.database.db import (
 )
 from configops.api.utils import BaseResult, auth_required, do_check_auth
 from marshmallow import Schema, fields, EXCLUDE, validate
-from configops.utils.constants import CONTROLLER_NAMESPACE, FutureCallback
+from configops.utils.constants import CONTROLLER_NAMESPACE
 from configops.cluster.messages import Message, MessageType
+from configops.cluster.scatter import STATUS_OK, ScatterTarget, scatter
 
 
 bp = Blueprint("admin", __name__, url_prefix=os.getenv("FLASK_APPLICATION_ROOT", "/"))
 
 logger = logging.getLogger(__name__)
 
+# Seconds the worker stats wait for the workers
+WORKER_STATS_TIMEOUT = 3.0
+
 
 class ApiWorkspaceSchema(Schema):
     id = fields.Str(required=False)
@@ -82,6 +87,12 @@ class ApiWorkspacePermissionSchema(Schema):
         unknown = EXCLUDE
 
 
+def _invalidate_worker_auth_cache():
+    controller_ns = current_app.config.get(CONTROLLER_NAMESPACE)
+    if controller_ns:
+        controller_ns.invalidate_worker_auth()
+
+
 @bp.route(rule="/api/admin/group/v1", methods=["GET"])
 @auth_required(module=PermissionModule.GROUP_MANAGE.name, actions=["READ"])
 def read_group():
@@ -254,11 +265,16 @@ def delete_workspace():
     for managed_object in managed_objects:
         db.session.delete(managed_object)
 
+    db.session.query(WorkerInventory).filter(
+        WorkerInventory.worker_id.in_(worker_ids)
+    ).delete()
+
     for worker in workers:
         db.session.delete(worker)
 
     db.session.delete(workspace)
     db.session.commit()
+    _invalidate_worker_auth_cache()
     return BaseResult().response()
 
 
@@ -354,6 +370,37 @@ def read_worker():
     return BaseResult(data=resp_data).response(total)
 
 
+@bp.route(rule="/api/admin/worker/stats/v1", methods=["GET"])
+@auth_required(module=PermissionModule.WORKSPACE_WORKER_MANAGE.name, actions=["READ"])
+def read_worker_stats():
+    workspace_id = request.headers.get(constants.X_WORKSPACE)
+    controller_ns = current_app.config.get(CONTROLLER_NAMESPACE)
+    workers = db.session.query(Worker).filter(Worker.workspace_id == workspace_id)
+    resp_data = []
+    targets = []
+    for worker in workers:
+        item = controller_ns.pending_requests.stats(worker.id)
+        item["id"] = worker.id
+        item["name"] = worker.name
+        item["sessions"] = len(controller_ns.routing_table.get_sessions(worker.id))
+        item["dispatcher"] = None
+        resp_data.append(item)
+        targets.append(
+            ScatterTarget(
+                f"worker-stats:{worker.id}",
+                worker.id,
+                Message(type=MessageType.WORKER_STATS, data={}),
+            )
+        )
+    # Message queue depths and saturation reported by the workers
+    scatter(controller_ns, targets, WORKER_STATS_TIMEOUT)
+    for item, target in zip(resp_data, targets):
+        item["dispatcher_status"] = target.status
+        if target.status == STATUS_OK:
+            item["dispatcher"] = target.result.get("data")
+    return BaseResult(data=resp_data).response()
+
+
 @bp.route(rule="/api/admin/worker/v1", methods=["POST"])
 @auth_required(module=PermissionModule.WORKSPACE_WORKER_MANAGE.name, actions=["CREATE"])
 def create_worker():
@@ -371,6 +418,7 @@ def create_worker():
     )
     db.session.add(worker)
     db.session.commit()
+    _invalidate_worker_auth_cache()
     return BaseResult().response()
 
 
@@ -387,6 +435,7 @@ def edit_worker():
     _exists.name = data["name"]
     _exists.description = data.get("description", "")
     db.session.commit()
+    _invalidate_worker_auth_cache()
     return BaseResult().response()
 
 
@@ -421,8 +470,13 @@ def delete_worker():
     for managed_object in managed_objects:
         db.session.delete(managed_object)
 
+    db.session.query(WorkerInventory).filter(
+        WorkerInventory.worker_id == worker_id
+    ).delete()
+
     db.session.delete(worker)
     db.session.commit()
+    _invalidate_worker_auth_cache()
     return BaseResult().response()
 
 
@@ -440,7 +494,7 @@ def get_worker_detail():
 
 
 @bp.route(rule="/api/admin/worker/upgrade/v1", methods=["PUT"])
-async def upgrade_worker():
+def upgrade_worker():
     worker_id = request.args["id"]
     workspace_id = request.headers[constants.X_WORKSPACE]
 
@@ -462,12 +516,9 @@ async def upgrade_worker():
         data=data,
     )
 
-    loop = asyncio.get_event_loop()
-    future = loop.create_future()
-    callback = FutureCallback(future, loop)
-
+    # The worker restarts while upgrading, nothing waits for its response
     controller_namespace = current_app.config.get(CONTROLLER_NAMESPACE)
-    controller_namespace.send_message(worker_id, message, callback)
+    controller_namespace.send_message(worker_id, message)
     return BaseResult().response(0)
 
 
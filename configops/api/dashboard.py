@@ -5,15 +5,26 @@ This Python file contains functionality for [briefly describe the purpose of the
 It is designed to [explain what the file does or its main use case].
 """
 
-from flask import Blueprint, make_response, request, current_app, session
-import logging, asyncio, os
+from flask import Blueprint, Response, make_response, request, current_app, session
+import logging, os, queue
 from marshmallow import Schema, fields, EXCLUDE, validate
-from configops.utils.constants import PermissionModule, ChangelogExeType, FutureCallback
+from configops.utils.constants import (
+    PermissionModule,
+    ChangelogExeType,
+    StreamCallback,
+)
 from configops.database.db import db, ManagedObjects, Worker, GroupPermission
 from configops.api.utils import BaseResult, auth_required, do_check_auth
 from marshmallow import Schema, fields, EXCLUDE
 from configops.utils.constants import CONTROLLER_NAMESPACE, X_WORKSPACE
 from configops.cluster.messages import Message, MessageType
+from configops.cluster.scatter import (
+    ScatterTarget,
+    STATUS_OK,
+    STATUS_UNSUPPORTED,
+    scatter,
+    merge_sorted,
+)
 import sqlalchemy
 
 bp = Blueprint(
@@ -22,6 +33,9 @@ bp = Blueprint(
 
 logger = logging.getLogger(__name__)
 
+# Max changelogs fetched from every managed object by the workspace view
+MAX_WORKSPACE_CHANGELOG_WINDOW = 500
+
 
 class ApiDeleteChangelogSchema(Schema):
     change_set_id = fields.Str(required=True)
@@ -44,19 +58,24 @@ class ApiUpdateChangelogSchema(Schema):
         unknown = EXCLUDE
 
 
-@bp.route("/api/dashboard/managed_objects/v1", methods=["GET"])
-@auth_required()
-def list_managed_objects():
-    workerspace_id = request.headers[X_WORKSPACE]
-    f = request.args.get("f")
-    permission_prefix = ""
-    if f == "secret":
-        permission_prefix = PermissionModule.MANAGED_OBJECT_SECRET_MANAGE.name
-    else:
-        permission_prefix = PermissionModule.MANAGED_OBJECT_CHANGELOG_MANAGE.name
+class ApiWorkspaceChangelogsSchema(Schema):
+    page = fields.Int(load_default=1, validate=validate.Range(min=1))
+    size = fields.Int(load_default=20, validate=validate.Range(min=1, max=100))
+    q = fields.Str(load_default="")
+    start_time = fields.Str(load_default="")
+    end_time = fields.Str(load_default="")
+    # Liquibase has exectypes of its own, e.g. MARK_RAN
+    exectypes = fields.List(fields.Str())
+    system_type = fields.Str()
+    timeout = fields.Float(load_default=5.0, validate=validate.Range(min=0.5, max=30))
+
+    class Meta:
+        unknown = EXCLUDE
+
 
+def __permitted_managed_objects_stmt__(workerspace_id, permission_prefix):
     groups = session["groups"]
-    stmt = (
+    return (
         sqlalchemy.select(
             ManagedObjects.id,
             ManagedObjects.system_id,
@@ -74,7 +93,22 @@ def list_managed_objects():
         )
         .order_by(Worker.name, ManagedObjects.system_type)
     )
-    items = db.session.execute(stmt).all()
+
+
+@bp.route("/api/dashboard/managed_objects/v1", methods=["GET"])
+@auth_required()
+def list_managed_objects():
+    workerspace_id = request.headers[X_WORKSPACE]
+    f = request.args.get("f")
+    permission_prefix = ""
+    if f == "secret":
+        permission_prefix = PermissionModule.MANAGED_OBJECT_SECRET_MANAGE.name
+    else:
+        permission_prefix = PermissionModule.MANAGED_OBJECT_CHANGELOG_MANAGE.name
+
+    items = db.session.execute(
+        __permitted_managed_objects_stmt__(workerspace_id, permission_prefix)
+    ).all()
     data = [
         {
             "id": item.id,
@@ -90,7 +124,7 @@ def list_managed_objects():
 
 
 @bp.route("/api/dashboard/changelogs/v1", methods=["GET"])
-async def get_changelogs():
+def get_changelogs():
     check_auth_resp = do_check_auth(
         module=PermissionModule.MANAGED_OBJECT_CHANGELOG_MANAGE, actions=["READ"]
     )
@@ -121,20 +155,133 @@ async def get_changelogs():
             "system_type": managed_object.system_type,
         },
     )
-    loop = asyncio.get_event_loop()
-    future = loop.create_future()
-    callback = FutureCallback(future, loop)
-
+    # Cursor pagination, the first page is requested with an empty cursor
+    for key in ("cursor", "count"):
+        if key in request.args:
+            message.data[key] = request.args[key]
     controller_namespace = current_app.config.get(CONTROLLER_NAMESPACE)
-    controller_namespace.send_message(managed_object.worker_id, message, callback)
     try:
-        return await asyncio.wait_for(future, timeout=5.0)
-    except asyncio.TimeoutError:
+        return controller_namespace.query(
+            managed_object.worker_id, managed_object.id, message, timeout=5.0
+        )
+    except TimeoutError:
         return BaseResult(data=[]).response(0)
 
 
+@bp.route("/api/dashboard/workspace/changelogs/v1", methods=["GET"])
+@auth_required()
+def get_workspace_changelogs():
+    """
+    Changelogs of every managed object of the workspace the user may read, newest
+    first. Objects whose worker is offline, does not answer in time or is too old
+    for the exectypes filter are left out and reported in targets.
+    """
+    workerspace_id = request.headers[X_WORKSPACE]
+    args = request.args.to_dict()
+    if "exectypes" in request.args:
+        args["exectypes"] = request.args.getlist("exectypes")
+    params = ApiWorkspaceChangelogsSchema().load(args)
+    page, size = params["page"], params["size"]
+    # Every object returns its newest changelogs up to the requested page
+    window = page * size
+    if window > MAX_WORKSPACE_CHANGELOG_WINDOW:
+        return BaseResult.error(
+            f"Page too deep, page * size must not exceed {MAX_WORKSPACE_CHANGELOG_WINDOW}"
+        ).response()
+
+    stmt = __permitted_managed_objects_stmt__(
+        workerspace_id, PermissionModule.MANAGED_OBJECT_CHANGELOG_MANAGE.name
+    )
+    if params.get("system_type"):
+        stmt = stmt.where(ManagedObjects.system_type == params["system_type"])
+    managed_objects = {}
+    for item in db.session.execute(stmt).all():
+        managed_objects.setdefault(item.id, item)
+
+    targets = []
+    for item in managed_objects.values():
+        data = {
+            "page": 1,
+            "size": window,
+            "q": params["q"],
+            "start_time": params["start_time"],
+            "end_time": params["end_time"],
+            "system_id": item.system_id,
+            "system_type": item.system_type,
+            "with_counts": True,
+            "count": "capped",
+        }
+        if params.get("exectypes"):
+            data["exectypes"] = params["exectypes"]
+        message = Message(type=MessageType.QUERY_CHANGE_LOG, data=data)
+        targets.append(ScatterTarget(item.id, item.worker_id, message))
+
+    controller_namespace = current_app.config.get(CONTROLLER_NAMESPACE)
+    scatter(controller_namespace, targets, params["timeout"])
+
+    item_lists = []
+    target_infos = []
+    total = 0
+    for target in targets:
+        managed_object = managed_objects[target.id]
+        result_data = None
+        if target.status == STATUS_OK:
+            result_data = target.result.get("data")
+            if params.get("exectypes") and not isinstance(result_data, dict):
+                # Workers not supporting with_counts ignore exectypes as well
+                target.status = STATUS_UNSUPPORTED
+                target.msg = "Worker does not support the exectypes filter"
+        target_info = target.to_dict()
+        target_info.update(
+            {
+                "system_id": managed_object.system_id,
+                "system_type": managed_object.system_type,
+                "worker_id": managed_object.worker_id,
+                "worker_name": managed_object.worker_name,
+                "total": None,
+                "counts": None,
+            }
+        )
+        target_infos.append(target_info)
+        if target.status != STATUS_OK:
+            continue
+        if isinstance(result_data, dict):
+            items = result_data.get("items") or []
+            target_info["counts"] = result_data.get("counts")
+        else:
+            # Workers not supporting with_counts
+            items = result_data or []
+        target_info["total"] = target.result.get("total", len(items))
+        total += target_info["total"]
+        # Results may be shared with other callers through the query cache
+        item_lists.append(
+            [
+                dict(
+                    changelog,
+                    managed_object_id=target.id,
+                    worker_name=managed_object.worker_name,
+                )
+                for changelog in items
+            ]
+        )
+
+    items = merge_sorted(
+        item_lists,
+        key=lambda changelog: changelog.get("execute_date") or "",
+        offset=(page - 1) * size,
+        size=size,
+        reverse=True,
+    )
+    data = {
+        "items": items,
+        "targets": target_infos,
+        "partial": any(target.status != STATUS_OK for target in targets),
+    }
+    return BaseResult(data=data).response(total)
+
+
 @bp.route("/api/dashboard/changelogs/v1", methods=["DELETE"])
-async def delete_changelogs():
+def delete_changelogs():
     check_auth_resp = do_check_auth(
         module=PermissionModule.MANAGED_OBJECT_CHANGELOG_MANAGE, actions=["DELETE"]
     )
@@ -172,22 +319,23 @@ async def delete_changelogs():
         },
     )
 
-    loop = asyncio.get_event_loop()
-    future = loop.create_future()
-    callback = FutureCallback(future, loop)
-
     controller_namespace = current_app.config.get(CONTROLLER_NAMESPACE)
-    controller_namespace.send_message(managed_object.worker_id, message, callback)
+    controller_namespace.query_cache.invalidate(managed_object.id)
     try:
-        return await asyncio.wait_for(future, timeout=5.0)
-    except asyncio.TimeoutError:
+        return controller_namespace.request(
+            managed_object.worker_id, message, timeout=5.0
+        )
+    except TimeoutError:
         return BaseResult.error(
             "Deletion timed out. Please refresh the data or try again."
         ).response()
+    finally:
+        # Reads racing with the write may have been cached meanwhile
+        controller_namespace.query_cache.invalidate(managed_object.id)
 
 
 @bp.route("/api/dashboard/changelogs/v1", methods=["PUT"])
-async def update_changelogs():
+def update_changelogs():
     check_auth_resp = do_check_auth(
         module=PermissionModule.MANAGED_OBJECT_CHANGELOG_MANAGE, actions=["EDIT"]
     )
@@ -223,22 +371,23 @@ async def update_changelogs():
         },
     )
 
-    loop = asyncio.get_event_loop()
-    future = loop.create_future()
-    callback = FutureCallback(future, loop)
-
     controller_namespace = current_app.config.get(CONTROLLER_NAMESPACE)
-    controller_namespace.send_message(managed_object.worker_id, message, callback)
+    controller_namespace.query_cache.invalidate(managed_object.id)
     try:
-        return await asyncio.wait_for(future, timeout=5.0)
-    except asyncio.TimeoutError:
+        return controller_namespace.request(
+            managed_object.worker_id, message, timeout=5.0
+        )
+    except TimeoutError:
         return BaseResult.error(
             "Update timed out. Please refresh the data or try again."
         ).response()
+    finally:
+        # Reads racing with the write may have been cached meanwhile
+        controller_namespace.query_cache.invalidate(managed_object.id)
 
 
 @bp.route("/api/dashboard/changeset/v1", methods=["GET"])
-async def get_changeset():
+def get_changeset():
     check_auth_resp = do_check_auth(
         module=PermissionModule.MANAGED_OBJECT_CHANGELOG_MANAGE, actions=["READ"]
     )
@@ -265,22 +414,40 @@ async def get_changeset():
         },
     )
 
-    loop = asyncio.get_event_loop()
-    future = loop.create_future()
-    callback = FutureCallback(future, loop)
-
+    # Change sets can be large, the worker streams them in chunks which are
+    # passed on to the client as they arrive
+    callback = StreamCallback()
     controller_namespace = current_app.config.get(CONTROLLER_NAMESPACE)
-    controller_namespace.send_message(managed_object.worker_id, message, callback)
+    controller_namespace.send_query(
+        managed_object.worker_id, managed_object.id, message, callback
+    )
     try:
-        return await asyncio.wait_for(future, timeout=5.0)
-    except asyncio.TimeoutError:
+        first_chunk = callback.next_chunk(timeout=5.0)
+    except queue.Empty:
         return BaseResult.error(
             "Get timed out. Please refresh the data or try again."
         ).response()
+    except Exception as e:
+        # e.g. the worker is offline, too many chunks buffered or a chunk out of order
+        logger.error(f"Get change set error. {e}")
+        return BaseResult.error(f"Get change set error. {e}").response()
+
+    def generate():
+        chunk = first_chunk
+        while chunk is not None:
+            yield chunk
+            try:
+                chunk = callback.next_chunk(timeout=5.0)
+            except Exception as e:
+                # Headers are sent already, the client sees a truncated body
+                logger.error(f"Stream change set error. {e}")
+                return
+
+    return Response(generate(), mimetype="application/json")
 
 
 @bp.route("/api/dashboard/secrets/v1", methods=["GET"])
-async def get_secrets():
+def get_secrets():
     check_auth_resp = do_check_auth(
         module=PermissionModule.MANAGED_OBJECT_SECRET_MANAGE, actions=["READ"]
     )
@@ -309,15 +476,12 @@ async def get_secrets():
         },
     )
 
-    loop = asyncio.get_event_loop()
-    future = loop.create_future()
-    callback = FutureCallback(future, loop)
-
     controller_namespace = current_app.config.get(CONTROLLER_NAMESPACE)
-    controller_namespace.send_message(managed_object.worker_id, message, callback)
     try:
-        return await asyncio.wait_for(future, timeout=5.0)
-    except asyncio.TimeoutError:
+        return controller_namespace.request(
+            managed_object.worker_id, message, timeout=5.0
+        )
+    except TimeoutError:
         return BaseResult.error(
             "Timed out. Please refresh the data or try again."
         ).response()
@@ -1,8 +1,9 @@
 # -*- coding: utf-8 -*-
 # @Author  : Bruce Wu
 import logging, os
-from marshmallow import Schema, fields, EXCLUDE
+from marshmallow import Schema, fields, validate, EXCLUDE
 from configops.changelog.elasticsearch_change import ElasticsearchChangelog
+from configops.changelog.changelog_utils import MAX_CHECKSUM_WORKERS
 from configops.utils.exception import ChangeLogException
 from configops.config import get_elasticsearch_cfg
 from flask import Blueprint, make_response, request, current_app
@@ -20,6 +21,29 @@ class ChangeSetSchema(Schema):
     count = fields.Int(required=False)
     contexts = fields.Str(required=False)
     vars = fields.Dict()
+    readOnly = fields.Bool(required=False)
+
+    class Meta:
+        unknown = EXCLUDE
+
+
+class PendingSummarySchema(Schema):
+    esId = fields.Str(required=True)
+    changeLogFile = fields.Str(required=True)
+    contexts = fields.Str(required=False)
+
+    class Meta:
+        unknown = EXCLUDE
+
+
+class SyncChangeSetSchema(Schema):
+    esId = fields.Str(required=True)
+    changeLogFile = fields.Str(required=True)
+    contexts = fields.Str(required=False)
+    changeSetIds = fields.List(fields.Str(), required=False)
+    workers = fields.Int(
+        load_default=1, validate=validate.Range(min=1, max=MAX_CHECKSUM_WORKERS)
+    )
 
     class Meta:
         unknown = EXCLUDE
@@ -42,7 +66,14 @@ def get_change_set():
         esChangeLog = ElasticsearchChangelog(
             changelog_file=changelogFile, app=current_app
         )
-        result = esChangeLog.fetch_multi(esId, count, contexts, variables, True)
+        result = esChangeLog.fetch_multi(
+            esId,
+            count,
+            contexts,
+            variables,
+            True,
+            read_only=data.get("readOnly", False),
+        )
         return result
     except ChangeLogException as err:
         logger.error("Elasticsearch changelog invalid.", exc_info=True)
@@ -69,3 +100,42 @@ def apply_change_set():
     except ChangeLogException as err:
         logger.error("Elasticsearch changelog invalid.", exc_info=True)
         return make_response(f"Elasticsearch changelog invalid. {str(err)}", 400)
+
+
+@bp.route("/elasticsearch/v1/sync_change_set", methods=["POST"])
+def sync_change_set():
+    """Mark change sets as executed without applying them"""
+    data = SyncChangeSetSchema().load(request.get_json())
+    esId = data.get("esId")
+    if get_elasticsearch_cfg(esId) is None:
+        return make_response(f"Elasticsearch id not found in config file: {esId}", 404)
+    try:
+        esChangeLog = ElasticsearchChangelog(
+            changelog_file=data.get("changeLogFile"), app=current_app
+        )
+        return esChangeLog.sync(
+            esId,
+            contexts=data.get("contexts"),
+            spec_changesets=data.get("changeSetIds"),
+            workers=data["workers"],
+        )
+    except ChangeLogException as err:
+        logger.error("Elasticsearch changelog invalid.", exc_info=True)
+        return make_response(f"Elasticsearch changelog invalid. {str(err)}", 400)
+
+
+@bp.route("/elasticsearch/v1/pending_summary", methods=["POST"])
+def pending_summary():
+    """Pending change set ids and counts, Elasticsearch is not contacted"""
+    data = PendingSummarySchema().load(request.get_json())
+    esId = data.get("esId")
+    if get_elasticsearch_cfg(esId) is None:
+        return make_response(f"Elasticsearch id not found in config file: {esId}", 404)
+    try:
+        esChangeLog = ElasticsearchChangelog(
+            changelog_file=data.get("changeLogFile"), app=current_app
+        )
+        return esChangeLog.pending_summary(esId, data.get("contexts"))
+    except ChangeLogException as err:
+        logger.error("Elasticsearch changelog invalid.", exc_info=True)
+        return make_response(f"Elasticsearch changelog invalid. {str(err)}", 400)
@@ -1,6 +1,7 @@
 import logging, os
-from marshmallow import Schema, fields, EXCLUDE
+from marshmallow import Schema, fields, validate, EXCLUDE
 from configops.changelog.graphdb_change import GraphdbChangelog
+from configops.changelog.changelog_utils import MAX_CHECKSUM_WORKERS
 from configops.utils.exception import ChangeLogException
 from configops.config import get_graphdb_cfg
 from flask import Blueprint, make_response, request, current_app
@@ -16,11 +17,58 @@ class ChangeSetSchema(Schema):
     count = fields.Int(required=False)
     contexts = fields.Str(required=False)
     vars = fields.Dict()
+    readOnly = fields.Bool(required=False)
 
     class Meta:
         unknown = EXCLUDE
 
 
+class PendingSummarySchema(Schema):
+    systemId = fields.Str(required=True)
+    changeLogFile = fields.Str(required=True)
+    contexts = fields.Str(required=False)
+
+    class Meta:
+        unknown = EXCLUDE
+
+
+class SyncChangeSetSchema(Schema):
+    systemId = fields.Str(required=True)
+    changeLogFile = fields.Str(required=True)
+    contexts = fields.Str(required=False)
+    changeSetIds = fields.List(fields.Str(), required=False)
+    workers = fields.Int(
+        load_default=1, validate=validate.Range(min=1, max=MAX_CHECKSUM_WORKERS)
+    )
+
+    class Meta:
+        unknown = EXCLUDE
+
+
+@bp.route("/graphdb/v1/get_change_set", methods=["POST"])
+def get_change_set():
+    data = ChangeSetSchema().load(request.get_json())
+    system_id = data.get("systemId")
+    cfg = get_graphdb_cfg(system_id)
+    if cfg is None:
+        return make_response(f"Graphdb id not found in config file: {system_id}", 404)
+    try:
+        graphdb_changelog = GraphdbChangelog(
+            changelog_file=data.get("changeLogFile"), app=current_app
+        )
+        return graphdb_changelog.fetch_multi(
+            system_id,
+            data.get("count", 0),
+            data.get("contexts"),
+            data.get("vars", {}),
+            True,
+            read_only=data.get("readOnly", False),
+        )
+    except ChangeLogException as err:
+        logger.error("Graphdb changelog invalid.", exc_info=True)
+        return make_response(f"Graphdb changelog invalid. {str(err)}", 400)
+
+
 @bp.route("/graphdb/v1/apply_change_set", methods=["POST"])
 def apply_change_set():
     data = ChangeSetSchema().load(request.get_json())
@@ -42,3 +90,42 @@ def apply_change_set():
     except ChangeLogException as err:
         logger.error("Graphdb changelog invalid.", exc_info=True)
         return make_response(f"Graphdb changelog invalid. {str(err)}", 400)
+
+
+@bp.route("/graphdb/v1/sync_change_set", methods=["POST"])
+def sync_change_set():
+    """Mark change sets as executed without applying them"""
+    data = SyncChangeSetSchema().load(request.get_json())
+    system_id = data.get("systemId")
+    if get_graphdb_cfg(system_id) is None:
+        return make_response(f"Graphdb id not found in config file: {system_id}", 404)
+    try:
+        graphdb_changelog = GraphdbChangelog(
+            changelog_file=data.get("changeLogFile"), app=current_app
+        )
+        return graphdb_changelog.sync(
+            system_id,
+            contexts=data.get("contexts"),
+            spec_changesets=data.get("changeSetIds"),
+            workers=data["workers"],
+        )
+    except ChangeLogException as err:
+        logger.error("Graphdb changelog invalid.", exc_info=True)
+        return make_response(f"Graphdb changelog invalid. {str(err)}", 400)
+
+
+@bp.route("/graphdb/v1/pending_summary", methods=["POST"])
+def pending_summary():
+    """Pending change set ids and counts, the graph database is not contacted"""
+    data = PendingSummarySchema().load(request.get_json())
+    system_id = data.get("systemId")
+    if get_graphdb_cfg(system_id) is None:
+        return make_response(f"Graphdb id not found in config file: {system_id}", 404)
+    try:
+        graphdb_changelog = GraphdbChangelog(
+            changelog_file=data.get("changeLogFile"), app=current_app
+        )
+        return graphdb_changelog.pending_summary(system_id, data.get("contexts"))
+    except ChangeLogException as err:
+        logger.error("Graphdb changelog invalid.", exc_info=True)
+        return make_response(f"Graphdb changelog invalid. {str(err)}", 400)
@@ -1,9 +1,21 @@
 import logging, os
 from flask import Blueprint, make_response, request, current_app
-from marshmallow import Schema, fields, EXCLUDE
+from marshmallow import (
+    Schema,
+    fields,
+    validate,
+    EXCLUDE,
+    ValidationError,
+    validates_schema,
+)
 from configops.utils import nacos_client
-from configops.utils.exception import ChangeLogException
+from configops.utils.exception import (
+    ChangeLogException,
+    ChangePlanDriftException,
+    ChangePlanNotFoundException,
+)
 from configops.changelog.nacos_change import NacosChangeLog
+from configops.changelog.changelog_utils import MAX_CHECKSUM_WORKERS
 from configops.config import get_nacos_cfg
 
 bp = Blueprint("nacos", __name__, url_prefix=os.getenv("FLASK_APPLICATION_ROOT", "/"))
@@ -65,6 +77,31 @@ class GetChangeSetSchema(Schema):
     contexts = fields.Str(required=False)
     vars = fields.Dict()
     allowedDataIds = fields.List(fields.Str(), required=False)
+    readOnly = fields.Bool(required=False)
+    # Store the changes as a plan on the worker and return its id instead of contents
+    plan = fields.Bool(required=False)
+
+    class Meta:
+        unknown = EXCLUDE
+
+
+class SyncChangeSetSchema(Schema):
+    nacosId = fields.Str(required=True)
+    changeLogFile = fields.Str(required=True)
+    contexts = fields.Str(required=False)
+    changeSetIds = fields.List(fields.Str(), required=False)
+    workers = fields.Int(
+        load_default=1, validate=validate.Range(min=1, max=MAX_CHECKSUM_WORKERS)
+    )
+
+    class Meta:
+        unknown = EXCLUDE
+
+
+class PendingSummarySchema(Schema):
+    nacosId = fields.Str(required=True)
+    changeLogFile = fields.Str(required=True)
+    contexts = fields.Str(required=False)
 
     class Meta:
         unknown = EXCLUDE
@@ -73,13 +110,21 @@ class GetChangeSetSchema(Schema):
 class ApplyChangeSetSchema(Schema):
     nacosId = fields.Str(required=True)
     changeSetId = fields.Str(required=False)
-    changeSetIds = fields.List(fields.Str(), required=True)
-    changes = fields.List(fields.Nested(NacosConfigSchema), required=True)
+    changeSetIds = fields.List(fields.Str(), required=False)
+    changes = fields.List(fields.Nested(NacosConfigSchema), required=False)
     deleteChanges = fields.List(fields.Nested(NacosConfigSchema), required=False)
+    planId = fields.Str(required=False)
 
     class Meta:
         unknown = EXCLUDE
 
+    @validates_schema
+    def validate_changes(self, data, **kwargs):
+        if data.get("planId"):
+            return
+        if data.get("changeSetIds") is None or data.get("changes") is None:
+            raise ValidationError("planId, or changeSetIds and changes are required")
+
 
 @bp.route("/nacos/v1/get_change_set", methods=["POST"])
 def get_change_set():
@@ -102,6 +147,15 @@ def get_change_set():
 
     try:
         nacosChangeLog = NacosChangeLog(changelog_file=changelog_file, app=current_app)
+        if data.get("plan", False) and not data.get("readOnly", False):
+            return nacosChangeLog.create_plan(
+                client=client,
+                nacos_id=nacos_id,
+                count=count,
+                contexts=contexts,
+                vars=variables,
+                allowed_data_ids=allowed_data_ids,
+            )
         result = nacosChangeLog.fetch_multi(
             client=client,
             nacos_id=nacos_id,
@@ -109,6 +163,7 @@ def get_change_set():
             contexts=contexts,
             vars=variables,
             allowed_data_ids=allowed_data_ids,
+            read_only=data.get("readOnly", False),
         )
         keys = ["ids", "changes", "deleteChanges"]
         return dict(zip(keys, result))
@@ -137,10 +192,57 @@ def apply_change_set():
         password=nacos_cfg.get("password"),
     )
     try:
-        NacosChangeLog.apply_changes(
-            change_set_ids, nacos_id, client, changes, delete_changes
-        )
+        if data.get("planId"):
+            NacosChangeLog.apply_plan(data["planId"], nacos_id, client, current_app)
+        else:
+            NacosChangeLog.apply_changes(
+                change_set_ids, nacos_id, client, changes, delete_changes
+            )
+    except ChangePlanNotFoundException as ex:
+        return make_response(str(ex), 404)
+    except ChangePlanDriftException as ex:
+        logger.warning(str(ex))
+        return make_response(str(ex), 409)
     except Exception as ex:
         logger.error(f"Apply config error. {ex}", stack_info=True)
         return make_response(f"Apply config error:{str(ex)}", 500)
     return "OK"
+
+
+@bp.route("/nacos/v1/sync_change_set", methods=["POST"])
+def sync_change_set():
+    """Mark change sets as executed without applying them"""
+    data = SyncChangeSetSchema().load(request.get_json())
+    nacos_id = data["nacosId"]
+    if get_nacos_cfg(nacos_id) is None:
+        return make_response(f"Nacos ID not found in config file: {nacos_id}", 404)
+    try:
+        nacosChangeLog = NacosChangeLog(
+            changelog_file=data["changeLogFile"], app=current_app
+        )
+        return nacosChangeLog.sync(
+            nacos_id,
+            contexts=data.get("contexts"),
+            spec_changesets=data.get("changeSetIds"),
+            workers=data["workers"],
+        )
+    except ChangeLogException as err:
+        logger.error("Nacos changelog invalid.", exc_info=True)
+        return make_response(f"Nacos changelog invalid. {str(err)}", 400)
+
+
+@bp.route("/nacos/v1/pending_summary", methods=["POST"])
+def pending_summary():
+    """Pending change set ids and counts, Nacos is not contacted"""
+    data = PendingSummarySchema().load(request.get_json())
+    nacos_id = data["nacosId"]
+    if get_nacos_cfg(nacos_id) is None:
+        return make_response(f"Nacos ID not found in config file: {nacos_id}", 404)
+    try:
+        nacosChangeLog = NacosChangeLog(
+            changelog_file=data["changeLogFile"], app=current_app
+        )
+        return nacosChangeLog.pending_summary(nacos_id, data.get("contexts"))
+    except ChangeLogException as err:
+        logger.error("Nacos changelog invalid.", exc_info=True)
+        return make_response(f"Nacos changelog invalid. {str(err)}", 400)
@@ -18,12 +18,14 @@ from configops.api.admin import bp as admin_bp
 from configops.api.dashboard import bp as dashboard_bp
 from configops.api.web import bp as web_bp
 from configops.api.auth import init_app as auth_init_app
-from configops.config import load_config, get_node_cfg
+from configops.config import load_config, get_config, get_node_cfg
 from configops.utils import constants
 from configops.utils.logging_configurator import DefaultLoggingConfigurator
 from configops.database import db
+from configops.database.search import init_changelog_search
 from configops.cluster import controller as clueter_controller
 from configops.cluster import worker as clueter_worker
+from configops.changelog.elasticsearch_change import ElasticTaskPoller
 
 
 logger = logging.getLogger(__name__)
@@ -122,18 +124,27 @@ def create_app(config_file=None):
 
     db.init(app, node_config)
     auth_init_app(app)
+    if constants.NodeRole.WORKER.matches(node_config["role"]):
+        with app.app_context():
+            init_changelog_search(app, db.db.engine)
 
     if constants.NodeRole.CONTROLLER.matches(node_config["role"]):
+        # With a message queue, several controller processes can serve the cluster
+        redis_uri = get_config(app, "config.cluster.redis_uri")
         socketio = SocketIO(
             cors_allowed_origins="*",
             path=__get_socketio_path(),
             max_http_buffer_size=50 * 1024 * 1024,
+            message_queue=redis_uri,
         )
         app.config[constants.CONTROLLER_SOCKETIO] = socketio
-        clueter_controller.register(socketio, app)
+        controller = clueter_controller.register(socketio, app)
         socketio.init_app(app)
+        controller.start_background_tasks(socketio)
     else:
         clueter_worker.register(app)
+        if get_config(app, "elasticsearch"):
+            ElasticTaskPoller(app).start()
 
     logger.info(f"Flask static folder: {app.static_folder}")
     return app
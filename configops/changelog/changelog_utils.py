@@ -5,9 +5,14 @@ import hashlib
 import msgpack
 import base64
 import logging
-from configops.database.db import ConfigOpsChangeLog
+import os
+import sqlalchemy
+from concurrent.futures import ProcessPoolExecutor
+from configops.cluster import codec
+from configops.database.db import db, ConfigOpsChangeLog
 from configops.utils import config_handler
 from configops.utils.constants import ChangelogExeType, SystemType, UNKNOWN
+from configops.utils.exception import ChangeLogException
 from configops.utils.secret_util import encrypt_data, decrypt_data
 
 logger = logging.getLogger(__name__)
@@ -15,6 +20,24 @@ logger = logging.getLogger(__name__)
 CHECKSUM_VERSION_V0 = "0" # 手动将changeset置为success时，用的version
 CHECKSUM_VERSION_V1 = "1"
 CHECKSUM_VERSION_V2 = "2"
+# Change keys only telling how to execute a change, not part of its checksum
+EXECUTION_ONLY_KEYS = {
+    SystemType.ELASTICSEARCH: ("skipIfIdentical",),
+    SystemType.GRAPHDB: ("pipelined",),
+}
+
+# Max values of one IN list when syncing changelogs
+SYNC_CHUNK_SIZE = 500
+# Max processes computing checksums for one sync
+MAX_CHECKSUM_WORKERS = os.cpu_count() or 1
+
+# Plan status of a change set
+PLAN_NEW = "NEW"  # Never run
+PLAN_FAILED = "FAILED"  # Failed or not finished (INIT)
+PLAN_CHANGED = "CHANGED"  # Executed, runOnChange and changed since
+PLAN_RUNNING = "RUNNING"
+PLAN_EXECUTED = "EXECUTED"
+PLAN_PENDING = (PLAN_NEW, PLAN_FAILED, PLAN_CHANGED)
 
 
 def __clean_string__(value: str) -> str:
@@ -66,6 +89,8 @@ def get_change_set_checksum_v2(changes, system_type: SystemType) -> str:
         new_changes = []
         for change in changes:
             new_change = change.copy()
+            for key in EXECUTION_ONLY_KEYS[system_type]:
+                new_change.pop(key, None)
             body = change.get("body")
             if body:
                 new_change["body"] = __clean_string__(body)
@@ -74,6 +99,8 @@ def get_change_set_checksum_v2(changes, system_type: SystemType) -> str:
         new_changes = []
         for change in changes:
             new_change = change.copy()
+            for key in EXECUTION_ONLY_KEYS[system_type]:
+                new_change.pop(key, None)
             query = change.get("query")
             if query:
                 new_change["query"] = __clean_string__(query)
@@ -110,7 +137,11 @@ def get_edit_new_checksum(checksum:str, old_exectype:str, new_exectype:str) -> s
         return checksum
     pre_version_checksume = checksum.split(":")
     pre_checksum = pre_version_checksume[0] if len(pre_version_checksume) <= 1 else pre_version_checksume[1]
-    if (old_exectype == ChangelogExeType.FAILED.value or old_exectype == ChangelogExeType.INIT.value) and new_exectype == ChangelogExeType.EXECUTED.value:
+    if (
+        old_exectype == ChangelogExeType.FAILED.value
+        or old_exectype == ChangelogExeType.INIT.value
+        or old_exectype == ChangelogExeType.RUNNING.value
+    ) and new_exectype == ChangelogExeType.EXECUTED.value:
         # 表示跳过，重新设置version为0，下次执行时会重新计算checksum
         return CHECKSUM_VERSION_V0 + ":" + pre_checksum
     return checksum
@@ -145,3 +176,207 @@ def unpack_changes(changes_bytes: bytes, secret: Optional[str]):
         except Exception as e:
             logger.warning(f"Error decrypting changes: {e}")
     return msgpack.unpackb(changes_bytes, raw=True)
+
+
+def pack_plan(plan: dict, secret: Optional[str]) -> tuple[str, bytes]:
+    """
+    Compress (and encrypt if a secret is set) a plan artifact.
+
+    :return: (plan id, packed plan). The id is the sha256 of the plan content
+    """
+    payload = msgpack.packb(plan, use_bin_type=True)
+    plan_id = hashlib.sha256(payload).hexdigest()
+    # zlib, so any worker can read the plan whether zstandard is installed or not
+    packed_data = codec.encode(
+        plan, codec.CODEC_MSGPACK, codec.COMPRESSION_ZLIB, threshold=0
+    )
+    if secret:
+        packed_data = encrypt_data(packed_data, base64.b64decode(secret))
+    return plan_id, packed_data
+
+
+def unpack_plan(plan_bytes: bytes, secret: Optional[str]) -> dict:
+    if secret:
+        plan_bytes = decrypt_data(plan_bytes, base64.b64decode(secret))
+    return codec.decode(plan_bytes)
+
+
+def _checksum_job(args):
+    changes, system_type_name = args
+    return get_change_set_checksum_v2(changes, SystemType[system_type_name])
+
+
+def compute_checksums(change_sets: list, system_type: SystemType, workers: int = 1):
+    """Checksums of the change sets, on a pool of processes if workers > 1."""
+    workers = min(workers, MAX_CHECKSUM_WORKERS)
+    if workers <= 1 or len(change_sets) < 2:
+        return [
+            get_change_set_checksum_v2(change_set["changes"], system_type)
+            for change_set in change_sets
+        ]
+    # Plain containers, the parsed YAML types are not worth pickling
+    jobs = [
+        (json.loads(json.dumps(change_set["changes"])), system_type.name)
+        for change_set in change_sets
+    ]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        chunksize = max(1, len(jobs) // (workers * 4))
+        return list(executor.map(_checksum_job, jobs, chunksize=chunksize))
+
+
+def _load_change_logs(system_id: str, system_type: SystemType, ids: list) -> dict:
+    return {
+        log.change_set_id: log
+        for log in db.session.execute(
+            sqlalchemy.select(
+                ConfigOpsChangeLog.id,
+                ConfigOpsChangeLog.change_set_id,
+                ConfigOpsChangeLog.exectype,
+                ConfigOpsChangeLog.checksum,
+                ConfigOpsChangeLog.filename,
+            ).where(
+                ConfigOpsChangeLog.system_id == system_id,
+                ConfigOpsChangeLog.system_type == system_type.value,
+                ConfigOpsChangeLog.change_set_id.in_(ids),
+            )
+        ).all()
+    }
+
+
+def sync_change_logs(
+    change_set_list: list,
+    system_id: str,
+    system_type: SystemType,
+    contexts: str = None,
+    spec_changesets: list = None,
+    workers: int = 1,
+) -> dict:
+    """
+    Record change sets as executed without running them, like Liquibase's
+    changelog-sync. Used to onboard targets whose history was applied by other means.
+
+    :return: Change set ids inserted, updated (not executed before) and unchanged
+    """
+    change_sets = [
+        change_set
+        for change_set in change_set_list
+        if is_ctx_included(contexts, change_set.get("context"))
+        and (not spec_changesets or str(change_set["id"]) in spec_changesets)
+    ]
+    checksums = compute_checksums(change_sets, system_type, workers)
+
+    result = {"inserted": [], "updated": [], "unchanged": []}
+    for i in range(0, len(change_sets), SYNC_CHUNK_SIZE):
+        chunk = change_sets[i : i + SYNC_CHUNK_SIZE]
+        chunk_checksums = checksums[i : i + SYNC_CHUNK_SIZE]
+        ids = [str(change_set["id"]) for change_set in chunk]
+        logs = _load_change_logs(system_id, system_type, ids)
+        inserts = []
+        updates = []
+        for change_set_id, change_set, checksum in zip(ids, chunk, chunk_checksums):
+            log = logs.get(change_set_id)
+            if log is None:
+                inserts.append(
+                    {
+                        "change_set_id": change_set_id,
+                        "system_id": system_id,
+                        "system_type": system_type.value,
+                        "exectype": ChangelogExeType.EXECUTED.value,
+                        "checksum": checksum,
+                        "author": change_set.get("author", ""),
+                        "comment": change_set.get("comment", ""),
+                        "filename": change_set.get("filename", ""),
+                    }
+                )
+                result["inserted"].append(change_set_id)
+                continue
+            if log.filename and log.filename != change_set.get("filename"):
+                raise ChangeLogException(
+                    f"ChangeSetId is already defined in an earlier changelog. changeSetId:{change_set_id}, Current file:{change_set.get('filename')}, previous file:{log.filename}"
+                )
+            if ChangelogExeType.RUNNING.matches(log.exectype):
+                raise ChangeLogException(
+                    f"This changeSetId is still running. Wait for it to finish or mark it as failed. changeSetId:{change_set_id}"
+                )
+            if ChangelogExeType.EXECUTED.matches(log.exectype) and log.checksum == checksum:
+                result["unchanged"].append(change_set_id)
+                continue
+            updates.append(
+                {
+                    "id": log.id,
+                    "exectype": ChangelogExeType.EXECUTED.value,
+                    "checksum": checksum,
+                }
+            )
+            result["updated"].append(change_set_id)
+        if inserts:
+            db.session.execute(sqlalchemy.insert(ConfigOpsChangeLog), inserts)
+        if updates:
+            db.session.execute(sqlalchemy.update(ConfigOpsChangeLog), updates)
+    db.session.commit()
+    return result
+
+
+def plan_change_sets(
+    change_sets: list, system_id: str, system_type: SystemType
+) -> dict:
+    """
+    Plan status of the change sets from their checksums and the changelog, the
+    same decision __check_change_log__ makes, without writing anything.
+
+    :return: change set id -> PLAN_* status
+    """
+    checksums = compute_checksums(change_sets, system_type)
+    statuses = {}
+    for i in range(0, len(change_sets), SYNC_CHUNK_SIZE):
+        chunk = change_sets[i : i + SYNC_CHUNK_SIZE]
+        ids = [str(change_set["id"]) for change_set in chunk]
+        logs = _load_change_logs(system_id, system_type, ids)
+        for change_set_id, change_set, checksum in zip(
+            ids, chunk, checksums[i : i + SYNC_CHUNK_SIZE]
+        ):
+            log = logs.get(change_set_id)
+            if log is None:
+                statuses[change_set_id] = PLAN_NEW
+                continue
+            if log.filename and log.filename != change_set.get("filename"):
+                raise ChangeLogException(
+                    f"ChangeSetId is already defined in an earlier changelog. changeSetId:{change_set_id}, Current file:{change_set.get('filename')}, previous file:{log.filename}"
+                )
+            if ChangelogExeType.RUNNING.matches(log.exectype):
+                statuses[change_set_id] = PLAN_RUNNING
+            elif ChangelogExeType.FAILED.matches(
+                log.exectype
+            ) or ChangelogExeType.INIT.matches(log.exectype):
+                statuses[change_set_id] = PLAN_FAILED
+            elif change_set.get("runOnChange", False) and is_changeset_changed(
+                log, checksum
+            ):
+                statuses[change_set_id] = PLAN_CHANGED
+            else:
+                statuses[change_set_id] = PLAN_EXECUTED
+    return statuses
+
+
+def pending_summary(
+    change_set_list: list,
+    system_id: str,
+    system_type: SystemType,
+    contexts: str = None,
+) -> dict:
+    """Pending change set ids and counts per plan status, the target is not contacted."""
+    change_sets = [
+        change_set
+        for change_set in change_set_list
+        if is_ctx_included(contexts, change_set.get("context"))
+    ]
+    statuses = plan_change_sets(change_sets, system_id, system_type)
+    counts = {}
+    for status in statuses.values():
+        counts[status] = counts.get(status, 0) + 1
+    pending = [
+        change_set_id
+        for change_set_id, status in statuses.items()
+        if status in PLAN_PENDING
+    ]
+    return {"pending": pending, "total": len(statuses), "counts": counts}
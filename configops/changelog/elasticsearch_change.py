@@ -1,15 +1,105 @@
-import logging, os, string, base64, requests, urllib
+import logging, os, string, base64, requests, urllib, time, json
+import threading
 import urllib.parse
+import sqlalchemy
+from datetime import timedelta
 from ruamel import yaml as ryaml
 from jsonschema import Draft7Validator, ValidationError
-from configops.changelog import changelog_utils
+from configops.changelog import changelog_utils, elasticsearch_planner
 from configops.utils import config_validator, secret_util
 from configops.utils.constants import ChangelogExeType, SystemType, extract_version
-from configops.database.db import db, ConfigOpsChangeLog, ConfigOpsChangeLogChanges
+from configops.database.db import (
+    db,
+    ConfigOpsChangeLog,
+    ConfigOpsChangeLogChanges,
+    ConfigOpsChangeLogTask,
+)
 from configops.utils.exception import ChangeLogException, ConfigOpsException
-from configops.config import get_config
+from configops.config import get_config, get_elasticsearch_cfg
 
 logger = logging.getLogger(__name__)
+
+# Long running endpoints which are submitted as tasks and polled through the _tasks api
+_TASK_ENDPOINTS = ("_reindex", "_update_by_query", "_delete_by_query", "_forcemerge")
+_TASK_POLL_INITIAL_INTERVAL = 1.0
+_TASK_POLL_MAX_INTERVAL = 30.0
+_TASK_POLL_BACKOFF = 1.5
+_TASK_POLL_MAX_ERRORS = 5
+_TASK_STATUS_RUNNING = "RUNNING"
+_TASK_STATUS_COMPLETED = "COMPLETED"
+# Change sets running longer than this without a task were abandoned by a crash
+_RUNNING_STALE_AFTER = 30 * 60
+# Tasks are settled by one thread at a time, their result is deleted once read
+_task_settle_lock = threading.Lock()
+
+
+def _canonical_scalar(value):
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if value is None:
+        return None
+    return str(value)
+
+
+def _flatten_settings(obj, prefix: str, out: dict):
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            _flatten_settings(value, f"{prefix}{key}.", out)
+    else:
+        key = prefix[:-1]
+        if key.startswith("index."):
+            key = key[len("index.") :]
+        if isinstance(obj, list):
+            out[key] = [_canonical_scalar(item) for item in obj]
+        else:
+            out[key] = _canonical_scalar(obj)
+    return out
+
+
+def _canonical(obj, settings: bool = False):
+    """
+    Canonical form of an elasticsearch resource body. Settings are flattened to
+    dotted keys without the "index." prefix, scalars are compared as strings
+    (elasticsearch echoes most settings back as strings) and empty values dropped.
+    """
+    if settings and isinstance(obj, dict):
+        return _flatten_settings(obj, "", {})
+    if isinstance(obj, dict):
+        result = {}
+        for key, value in obj.items():
+            value = _canonical(value, key == "settings")
+            if value is None or value == {} or value == []:
+                continue
+            result[key] = value
+        return result
+    if isinstance(obj, list):
+        return [_canonical(item) for item in obj]
+    return _canonical_scalar(obj)
+
+
+def _is_subset(expected, actual) -> bool:
+    if isinstance(expected, dict):
+        return isinstance(actual, dict) and all(
+            key in actual and _is_subset(value, actual[key])
+            for key, value in expected.items()
+        )
+    return expected == actual
+
+
+def is_identical_resource(body: dict, current: dict, merge: bool) -> bool:
+    """
+    Compare a change body with the current resource.
+
+    :param merge: The api merges the body into the resource (settings, mappings),
+        so the body only has to be contained in the current resource.
+    """
+    expected = _canonical(body)
+    actual = _canonical(current)
+    if merge:
+        return _is_subset(expected, actual)
+    return expected == actual
+
+
 schema = {
     "type": "object",
     "properties": {
@@ -61,6 +151,10 @@ schema = {
                                                 },
                                                 "path": {"type": "string"},
                                                 "body": {"type": "string"},
+                                                "skipIfIdentical": {
+                                                    "type": "boolean",
+                                                    "description": "Skip the write when the current template, pipeline, settings or mapping already matches the body",
+                                                },
                                             },
                                             "required": [
                                                 "method",
@@ -98,7 +192,11 @@ class ElasticsearchChangelog:
     def __init__(self, changelog_file=None, app=None):
         self.changelog_file = changelog_file
         self.app = app
-        self.__init_change_log__()
+        self.change_set_list = []
+        self.change_set_dict = {}
+        # Without a changelog file, e.g. to poll the tasks of earlier runs
+        if changelog_file is not None:
+            self.__init_change_log__()
 
     def __init_change_log__(self):
         changeSets = []
@@ -228,6 +326,10 @@ class ElasticsearchChangelog:
                 raise ChangeLogException(
                     f"This changeSetId is already defined in an earlier changelog. changeSetId:{change_set_id}, Current file:{current_filename}, previous file:{log.filename}"
                 )
+            if ChangelogExeType.RUNNING.matches(log.exectype):
+                raise ChangeLogException(
+                    f"This changeSetId is still running. Wait for it to finish or mark it as failed. changeSetId:{change_set_id}"
+                )
             if ChangelogExeType.FAILED.matches(
                 log.exectype
             ) or ChangelogExeType.INIT.matches(log.exectype):
@@ -289,6 +391,33 @@ class ElasticsearchChangelog:
                 )
         return is_execute
 
+    def sync(
+        self,
+        elasticsearch_id: str,
+        contexts: str = None,
+        spec_changesets: list = None,
+        workers: int = 1,
+    ) -> dict:
+        """
+        Record the change sets as executed without applying them (changelog-sync)
+        """
+        return changelog_utils.sync_change_logs(
+            self.change_set_list,
+            elasticsearch_id,
+            SystemType.ELASTICSEARCH,
+            contexts,
+            spec_changesets,
+            workers,
+        )
+
+    def pending_summary(self, elasticsearch_id: str, contexts: str = None) -> dict:
+        """
+        Pending change set ids and counts, from checksums and the changelog only
+        """
+        return changelog_utils.pending_summary(
+            self.change_set_list, elasticsearch_id, SystemType.ELASTICSEARCH, contexts
+        )
+
     def fetch_multi(
         self,
         elasticsearch_id: str,
@@ -296,8 +425,25 @@ class ElasticsearchChangelog:
         contexts: str = None,
         vars: dict = {},
         check_log: bool = True,
+        read_only: bool = False,
     ):
+        """
+        :param read_only: Plan only, decide from the changelog without writing to it
+        """
         idx = 0
+        plan = None
+        if check_log and read_only:
+            plan = changelog_utils.plan_change_sets(
+                [
+                    change_set_obj
+                    for change_set_obj in self.change_set_list
+                    if changelog_utils.is_ctx_included(
+                        contexts, change_set_obj.get("context")
+                    )
+                ],
+                elasticsearch_id,
+                SystemType.ELASTICSEARCH,
+            )
         final_change_sets = []
         for change_set_obj in self.change_set_list:
             change_set_id = str(change_set_obj["id"])
@@ -308,7 +454,13 @@ class ElasticsearchChangelog:
 
             is_execute = True
 
-            if check_log:
+            if plan is not None:
+                if plan[change_set_id] == changelog_utils.PLAN_RUNNING:
+                    raise ChangeLogException(
+                        f"This changeSetId is still running. Wait for it to finish or mark it as failed. changeSetId:{change_set_id}"
+                    )
+                is_execute = plan[change_set_id] in changelog_utils.PLAN_PENDING
+            elif check_log:
                 is_execute = self.__check_change_log__(
                     change_set_obj, elasticsearch_id, contexts, vars
                 )
@@ -324,44 +476,51 @@ class ElasticsearchChangelog:
             if count > 0 and idx >= count:
                 break
 
-        if check_log:
+        if check_log and plan is None:
             db.session.commit()
 
         return final_change_sets
 
-    def __request__(self, cfg, method, path, data):
-        url = cfg.get("url")
-        hosts = url.split(",")
+    def __get_log__(self, elasticsearch_id: str, change_set_id: str):
+        return (
+            db.session.query(ConfigOpsChangeLog)
+            .filter_by(
+                change_set_id=change_set_id,
+                system_id=elasticsearch_id,
+                system_type=SystemType.ELASTICSEARCH.value,
+            )
+            .first()
+        )
 
+    def __auth_headers__(self, cfg) -> dict:
         username = cfg.get("username")
-        password = cfg.get("password")
         api_id = cfg.get("api_id")
-        api_key = cfg.get("api_key")
 
-        credentials_type = None
+        headers = {"Content-Type": "application/json"}
         if api_id:
-            credentials_type = 1
             secretData = secret_util.get_secret_data(cfg, "app_key")
             api_key = secretData.password
+            encoded_key = base64.b64encode(f"{api_id}:{api_key}".encode("utf-8")).decode(
+                "utf-8"
+            )
+            headers["Authorization"] = f"ApiKey {encoded_key}"
         elif username:
-            credentials_type = 2
             secretData = secret_util.get_secret_data(cfg, "password")
             password = secretData.password
+            encoded_key = base64.b64encode(
+                f"{username}:{password}".encode("utf-8")
+            ).decode("utf-8")
+            headers["Authorization"] = f"Basic {encoded_key}"
+        return headers
+
+    def __request__(self, cfg, method, path, data, headers: dict = None):
+        url = cfg.get("url")
+        hosts = url.split(",")
+        if headers is None:
+            headers = self.__auth_headers__(cfg)
 
         errorResponse = None
         for host in hosts:
-            headers = {"Content-Type": "application/json"}
-            if credentials_type == 1:
-                encoded_key = base64.b64encode(
-                    f"{api_id}:{api_key}".encode("utf-8")
-                ).decode("utf-8")
-                headers["Authorization"] = f"ApiKey {encoded_key}"
-            elif credentials_type == 2:
-                encoded_key = base64.b64encode(
-                    f"{username}:{password}".encode("utf-8")
-                ).decode("utf-8")
-                headers["Authorization"] = f"Basic {encoded_key}"
-
             response = requests.request(
                 method=method,
                 data=data,
@@ -379,6 +538,343 @@ class ElasticsearchChangelog:
             f"status_code: {errorResponse.status_code} , text: {errorResponse.text}"
         )
 
+    @staticmethod
+    def __is_task_request__(method: str, path: str) -> bool:
+        if method not in ("POST", "PUT"):
+            return False
+        parsed = urllib.parse.urlsplit(path)
+        segments = [item for item in parsed.path.split("/") if item]
+        if len(segments) == 0 or segments[-1] not in _TASK_ENDPOINTS:
+            return False
+        query = urllib.parse.parse_qs(parsed.query)
+        # Respect an explicit wait_for_completion in the changelog
+        return "wait_for_completion" not in query
+
+    def __submit_task__(self, es_cfg, headers: dict, change_set_id, method, path, data):
+        """
+        Submit a long running request as a task.
+
+        :return: (task id, response text). The task id is None if the endpoint
+            finished synchronously
+        """
+        parsed = urllib.parse.urlsplit(path)
+        query = parsed.query + "&" if parsed.query else ""
+        task_path = urllib.parse.urlunsplit(
+            parsed._replace(query=f"{query}wait_for_completion=false")
+        )
+        resp = self.__request__(
+            es_cfg, method=method, path=task_path, data=data, headers=headers
+        )
+        task_id = resp.json().get("task")
+        if task_id:
+            logger.info(
+                f"Elastic task submitted. changeSetId: {change_set_id}, path: {path}, task: {task_id}"
+            )
+        return task_id, resp.text
+
+    def __task_result__(self, es_cfg, headers: dict, task_id: str):
+        """
+        Get the result of a task. The result document stored in the .tasks index is
+        deleted once read.
+
+        :return: (task response, None if the task is still running; task status)
+        """
+        quoted_id = urllib.parse.quote(task_id, safe=":")
+        task_resp = self.__request__(
+            es_cfg,
+            method="GET",
+            path=f"/_tasks/{quoted_id}",
+            data=None,
+            headers=headers,
+        ).json()
+        status = task_resp.get("task", {}).get("status")
+        if status:
+            logger.info(f"Elastic task progress. task: {task_id}, status: {status}")
+        if not task_resp.get("completed", False):
+            return None, status
+
+        try:
+            self.__request__(
+                es_cfg,
+                method="DELETE",
+                path=f"/.tasks/_doc/{quoted_id}",
+                data=None,
+                headers=headers,
+            )
+        except Exception as e:
+            logger.warning(f"Delete elastic task result error. task: {task_id}. {e}")
+
+        error = task_resp.get("error")
+        response = task_resp.get("response", {})
+        failures = response.get("failures") if isinstance(response, dict) else None
+        if error or failures:
+            raise ConfigOpsException(
+                f"Elastic task failed. task: {task_id}, error: {json.dumps(error or failures)}"
+            )
+        return json.dumps(response), status
+
+    def __run_task__(self, es_cfg, headers: dict, change_set_id, method, path, data):
+        """
+        Submit a long running request as a task and poll the _tasks api until it ends.
+        Only used when the changelog is not checked, tracked change sets do not wait
+        for their tasks (see __poll_task__).
+        """
+        task_id, message = self.__submit_task__(
+            es_cfg, headers, change_set_id, method, path, data
+        )
+        if not task_id:
+            # The endpoint finished synchronously
+            return message
+
+        interval = _TASK_POLL_INITIAL_INTERVAL
+        errors = 0
+        while True:
+            time.sleep(interval)
+            interval = min(interval * _TASK_POLL_BACKOFF, _TASK_POLL_MAX_INTERVAL)
+            try:
+                message, _ = self.__task_result__(es_cfg, headers, task_id)
+                errors = 0
+            except requests.RequestException as e:
+                errors += 1
+                if errors >= _TASK_POLL_MAX_ERRORS:
+                    raise ConfigOpsException(
+                        f"Poll elastic task error. task: {task_id}. {e}"
+                    )
+                logger.warning(f"Poll elastic task error, retry. task: {task_id}. {e}")
+                continue
+            if message is not None:
+                return message
+
+    def __get_task__(self, elasticsearch_id: str, change_set_id: str):
+        return (
+            db.session.query(ConfigOpsChangeLogTask)
+            .filter_by(
+                change_set_id=change_set_id,
+                system_id=elasticsearch_id,
+                system_type=SystemType.ELASTICSEARCH.value,
+            )
+            .first()
+        )
+
+    def __reconcile_running__(
+        self, es_cfg, headers: dict, elasticsearch_id: str
+    ) -> list:
+        """
+        Settle the change sets left running by an earlier run. Change sets whose task
+        completed are run again from the change after the task, those whose task
+        failed, or which were abandoned without a task, are marked as failed.
+
+        :return: The tasks still running
+        """
+        logs = (
+            db.session.query(ConfigOpsChangeLog)
+            .filter_by(
+                system_id=elasticsearch_id,
+                system_type=SystemType.ELASTICSEARCH.value,
+                exectype=ChangelogExeType.RUNNING.value,
+            )
+            .all()
+        )
+        if len(logs) == 0:
+            return []
+        running = []
+        stale_before = db.session.scalar(
+            sqlalchemy.select(sqlalchemy.func.now())
+        ) - timedelta(seconds=_RUNNING_STALE_AFTER)
+        for log in logs:
+            task = self.__get_task__(elasticsearch_id, log.change_set_id)
+            if task is None or task.status != _TASK_STATUS_RUNNING:
+                if log.updated_at is not None and log.updated_at < stale_before:
+                    logger.warning(
+                        f"Change set left running, mark it as failed. changeSetId: {log.change_set_id}"
+                    )
+                    log.exectype = ChangelogExeType.FAILED.value
+                continue
+            try:
+                if not self.__poll_task__(es_cfg, headers, task):
+                    running.append(task)
+            except requests.RequestException as e:
+                logger.warning(
+                    f"Poll elastic task error. changeSetId: {log.change_set_id}, task: {task.task_id}. {e}"
+                )
+        db.session.commit()
+        return running
+
+    def __poll_task__(self, es_cfg, headers: dict, task) -> bool:
+        """
+        Poll the elastic task of a change set once and record its progress. A task
+        which ended settles its change set: executed if the task was its last change,
+        failed if the task failed, otherwise pending and resumed after the task by
+        the next apply.
+
+        :return: True once the task is settled
+        :raise requests.RequestException: The task could not be polled
+        """
+        with _task_settle_lock:
+            task = db.session.get(
+                ConfigOpsChangeLogTask, task.id, populate_existing=True
+            )
+            if task is None or task.status != _TASK_STATUS_RUNNING:
+                # Settled by another thread or process
+                return True
+            log = self.__get_log__(task.system_id, task.change_set_id)
+            try:
+                message, status = self.__task_result__(es_cfg, headers, task.task_id)
+            except requests.RequestException:
+                raise
+            except Exception as e:
+                db.session.rollback()
+                task = db.session.get(ConfigOpsChangeLogTask, task.id)
+                if task is None or task.status != _TASK_STATUS_RUNNING:
+                    return True
+                logger.error(
+                    f"Elastic task of change set failed. changeSetId: {task.change_set_id}, task: {task.task_id}. {e}"
+                )
+                if log is not None:
+                    log.exectype = ChangelogExeType.FAILED.value
+                db.session.delete(task)
+                db.session.commit()
+                return True
+            if status is not None:
+                task.progress = json.dumps(status)
+            if message is None:
+                db.session.commit()
+                return False
+            logger.info(
+                f"Elastic task of change set completed. changeSetId: {task.change_set_id}, task: {task.task_id}"
+            )
+            if log is None:
+                db.session.delete(task)
+            elif task.change_count and task.change_index + 1 >= task.change_count:
+                log.exectype = ChangelogExeType.EXECUTED.value
+                db.session.delete(task)
+            else:
+                task.status = _TASK_STATUS_COMPLETED
+                # Picked up again by fetch_multi, and resumed after the task
+                log.exectype = ChangelogExeType.INIT.value
+            db.session.commit()
+            return True
+
+    def __current_resources__(self, es_cfg, headers: dict, path: str):
+        """
+        Fetch the current state of the resource a write change targets.
+
+        :return: (resources, merge) or None when the path is not supported
+        """
+        parsed = urllib.parse.urlsplit(path)
+        segments = [item for item in parsed.path.split("/") if item]
+        if len(segments) == 0:
+            return None
+
+        if len(segments) == 2 and segments[0] in (
+            "_index_template",
+            "_component_template",
+        ):
+            key = segments[0][1:] + "s"
+            resp = self.__request__(es_cfg, "GET", parsed.path, None, headers).json()
+            items = resp.get(key, [])
+            if len(items) != 1:
+                return None
+            return [items[0].get(segments[0][1:])], False
+        if len(segments) == 2 and segments[0] == "_template":
+            resp = self.__request__(es_cfg, "GET", parsed.path, None, headers).json()
+            return [resp.get(segments[1])], False
+        if len(segments) == 3 and segments[0] == "_ingest" and segments[1] == "pipeline":
+            resp = self.__request__(es_cfg, "GET", parsed.path, None, headers).json()
+            return [resp.get(segments[2])], False
+        if segments[-1] in ("_settings", "_mapping", "_mappings") and len(segments) <= 2:
+            resp = self.__request__(es_cfg, "GET", parsed.path, None, headers).json()
+            if len(resp) == 0:
+                return None
+            if segments[-1] == "_settings":
+                return [item.get("settings") for item in resp.values()], True
+            return [item.get("mappings") for item in resp.values()], True
+        return None
+
+    def __is_identical__(self, es_cfg, headers: dict, method: str, path: str, body):
+        if method not in ("PUT", "POST") or not body:
+            return False
+        try:
+            current = self.__current_resources__(es_cfg, headers, path)
+            if current is None:
+                return False
+            resources, merge = current
+            body_obj = json.loads(body)
+            if urllib.parse.urlsplit(path).path.rstrip("/").endswith("_settings"):
+                # Settings are always compared in their flattened form
+                body_obj = {"settings": body_obj}
+                resources = [{"settings": item} for item in resources]
+            return all(
+                item is not None and is_identical_resource(body_obj, item, merge)
+                for item in resources
+            )
+        except Exception as e:
+            # Not found or not comparable, apply the change
+            logger.debug(f"Can not compare elastic resource. path: {path}. {e}")
+            return False
+
+    def __apply_change_set__(
+        self, es_cfg, headers: dict, changeSet, track_tasks: bool = False
+    ):
+        """
+        :param track_tasks: Do not wait for tasks, raise ChangeSetPending once a task
+            is submitted
+        """
+        change_set_id = str(changeSet["id"])
+        resume_from = changeSet.get("resumeFrom", 0)
+        for idx, change in enumerate(changeSet["changes"]):
+            if idx < resume_from:
+                change["success"] = True
+                change["message"] = "Applied by an earlier run"
+                continue
+            path = change["path"]
+            method = change["method"]
+            body = change.get("body")
+            try:
+                data = None
+                if body:
+                    data = body.encode("utf-8")
+                if change.get(
+                    "skipIfIdentical", es_cfg.get("skip_if_identical", False)
+                ) and self.__is_identical__(es_cfg, headers, method, path, body):
+                    logger.info(
+                        f"Skip identical elastic resource. changeSetId: {change_set_id}, path: {path}, method: {method}"
+                    )
+                    change["success"] = True
+                    change["skipped"] = True
+                    change["message"] = "Skipped, the resource is already identical"
+                    continue
+                if self.__is_task_request__(method, path) and track_tasks:
+                    task_id, message = self.__submit_task__(
+                        es_cfg, headers, change_set_id, method, path, data
+                    )
+                    if task_id:
+                        change["running"] = True
+                        change["task"] = task_id
+                        change["message"] = f"Submitted as elastic task: {task_id}"
+                        raise elasticsearch_planner.ChangeSetPending(idx, task_id)
+                elif self.__is_task_request__(method, path):
+                    message = self.__run_task__(
+                        es_cfg, headers, change_set_id, method, path, data
+                    )
+                else:
+                    resp = self.__request__(
+                        es_cfg, method=method, path=path, data=data, headers=headers
+                    )
+                    message = resp.text
+                change["success"] = True
+                change["message"] = f"{message}"
+            except elasticsearch_planner.ChangeSetPending:
+                raise
+            except Exception as e:
+                logger.error(
+                    f"Execute elastic request error. changeSetId: {change_set_id}, path: {path}, method: {method}. {e}",
+                    exc_info=True,
+                )
+                change["success"] = False
+                change["message"] = str(e)
+                raise ConfigOpsException(str(e))
+
     def apply(
         self,
         es_cfg,
@@ -388,53 +884,158 @@ class ElasticsearchChangelog:
         vars: dict = {},
         check_log: bool = True,
     ):
+        # Resolve credentials once, change sets may run on pool threads
+        headers = self.__auth_headers__(es_cfg)
+        if check_log:
+            running = self.__reconcile_running__(es_cfg, headers, elasticsearch_id)
+            if len(running) > 0:
+                # Later change sets may depend on them, run nothing until they end
+                return [
+                    {
+                        "id": task.change_set_id,
+                        "running": True,
+                        "task": task.task_id,
+                        "changeIndex": task.change_index,
+                    }
+                    for task in running
+                ]
+
         changeSets = self.fetch_multi(
             elasticsearch_id, count, contexts, vars, check_log
         )
         if len(changeSets) == 0:
             return []
 
-        for changeSet in changeSets:
-            try:
+        if check_log:
+            for changeSet in changeSets:
                 change_set_id = str(changeSet["id"])
-                changes = changeSet["changes"]
-                log = None
-                if check_log:
-                    log = (
-                        db.session.query(ConfigOpsChangeLog)
-                        .filter_by(
-                            change_set_id=change_set_id,
+                task = self.__get_task__(elasticsearch_id, change_set_id)
+                if task is None:
+                    continue
+                log = self.__get_log__(elasticsearch_id, change_set_id)
+                if (
+                    task.status == _TASK_STATUS_COMPLETED
+                    and log is not None
+                    and log.checksum == task.checksum
+                ):
+                    changeSet["resumeFrom"] = task.change_index + 1
+                else:
+                    # The change set changed since, run it again from the start
+                    db.session.delete(task)
+            db.session.commit()
+
+        def get_log(changeSet):
+            if not check_log:
+                return None
+            return self.__get_log__(elasticsearch_id, str(changeSet["id"]))
+
+        def on_start(changeSet):
+            log = get_log(changeSet)
+            if log:
+                # Stays running until every change (and elastic task) has finished
+                log.exectype = ChangelogExeType.RUNNING.value
+                db.session.commit()
+
+        def on_complete(changeSet, error):
+            try:
+                log = get_log(changeSet)
+                if log is None:
+                    return
+                task = self.__get_task__(elasticsearch_id, log.change_set_id)
+                if isinstance(error, elasticsearch_planner.ChangeSetPending):
+                    # Stays running, settled by ElasticTaskPoller or a later run
+                    if task is None:
+                        task = ConfigOpsChangeLogTask(
+                            change_set_id=log.change_set_id,
                             system_id=elasticsearch_id,
                             system_type=SystemType.ELASTICSEARCH.value,
                         )
-                        .first()
-                    )
-                for change in changes:
-                    path = change["path"]
-                    method = change["method"]
-                    body = change.get("body")
-                    try:
-                        data = None
-                        if body:
-                            data = body.encode("utf-8")
-                        resp = self.__request__(
-                            es_cfg, method=method, path=path, data=data
-                        )
-                        change["success"] = True
-                        change["message"] = f"{resp.text}"
-                    except Exception as e:
-                        logger.error(
-                            f"Execute elastic request error. changeSetId: {change_set_id}, path: {path}, method: {method}. {e}",
-                            exc_info=True,
-                        )
-                        change["success"] = False
-                        change["message"] = str(e)
-                        raise ConfigOpsException(str(e))
-                if log:
+                        db.session.add(task)
+                    task.change_index = error.change_index
+                    task.task_id = error.task_id
+                    task.status = _TASK_STATUS_RUNNING
+                    task.checksum = log.checksum
+                    task.change_count = len(changeSet["changes"])
+                    task.progress = None
+                    return
+                if task is not None:
+                    db.session.delete(task)
+                if error is None:
                     log.exectype = ChangelogExeType.EXECUTED.value
-            except ConfigOpsException as e:
-                if log:
+                else:
                     log.exectype = ChangelogExeType.FAILED.value
             finally:
                 db.session.commit()
+
+        elasticsearch_planner.execute_plan(
+            changeSets,
+            lambda changeSet: self.__apply_change_set__(
+                es_cfg, headers, changeSet, check_log
+            ),
+            on_complete,
+            es_cfg.get("concurrency", 1),
+            on_start,
+        )
         return changeSets
+
+
+class ElasticTaskPoller:
+    """
+    Worker background thread settling the elastic tasks of tracked change sets, so
+    a finished task does not wait for the next apply. Each task is polled with
+    backoff, its progress is recorded on its CONFIGOPS_CHANGE_LOG_TASK row.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.changelog = ElasticsearchChangelog(app=app)
+        self._schedule = {}  # task row id -> (next poll at, interval)
+        self._stop = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self.run, name="es-task-poller", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self):
+        while not self._stop.wait(_TASK_POLL_INITIAL_INTERVAL):
+            try:
+                with self.app.app_context():
+                    self.poll()
+            except Exception as e:
+                logger.error(f"Poll elastic tasks error. {e}", exc_info=True)
+
+    def poll(self, now: float = None):
+        """Poll the running tasks which are due."""
+        now = time.monotonic() if now is None else now
+        tasks = (
+            db.session.query(ConfigOpsChangeLogTask)
+            .filter_by(
+                system_type=SystemType.ELASTICSEARCH.value,
+                status=_TASK_STATUS_RUNNING,
+            )
+            .all()
+        )
+        schedule = {}
+        for task in tasks:
+            next_poll, interval = self._schedule.get(
+                task.id, (now, _TASK_POLL_INITIAL_INTERVAL)
+            )
+            if next_poll > now:
+                schedule[task.id] = (next_poll, interval)
+                continue
+            es_cfg = get_elasticsearch_cfg(task.system_id)
+            if es_cfg is None:
+                continue
+            try:
+                headers = self.changelog.__auth_headers__(es_cfg)
+                if self.changelog.__poll_task__(es_cfg, headers, task):
+                    continue
+            except requests.RequestException as e:
+                logger.warning(f"Poll elastic task error. task: {task.task_id}. {e}")
+            schedule[task.id] = (
+                now + interval,
+                min(interval * _TASK_POLL_BACKOFF, _TASK_POLL_MAX_INTERVAL),
+            )
+        self._schedule = schedule
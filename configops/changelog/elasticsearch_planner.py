@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+"""
+Execution planning for elasticsearch change sets.
+
+Every change is mapped to the resources it touches (indices/aliases/data streams,
+templates, pipelines, ...). A change set depends on every earlier change set that
+touches a conflicting resource, so change sets on unrelated resources can run
+concurrently while the changelog order is preserved per resource.
+"""
+import json
+import logging
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from fnmatch import fnmatchcase
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+KIND_INDEX = "index"
+KIND_TEMPLATE = "template"
+KIND_COMPONENT_TEMPLATE = "component_template"
+KIND_PIPELINE = "pipeline"
+KIND_POLICY = "policy"
+KIND_GLOBAL = "*"
+
+WILDCARD = "*"
+
+GLOBAL_KEY = (KIND_GLOBAL, WILDCARD)
+
+
+class ChangeSetPending(Exception):
+    """
+    Raised by a change set that submitted a long running task and finishes later.
+    Change sets depending on it are not run.
+    """
+
+    def __init__(self, change_index: int, task_id: str):
+        super().__init__(f"Waiting for task {task_id}")
+        self.change_index = change_index
+        self.task_id = task_id
+
+
+def _is_pattern(name: str) -> bool:
+    return "*" in name or "?" in name
+
+
+def _literal_prefix(pattern: str) -> str:
+    for idx, char in enumerate(pattern):
+        if char in "*?[":
+            return pattern[:idx]
+    return pattern
+
+
+def _index_keys(expression: str) -> set:
+    keys = set()
+    for name in expression.split(","):
+        name = name.strip()
+        if not name:
+            continue
+        if name.startswith("<") or name.startswith("-") or name in ("_all",):
+            # Date math and exclusions can not be resolved locally
+            return {(KIND_INDEX, WILDCARD)}
+        keys.add((KIND_INDEX, name))
+    return keys if keys else {(KIND_INDEX, WILDCARD)}
+
+
+def _load_body(body) -> Optional[dict]:
+    if not body:
+        return None
+    if isinstance(body, dict):
+        return body
+    try:
+        obj = json.loads(body)
+    except (TypeError, ValueError):
+        return None
+    return obj if isinstance(obj, dict) else None
+
+
+def _body_references(obj, keys: set):
+    """Collect pipelines, lifecycle policies and component templates referenced by a body."""
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            if isinstance(value, str):
+                if key.endswith("default_pipeline") or key.endswith("final_pipeline"):
+                    keys.add((KIND_PIPELINE, value))
+                elif key == "lifecycle.name" or key.endswith(".lifecycle.name"):
+                    keys.add((KIND_POLICY, value))
+            elif key == "lifecycle" and isinstance(value, dict):
+                name = value.get("name")
+                if isinstance(name, str):
+                    keys.add((KIND_POLICY, name))
+                _body_references(value, keys)
+            elif key == "composed_of" and isinstance(value, list):
+                for item in value:
+                    if isinstance(item, str):
+                        keys.add((KIND_COMPONENT_TEMPLATE, item))
+            else:
+                _body_references(value, keys)
+    elif isinstance(obj, list):
+        for item in obj:
+            _body_references(item, keys)
+
+
+def _template_keys(kind: str, name: str, body_obj: Optional[dict]) -> set:
+    keys = {(kind, name)}
+    if body_obj is None:
+        # Without a body (e.g. DELETE) the matched indices are unknown
+        keys.add((KIND_INDEX, WILDCARD))
+        return keys
+    patterns = body_obj.get("index_patterns")
+    if isinstance(patterns, str):
+        patterns = [patterns]
+    if patterns:
+        for pattern in patterns:
+            keys.add((KIND_INDEX, str(pattern)))
+    else:
+        keys.add((KIND_INDEX, WILDCARD))
+    _body_references(body_obj, keys)
+    return keys
+
+
+def get_resource_keys(path: str, body=None) -> set:
+    """
+    Derive the resource keys a change touches from its path (and body).
+
+    :param path: The elasticsearch api path, e.g. /my_index/_settings
+    :param body: The request body
+    :return: A set of (kind, name) tuples. Names may be wildcard patterns.
+    """
+    path = urllib.parse.urlsplit(path or "").path
+    parts = [urllib.parse.unquote(item) for item in path.split("/") if item]
+    if len(parts) == 0:
+        return {GLOBAL_KEY}
+
+    body_obj = _load_body(body)
+    head = parts[0]
+    if not head.startswith("_"):
+        keys = _index_keys(head)
+        if len(parts) >= 3 and parts[1] in ("_alias", "_aliases"):
+            keys |= _index_keys(parts[2])
+        if body_obj is not None and len(parts) == 1:
+            # Index creation: settings may reference pipelines and policies
+            _body_references(body_obj, keys)
+            aliases = body_obj.get("aliases")
+            if isinstance(aliases, dict):
+                for alias in aliases:
+                    keys.add((KIND_INDEX, alias))
+        elif body_obj is not None and len(parts) >= 2 and parts[1] == "_settings":
+            _body_references(body_obj, keys)
+        return keys
+
+    if head in ("_index_template", "_template") and len(parts) >= 2:
+        return _template_keys(KIND_TEMPLATE, parts[1], body_obj)
+    if head == "_component_template" and len(parts) >= 2:
+        # Affects every index created later through a composing template
+        keys = {(KIND_COMPONENT_TEMPLATE, parts[1]), (KIND_INDEX, WILDCARD)}
+        if body_obj is not None:
+            _body_references(body_obj, keys)
+        return keys
+    if head == "_ingest" and len(parts) >= 3 and parts[1] == "pipeline":
+        return {(KIND_PIPELINE, parts[2])}
+    if head == "_ilm" and len(parts) >= 3 and parts[1] == "policy":
+        return {(KIND_POLICY, parts[2])}
+    if head == "_data_stream" and len(parts) >= 2:
+        return _index_keys(parts[1])
+    if head == "_alias" and len(parts) >= 2:
+        return _index_keys(parts[1])
+    if head == "_reindex" and body_obj is not None:
+        source = body_obj.get("source", {})
+        dest = body_obj.get("dest", {})
+        source_index = source.get("index") if isinstance(source, dict) else None
+        dest_index = dest.get("index") if isinstance(dest, dict) else None
+        if isinstance(source_index, list):
+            source_index = ",".join(source_index)
+        if source_index and dest_index:
+            keys = _index_keys(str(source_index)) | _index_keys(str(dest_index))
+            if isinstance(dest, dict) and isinstance(dest.get("pipeline"), str):
+                keys.add((KIND_PIPELINE, dest["pipeline"]))
+            return keys
+    # _aliases, _bulk, _cluster, _snapshot, ... may touch anything
+    return {GLOBAL_KEY}
+
+
+def get_change_set_resource_keys(change_set) -> set:
+    keys = set()
+    for change in change_set["changes"]:
+        keys |= get_resource_keys(change.get("path"), change.get("body"))
+    return keys
+
+
+def is_conflict(key_a: tuple, key_b: tuple) -> bool:
+    """Two resource keys conflict if they may address the same resource."""
+    if key_a[0] == KIND_GLOBAL or key_b[0] == KIND_GLOBAL:
+        return True
+    if key_a[0] != key_b[0]:
+        return False
+    name_a, name_b = key_a[1], key_b[1]
+    if name_a == name_b:
+        return True
+    pattern_a, pattern_b = _is_pattern(name_a), _is_pattern(name_b)
+    if pattern_a and pattern_b:
+        # Two patterns may overlap unless their literal prefixes diverge
+        prefix_a, prefix_b = _literal_prefix(name_a), _literal_prefix(name_b)
+        return prefix_a.startswith(prefix_b) or prefix_b.startswith(prefix_a)
+    if pattern_a:
+        return fnmatchcase(name_b, name_a)
+    if pattern_b:
+        return fnmatchcase(name_a, name_b)
+    return False
+
+
+def build_dependencies(change_sets: list) -> list:
+    """
+    Build the dependency graph of change sets.
+
+    :return: For every change set, the set of indexes of the earlier change sets it depends on.
+    """
+    dependencies = []
+    # Last change set that wrote each key. Earlier writers of the same key are
+    # ancestors of the last one, so depending on the last writer is enough.
+    last_writers = {}
+    for idx, change_set in enumerate(change_sets):
+        keys = get_change_set_resource_keys(change_set)
+        deps = set()
+        for key in keys:
+            exact = last_writers.get(key)
+            if exact is not None:
+                deps.add(exact)
+            for written_key, writer in last_writers.items():
+                if writer not in deps and is_conflict(key, written_key):
+                    deps.add(writer)
+        if GLOBAL_KEY in keys:
+            last_writers = {}
+        for key in keys:
+            last_writers[key] = idx
+        dependencies.append(deps)
+    return dependencies
+
+
+def _run(func: Callable, change_set) -> Optional[Exception]:
+    try:
+        func(change_set)
+        return None
+    except Exception as e:
+        return e
+
+
+def execute_plan(
+    change_sets: list,
+    run_change_set: Callable,
+    on_complete: Callable,
+    concurrency: int = 1,
+    on_start: Callable = None,
+):
+    """
+    Execute change sets, independent ones concurrently.
+
+    :param change_sets: The change sets in changelog order
+    :param run_change_set: Executes one change set. Invoked on pool threads when concurrency > 1,
+        so it must not touch the database session.
+    :param on_complete: Called with (change_set, error) on the calling thread, in dependency order.
+    :param concurrency: Max number of change sets running at the same time
+    :param on_start: Called with (change_set) on the calling thread before a change set starts.
+    """
+    if concurrency is None or concurrency <= 1 or len(change_sets) <= 1:
+        for change_set in change_sets:
+            if on_start:
+                on_start(change_set)
+            error = _run(run_change_set, change_set)
+            on_complete(change_set, error)
+            if isinstance(error, ChangeSetPending):
+                # The later change sets may depend on it
+                break
+        return
+
+    dependencies = build_dependencies(change_sets)
+    dependents = [[] for _ in change_sets]
+    for idx, deps in enumerate(dependencies):
+        for dep in deps:
+            dependents[dep].append(idx)
+    remaining = [len(deps) for deps in dependencies]
+
+    with ThreadPoolExecutor(
+        max_workers=concurrency, thread_name_prefix="es-changeset"
+    ) as executor:
+        running = {}
+
+        def submit(idx):
+            if on_start:
+                on_start(change_sets[idx])
+            future = executor.submit(_run, run_change_set, change_sets[idx])
+            running[future] = idx
+
+        for idx, count in enumerate(remaining):
+            if count == 0:
+                submit(idx)
+
+        while running:
+            done, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+            for future in done:
+                idx = running.pop(future)
+                error = future.result()
+                on_complete(change_sets[idx], error)
+                if isinstance(error, ChangeSetPending):
+                    continue
+                for dependent in dependents[idx]:
+                    remaining[dependent] -= 1
+                    if remaining[dependent] == 0:
+                        submit(dependent)
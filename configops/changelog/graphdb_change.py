@@ -73,6 +73,11 @@ schema = {
                                                     "description": "Dataset for query execution",
                                                 },
                                                 "query": {"type": "string"},
+                                                "pipelined": {
+                                                    "type": "boolean",
+                                                    "default": "false",
+                                                    "description": "The gremlin statements are independent and can be submitted without waiting for each other",
+                                                },
                                             },
                                             "required": [
                                                 "type",
@@ -285,6 +290,33 @@ class GraphdbChangelog:
                 )
         return is_execute
 
+    def sync(
+        self,
+        system_id: str,
+        contexts: str = None,
+        spec_changesets: list = None,
+        workers: int = 1,
+    ) -> dict:
+        """
+        Record the change sets as executed without applying them (changelog-sync)
+        """
+        return changelog_utils.sync_change_logs(
+            self.change_set_list,
+            system_id,
+            SystemType.GRAPHDB,
+            contexts,
+            spec_changesets,
+            workers,
+        )
+
+    def pending_summary(self, system_id: str, contexts: str = None) -> dict:
+        """
+        Pending change set ids and counts, from checksums and the changelog only
+        """
+        return changelog_utils.pending_summary(
+            self.change_set_list, system_id, SystemType.GRAPHDB, contexts
+        )
+
     def fetch_multi(
         self,
         system_id: str,
@@ -292,8 +324,25 @@ class GraphdbChangelog:
         contexts: str = None,
         vars: dict = {},
         check_log: bool = True,
+        read_only: bool = False,
     ):
+        """
+        :param read_only: Plan only, decide from the changelog without writing to it
+        """
         idx = 0
+        plan = None
+        if check_log and read_only:
+            plan = changelog_utils.plan_change_sets(
+                [
+                    change_set_obj
+                    for change_set_obj in self.change_set_list
+                    if changelog_utils.is_ctx_included(
+                        contexts, change_set_obj.get("context")
+                    )
+                ],
+                system_id,
+                SystemType.GRAPHDB,
+            )
         final_change_sets = []
         for change_set_obj in self.change_set_list:
             change_set_id = str(change_set_obj["id"])
@@ -304,7 +353,9 @@ class GraphdbChangelog:
 
             is_execute = True
 
-            if check_log:
+            if plan is not None:
+                is_execute = plan[change_set_id] in changelog_utils.PLAN_PENDING
+            elif check_log:
                 is_execute = self.__check_change_log__(
                     change_set_obj, system_id, contexts, vars
                 )
@@ -318,11 +369,33 @@ class GraphdbChangelog:
             if count > 0 and idx >= count:
                 break
 
-        if check_log:
+        if check_log and plan is None:
             db.session.commit()
 
         return final_change_sets
 
+    @staticmethod
+    def __batch_changes__(changes) -> list:
+        """
+        Merge consecutive openCypher or SPARQL changes on the same dataset, so the
+        executor can send them in one round trip (and one transaction where supported).
+
+        :return: A list of (first change, querys)
+        """
+        batches = []
+        for change in changes:
+            if batches:
+                previous, querys = batches[-1]
+                if (
+                    change["type"] in (OPEN_CYPHER, SPARQL)
+                    and previous["type"] == change["type"]
+                    and change.get("dataset") == previous.get("dataset")
+                ):
+                    querys.append(change["query"])
+                    continue
+            batches.append((change, [change["query"]]))
+        return batches
+
     def apply(
         self,
         system_cfg,
@@ -352,9 +425,8 @@ class GraphdbChangelog:
                         .first()
                     )
                 executor = graphdb_executor.get_executor(system_cfg["dialect"])
-                for change in changes:
+                for change, _querys in self.__batch_changes__(changes):
                     _type = change["type"]
-                    _querys = [change["query"]]
                     _dataset = change.get("dataset", None)
                     try:
                         if _type == SPARQL:
@@ -363,7 +435,10 @@ class GraphdbChangelog:
                             )
                         elif _type == GREMLIN:
                             executor.execute_gremlin(
-                                system_cfg, _querys, dataset=_dataset
+                                system_cfg,
+                                _querys,
+                                dataset=_dataset,
+                                pipelined=change.get("pipelined", False),
                             )
                         elif _type == OPEN_CYPHER:
                             executor.execute_opencypher(
@@ -1,18 +1,369 @@
 # -*- coding: utf-8 -*-
 # @Author  : Bruce Wu
 # @Time    : 2025/06/12 10:21
+import atexit
+import collections
+import hashlib
 import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
 import requests
 from gremlin_python.driver import client as gremlin_client
-import SPARQLWrapper
+from gremlin_python.driver.protocol import GremlinServerError
 from configops.utils import secret_util
 from configops.utils.exception import ChangeLogException
 from configops.utils.constants import GraphdbDialect
 
+try:
+    from rdflib.plugins.sparql.parser import parseUpdate as _parse_sparql_update
+except ImportError:
+    _parse_sparql_update = None
+
 logger = logging.getLogger(__name__)
 
 _AWS_NEPTUNEDB_SERVICE_NAME = "neptune-db"
 
+# Pooled gremlin clients not used for this long are closed
+_GREMLIN_CLIENT_IDLE_TIMEOUT = 300
+# Neptune checks the SigV4 headers signed when a client is created at every websocket
+# handshake, and signatures expire after 5 minutes. Its clients are replaced before.
+_NEPTUNE_CLIENT_MAX_AGE = 240
+# Default number of pipelined gremlin statements in flight, the client pool size
+_GREMLIN_MAX_IN_FLIGHT = 8
+# Default number of openCypher statements sent in one neo4j transactional request
+_OPENCYPHER_MAX_STATEMENTS_PER_REQUEST = 500
+
+# Default max size of one batched SPARQL update request
+_SPARQL_MAX_UPDATE_BYTES = 1024 * 1024
+_SPARQL_UPDATE_SEPARATOR = " ;\n"
+# Separators ending an operation, batching adds its own
+_SPARQL_TRAILING_SEPARATORS = re.compile(r"[\s;]+$")
+
+_SPARQL_UPDATE_KEYWORDS = (
+    "INSERT",
+    "DELETE",
+    "LOAD",
+    "CLEAR",
+    "CREATE",
+    "DROP",
+    "COPY",
+    "MOVE",
+    "ADD",
+    "WITH",
+)
+_SPARQL_PROLOGUE = re.compile(
+    r"^\s*(?:(?:#[^\n]*\n)\s*|PREFIX\s+[^:]*:\s*<[^>]*>\s*|BASE\s+<[^>]*>\s*)*",
+    re.IGNORECASE,
+)
+
+_http_sessions_lock = threading.Lock()
+_http_sessions = {}
+
+
+def get_http_session(base_url: str) -> requests.Session:
+    """Keep-alive HTTP session shared by all requests to a graph system."""
+    with _http_sessions_lock:
+        session = _http_sessions.get(base_url)
+        if session is None:
+            session = requests.Session()
+            _http_sessions[base_url] = session
+        return session
+
+
+def _split_statements(querys: list) -> list:
+    statements = []
+    for query in querys:
+        for part in query.split(";"):
+            if part.strip():
+                statements.append(part.strip())
+    return statements
+
+
+class _PooledGremlinClient:
+    def __init__(self, client, credential_key):
+        self.client = client
+        self.credential_key = credential_key
+        self.users = 0
+        self.retired = False
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+
+class GremlinClientPool:
+    """
+    Keep one gremlin client (with its own websocket connection pool) per graph
+    system, shared by changes and change sets. A client is replaced when the
+    credentials it connected with change, when it is older than its max age or when
+    it fails, and closed when idle.
+    """
+
+    def __init__(self, idle_timeout: float = _GREMLIN_CLIENT_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._reaper = None
+
+    @contextmanager
+    def client(
+        self, system_key: str, credential_key: str, factory, max_age: float = None
+    ):
+        """
+        Borrow the client of a system.
+
+        :param system_key: Identifies the graph system, e.g. the request url
+        :param credential_key: Fingerprint of the credentials, a change replaces the client
+        :param factory: Creates a new client, only called when there is no usable one
+        :param max_age: Seconds after which the client is replaced, e.g. when the
+            connections it opens later reuse headers signed at its creation
+        """
+        pooled = self._acquire(system_key, credential_key, factory, max_age)
+        try:
+            yield pooled.client
+        except (GremlinServerError, ChangeLogException):
+            # Script error, the connection is fine
+            raise
+        except Exception:
+            self._retire(system_key, pooled)
+            raise
+        finally:
+            self._release(pooled)
+
+    def _acquire(
+        self, system_key, credential_key, factory, max_age=None
+    ) -> _PooledGremlinClient:
+        with self._lock:
+            pooled = self._clients.get(system_key)
+            if pooled and pooled.credential_key != credential_key:
+                logger.info(f"Gremlin credentials changed, reconnect. {system_key}")
+                self._retire_locked(system_key, pooled)
+                pooled = None
+            if pooled and max_age and time.monotonic() - pooled.created_at >= max_age:
+                logger.info(f"Gremlin client expired, reconnect. {system_key}")
+                self._retire_locked(system_key, pooled)
+                pooled = None
+            if pooled is None:
+                pooled = _PooledGremlinClient(factory(), credential_key)
+                self._clients[system_key] = pooled
+                self._start_reaper_locked()
+            pooled.users += 1
+            pooled.last_used = time.monotonic()
+            return pooled
+
+    def _release(self, pooled: _PooledGremlinClient):
+        with self._lock:
+            pooled.users -= 1
+            pooled.last_used = time.monotonic()
+            if pooled.retired and pooled.users == 0:
+                self._close(pooled)
+
+    def _retire(self, system_key, pooled: _PooledGremlinClient):
+        with self._lock:
+            self._retire_locked(system_key, pooled)
+
+    def _retire_locked(self, system_key, pooled: _PooledGremlinClient):
+        if self._clients.get(system_key) is pooled:
+            del self._clients[system_key]
+        pooled.retired = True
+        if pooled.users == 0:
+            self._close(pooled)
+
+    @staticmethod
+    def _close(pooled: _PooledGremlinClient):
+        try:
+            pooled.client.close()
+        except Exception as e:
+            logger.warning(f"Close gremlin client error. {e}")
+
+    def _start_reaper_locked(self):
+        if self._reaper and self._reaper.is_alive():
+            return
+        self._reaper = threading.Thread(
+            target=self._reap, name="gremlin-client-reaper", daemon=True
+        )
+        self._reaper.start()
+
+    def _reap(self):
+        while True:
+            time.sleep(max(self.idle_timeout / 2, 1))
+            with self._lock:
+                now = time.monotonic()
+                for system_key, pooled in list(self._clients.items()):
+                    if pooled.users == 0 and now - pooled.last_used >= self.idle_timeout:
+                        logger.info(f"Close idle gremlin client. {system_key}")
+                        self._retire_locked(system_key, pooled)
+                if len(self._clients) == 0:
+                    self._reaper = None
+                    return
+
+    def close_all(self):
+        with self._lock:
+            for system_key, pooled in list(self._clients.items()):
+                self._retire_locked(system_key, pooled)
+
+
+_gremlin_client_pool = GremlinClientPool()
+atexit.register(_gremlin_client_pool.close_all)
+
+
+def _gremlin_one(future):
+    try:
+        return future.result().one()
+    except KeyError:
+        return None
+
+
+def submit_gremlin(
+    client, querys: list, pipelined: bool = False, max_in_flight: int = None
+) -> list:
+    """
+    Submit the ";" separated statements of gremlin scripts.
+
+    :param pipelined: The statements are independent, keep up to max_in_flight of
+        them submitted at the same time instead of waiting for each one.
+    :return: The results in statement order
+    """
+    parts = _split_statements(querys)
+
+    if not pipelined:
+        return [_gremlin_one(client.submit_async(part)) for part in parts]
+
+    max_in_flight = max(max_in_flight or _GREMLIN_MAX_IN_FLIGHT, 1)
+    results = []
+    pending = collections.deque()
+    idx = 0
+    while idx < len(parts) or pending:
+        while idx < len(parts) and len(pending) < max_in_flight:
+            pending.append((idx, client.submit_async(parts[idx])))
+            idx += 1
+        statement_idx, future = pending.popleft()
+        try:
+            results.append(_gremlin_one(future))
+        except GremlinServerError as e:
+            # Stop at the first failure, let the in flight statements finish
+            for _, other in pending:
+                try:
+                    other.result()
+                except Exception:
+                    pass
+            raise ChangeLogException(
+                f"Gremlin statement {statement_idx + 1}/{len(parts)} failed: {parts[statement_idx]}. {e}"
+            )
+    return results
+
+
+def _gremlin_pool_size(max_in_flight: int = None) -> int:
+    """Connections of a pooled gremlin client, enough for max_in_flight statements."""
+    return max(max_in_flight or 0, _GREMLIN_MAX_IN_FLIGHT)
+
+
+def _fingerprint(*values) -> str:
+    return hashlib.sha256(
+        "\x00".join("" if v is None else str(v) for v in values).encode()
+    ).hexdigest()
+
+
+def is_sparql_update(query: str) -> bool:
+    body = _SPARQL_PROLOGUE.sub("", query, count=1)
+    keyword = body.split(None, 1)[0].upper() if body.strip() else ""
+    return keyword in _SPARQL_UPDATE_KEYWORDS
+
+
+def _batch_sparql_updates(querys: list, max_bytes: int) -> list:
+    """
+    Group consecutive update operations into batches joined by ';', each at most
+    max_bytes unless a single operation is larger. Queries form batches of their own.
+
+    :return: A list of (offset, querys)
+    """
+    batches = []
+    size = 0
+    for idx, query in enumerate(querys):
+        query_size = len(query.encode("utf-8"))
+        if not is_sparql_update(query):
+            batches.append((idx, [query]))
+            continue
+        if (
+            batches
+            and is_sparql_update(batches[-1][1][-1])
+            and size + len(_SPARQL_UPDATE_SEPARATOR) + query_size <= max_bytes
+        ):
+            batches[-1][1].append(query)
+            size += len(_SPARQL_UPDATE_SEPARATOR) + query_size
+        else:
+            batches.append((idx, [query]))
+            size = query_size
+    return batches
+
+
+def _find_unparsable_sparql(querys: list, offset: int, count: int):
+    """
+    Index of the first of querys[offset:offset + count] rejected by a parse-only
+    check, None if they all parse or rdflib is not installed.
+    """
+    if _parse_sparql_update is None:
+        return None
+    for idx in range(offset, offset + count):
+        if not is_sparql_update(querys[idx]):
+            continue
+        try:
+            _parse_sparql_update(querys[idx])
+        except Exception:
+            return idx
+    return None
+
+
+def submit_sparql(
+    session: requests.Session,
+    request_url: str,
+    querys: list,
+    max_bytes: int = None,
+    sign=None,
+    auth=None,
+):
+    """
+    Submit SPARQL queries over a pooled session. Consecutive update operations are
+    sent together as one SPARQL update request. A request is atomic, a failed
+    batch applied none of its operations and is not retried operation by operation.
+    The failing operation of a batch is located with a parse-only check when rdflib
+    is installed. Operations rejected by the server for another reason are only
+    reported by the range of their batch.
+
+    :param sign: Optional callable (payload) -> headers
+    """
+    querys = [_SPARQL_TRAILING_SEPARATORS.sub("", query.strip()) for query in querys]
+    querys = [query for query in querys if query]
+    max_bytes = max_bytes or _SPARQL_MAX_UPDATE_BYTES
+
+    def send(query: str):
+        payload = {"update" if is_sparql_update(query) else "query": query}
+        headers = dict(sign(payload)) if sign else {}
+        response = session.post(
+            request_url, headers=headers, data=payload, auth=auth, verify=False
+        )
+        logger.info(
+            f"Execute sparql. status: {response.status_code}, text: {response.text}"
+        )
+        return response
+
+    for offset, batch in _batch_sparql_updates(querys, max_bytes):
+        response = send(_SPARQL_UPDATE_SEPARATOR.join(batch))
+        if 200 <= response.status_code < 300:
+            continue
+        if len(batch) == 1:
+            raise ChangeLogException(
+                f"SPARQL operation {offset + 1}/{len(querys)} failed: {querys[offset]}. {response.text}"
+            )
+        failed = _find_unparsable_sparql(querys, offset, len(batch))
+        if failed is not None:
+            raise ChangeLogException(
+                f"SPARQL operation {failed + 1}/{len(querys)} is invalid: {querys[failed]}. None of operations {offset + 1}-{offset + len(batch)} was applied. {response.text}"
+            )
+        raise ChangeLogException(
+            f"SPARQL operations {offset + 1}-{offset + len(batch)}/{len(querys)} failed, none of them was applied. {response.text}"
+        )
+
 
 class BaseExecutor:
     def execute_gremlin(self, system_cfg, querys: list, **kwargs):
@@ -32,29 +383,44 @@ class NeptuneExecutor(BaseExecutor):
         host = system_cfg["host"]
         port = system_cfg["port"]
         request_url = f"{schema}://{host}:{port}/gremlin"
-        headers = secret_util.get_aws_request_headers(
-            system_cfg.get("aws_iam_authentication"),
-            "GET",
-            _AWS_NEPTUNEDB_SERVICE_NAME,
-            request_url,
-            None,
-        )
-        client = gremlin_client.Client(
-            url=request_url, traversal_source="g", headers=headers
+        aws_cfg = system_cfg.get("aws_iam_authentication")
+        pool_size = _gremlin_pool_size(system_cfg.get("max_in_flight"))
+        # Only signed headers expire
+        max_age = (
+            _NEPTUNE_CLIENT_MAX_AGE if secret_util.is_aws_iam_enabled(aws_cfg) else None
         )
-        try:
-            for query in querys:
-                parts = query.split(";")
-                for part in parts:
-                    if part.strip():
-                        try:
-                            future_result = client.submit_async(part.strip())
-                            result = future_result.result().one()
-                            logger.info(f"Neptune execute gremlin. result: {result}")
-                        except KeyError:
-                            pass
-        finally:
-            client.close()
+
+        def create_client():
+            # Signed headers are only checked by the websocket handshake
+            headers = secret_util.get_aws_request_headers(
+                aws_cfg,
+                "GET",
+                _AWS_NEPTUNEDB_SERVICE_NAME,
+                request_url,
+                None,
+            )
+            return gremlin_client.Client(
+                url=request_url,
+                traversal_source="g",
+                headers=headers,
+                pool_size=pool_size,
+            )
+
+        with _gremlin_client_pool.client(
+            request_url,
+            _fingerprint(
+                secret_util.get_aws_credentials_fingerprint(aws_cfg), pool_size
+            ),
+            create_client,
+            max_age,
+        ) as client:
+            results = submit_gremlin(
+                client,
+                querys,
+                kwargs.get("pipelined", False),
+                system_cfg.get("max_in_flight"),
+            )
+            logger.info(f"Neptune execute gremlin. results: {results}")
 
     def execute_opencypher(self, system_cfg, querys: list, **kwargs):
         secure = system_cfg.get("secure", False)
@@ -62,26 +428,29 @@ class NeptuneExecutor(BaseExecutor):
         host = system_cfg["host"]
         port = system_cfg["port"]
         request_url = f"{schema}://{host}:{port}/openCypher"
-        for query in querys:
-            parts = query.split(";")
-            for part in parts:
-                if part.strip():
-                    payload = {"query": part}
-                    headers = secret_util.get_aws_request_headers(
-                        system_cfg.get("aws_iam_authentication"),
-                        "POST",
-                        _AWS_NEPTUNEDB_SERVICE_NAME,
-                        request_url,
-                        payload,
-                    )
-                    response = requests.post(
-                        request_url, headers=headers, verify=False, data=payload
-                    )
-                    logger.info(
-                        f"Neptune execute opencypher. status: {response.status_code}, text: {response.text}"
-                    )
-                    if response.status_code < 200 or response.status_code >= 300:
-                        raise ChangeLogException(response.text)
+        # Neptune runs every openCypher request in its own transaction, statements
+        # are sent in order over one keep-alive connection
+        session = get_http_session(f"{schema}://{host}:{port}")
+        statements = _split_statements(querys)
+        for idx, statement in enumerate(statements):
+            payload = {"query": statement}
+            headers = secret_util.get_aws_request_headers(
+                system_cfg.get("aws_iam_authentication"),
+                "POST",
+                _AWS_NEPTUNEDB_SERVICE_NAME,
+                request_url,
+                payload,
+            )
+            response = session.post(
+                request_url, headers=headers, verify=False, data=payload
+            )
+            logger.info(
+                f"Neptune execute opencypher. status: {response.status_code}, text: {response.text}"
+            )
+            if response.status_code < 200 or response.status_code >= 300:
+                raise ChangeLogException(
+                    f"Statement {idx + 1}/{len(statements)} failed: {statement}. {response.text}"
+                )
 
     def execute_sparql(self, system_cfg, querys: list, **kwargs):
         secure = system_cfg.get("secure", False)
@@ -89,25 +458,24 @@ class NeptuneExecutor(BaseExecutor):
         host = system_cfg["host"]
         port = system_cfg["port"]
         request_url = f"{schema}://{host}:{port}/sparql"
-        for query in querys:
-            headers = secret_util.get_aws_request_headers(
-                system_cfg.get("aws_iam_authentication"),
-                "POST",
-                _AWS_NEPTUNEDB_SERVICE_NAME,
-                request_url,
-                {"query": query},
-            )
-            sparql = SPARQLWrapper.SPARQLWrapper(request_url)
-            sparql.setMethod(SPARQLWrapper.POST)
-            for k, v in headers.items():
-                sparql.addCustomHttpHeader(k, v)
-            sparql.setQuery(query)
-            result = sparql.query()
-            logger.info(f"Neptune execute sparql result: {result}")
+        aws_cfg = system_cfg.get("aws_iam_authentication")
+        submit_sparql(
+            get_http_session(f"{schema}://{host}:{port}"),
+            request_url,
+            querys,
+            system_cfg.get("max_sparql_update_bytes"),
+            sign=lambda payload: secret_util.get_aws_request_headers(
+                aws_cfg, "POST", _AWS_NEPTUNEDB_SERVICE_NAME, request_url, payload
+            ),
+        )
 
 
 class Neo4jExecutor(BaseExecutor):
     def execute_opencypher(self, system_cfg, querys: list, **kwargs):
+        """
+        Execute all statements atomically. Up to max_statements_per_request statements
+        go in one /tx/commit request, more are chunked into one explicit transaction.
+        """
         dataset = kwargs["dataset"]
         secure = system_cfg.get("secure", False)
         schema = "https" if secure else "http"
@@ -116,18 +484,66 @@ class Neo4jExecutor(BaseExecutor):
         username = system_cfg.get("username")
         password = secret_util.get_secret_data(system_cfg).password
 
-        request_url = f"{schema}://{host}:{port}/db/{dataset}/tx/commit"
-        statements = []
-        for query in querys:
-            parts = query.split(";")
-            for part in parts:
-                if part.strip():
-                    statements.append({"statement": part.strip()})
+        base_url = f"{schema}://{host}:{port}"
+        session = get_http_session(base_url)
+        auth = requests.auth.HTTPBasicAuth(username=username, password=password)
+        statements = [
+            {"statement": statement} for statement in _split_statements(querys)
+        ]
+        if len(statements) == 0:
+            return
+        chunk_size = max(
+            system_cfg.get("max_statements_per_request")
+            or _OPENCYPHER_MAX_STATEMENTS_PER_REQUEST,
+            1,
+        )
+        chunks = [
+            statements[i : i + chunk_size]
+            for i in range(0, len(statements), chunk_size)
+        ]
 
-        response = requests.post(
-            request_url,
+        if len(chunks) == 1:
+            self.__post__(
+                session,
+                f"{base_url}/db/{dataset}/tx/commit",
+                auth,
+                statements,
+                0,
+                len(statements),
+            )
+            return
+
+        tx_url = None
+        try:
+            offset = 0
+            for idx, chunk in enumerate(chunks):
+                if idx == 0:
+                    url = f"{base_url}/db/{dataset}/tx"
+                elif idx == len(chunks) - 1:
+                    url = f"{tx_url}/commit"
+                else:
+                    url = tx_url
+                resp_body = self.__post__(
+                    session, url, auth, chunk, offset, len(statements)
+                )
+                if idx == 0:
+                    tx_url = resp_body["commit"][: -len("/commit")]
+                offset += len(chunk)
+            tx_url = None
+        finally:
+            if tx_url:
+                # Roll back what was sent so far
+                try:
+                    session.delete(tx_url, auth=auth)
+                except Exception as e:
+                    logger.warning(f"Neo4j rollback transaction error. {e}")
+
+    @staticmethod
+    def __post__(session, url, auth, statements, offset, total) -> dict:
+        response = session.post(
+            url,
             json={"statements": statements},
-            auth=requests.auth.HTTPBasicAuth(username=username, password=password),
+            auth=auth,
             allow_redirects=True,
         )
         logger.info(
@@ -144,7 +560,12 @@ class Neo4jExecutor(BaseExecutor):
                 error_text = ";".join([item["description"] for item in notifications])
             else:
                 error_text = ";".join([item["message"] for item in errors])
-            raise ChangeLogException(error_text)
+            # Neo4j stops at the failing statement, results hold the ones before it
+            failed_idx = min(len(resp_body.get("results", [])), len(statements) - 1)
+            raise ChangeLogException(
+                f"Statement {offset + failed_idx + 1}/{total} failed: {statements[failed_idx]['statement']}. {error_text}"
+            )
+        return resp_body
 
 
 class JenafusekiExecutor(BaseExecutor):
@@ -157,14 +578,13 @@ class JenafusekiExecutor(BaseExecutor):
         password = secret_util.get_secret_data(system_cfg).password
         dataset = kwargs["dataset"]
 
-        sparql = SPARQLWrapper.SPARQLWrapper(f"{schema}://{host}:{port}/{dataset}")
-        sparql.setHTTPAuth(SPARQLWrapper.BASIC)
-        sparql.setCredentials(username, password)
-        sparql.setMethod(SPARQLWrapper.POST)
-        for query in querys:
-            sparql.setQuery(query)
-            query_result = sparql.query()
-            logger.info(f"Jenafuseki execute sparql. result: {query_result}")
+        submit_sparql(
+            get_http_session(f"{schema}://{host}:{port}"),
+            f"{schema}://{host}:{port}/{dataset}",
+            querys,
+            system_cfg.get("max_sparql_update_bytes"),
+            auth=requests.auth.HTTPBasicAuth(username=username, password=password),
+        )
 
 
 class JanusgraphExecutor(BaseExecutor):
@@ -176,24 +596,26 @@ class JanusgraphExecutor(BaseExecutor):
         username = system_cfg.get("username", "")
         password = secret_util.get_secret_data(system_cfg).password
         request_url = f"{schema}://{host}:{port}/gremlin"
-        client = gremlin_client.Client(
-            url=request_url,
-            traversal_source="g",
-            username=username,
-            password=password,
-        )
-        try:
-            for query in querys:
-                parts = query.split(";")
-                for part in parts:
-                    if part.strip():
-                        try:
-                            future_result = client.submit_async(part.strip())
-                            future_result.result().one()
-                        except KeyError:
-                            pass
-        finally:
-            client.close()
+        pool_size = _gremlin_pool_size(system_cfg.get("max_in_flight"))
+
+        def create_client():
+            return gremlin_client.Client(
+                url=request_url,
+                traversal_source="g",
+                username=username,
+                password=password,
+                pool_size=pool_size,
+            )
+
+        with _gremlin_client_pool.client(
+            request_url, _fingerprint(username, password, pool_size), create_client
+        ) as client:
+            submit_gremlin(
+                client,
+                querys,
+                kwargs.get("pipelined", False),
+                system_cfg.get("max_in_flight"),
+            )
 
 
 _DIALECT_EXECUTOR_MAP = {
@@ -1,17 +1,50 @@
-import logging, os, string
+import hashlib, logging, os, string
+from datetime import datetime, timedelta
+from typing import Optional
 from configops.changelog import changelog_utils
 from configops.utils import config_handler, config_validator
 from configops.utils.constants import ChangelogExeType, SystemType, extract_version
-from configops.utils.exception import ChangeLogException, ConfigOpsException
+from configops.utils.exception import (
+    ChangeLogException,
+    ChangePlanDriftException,
+    ChangePlanNotFoundException,
+    ConfigOpsException,
+)
 from configops.config import get_config
 from ruamel import yaml as ryaml
 from jsonschema import Draft7Validator, ValidationError
 from configops.utils.nacos_client import ConfigOpsNacosClient
-from configops.database.db import db, ConfigOpsChangeLog, ConfigOpsChangeLogChanges
+from configops.database.db import (
+    db,
+    ConfigOpsChangeLog,
+    ConfigOpsChangeLogChanges,
+    ConfigOpsChangePlan,
+)
 
 
 logger = logging.getLogger(__name__)
 
+PLAN_STATUS_PENDING = "PENDING"
+PLAN_STATUS_APPLYING = "APPLYING"
+# casMd5 of a config planned to be created, only matched by an empty config
+_ABSENT_CONFIG_MD5 = hashlib.md5(b"").hexdigest()
+# Plans not applied within this time are removed
+PLAN_RETENTION = timedelta(days=7)
+
+
+def _node_secret(app) -> Optional[str]:
+    if app:
+        return get_config(app, "config.node.secret")
+    return None
+
+
+def _remote_md5(remote_config: Optional[dict]) -> Optional[str]:
+    """md5 of a remote config content, None if the config does not exist"""
+    if remote_config is None:
+        return None
+    content = remote_config.get("content") or ""
+    return hashlib.md5(content.encode("utf-8")).hexdigest()
+
 schema = {
     "type": "object",
     "properties": {
@@ -348,6 +381,33 @@ class NacosChangeLog:
 
         return is_execute
 
+    def sync(
+        self,
+        nacos_id: str,
+        contexts: str = None,
+        spec_changesets: list = None,
+        workers: int = 1,
+    ) -> dict:
+        """
+        Record the change sets as executed without applying them (changelog-sync)
+        """
+        return changelog_utils.sync_change_logs(
+            self.change_set_list,
+            nacos_id,
+            SystemType.NACOS,
+            contexts,
+            spec_changesets,
+            workers,
+        )
+
+    def pending_summary(self, nacos_id: str, contexts: str = None) -> dict:
+        """
+        Pending change set ids and counts, from checksums and the changelog only
+        """
+        return changelog_utils.pending_summary(
+            self.change_set_list, nacos_id, SystemType.NACOS, contexts
+        )
+
     def fetch_multi(
         self,
         client: ConfigOpsNacosClient,
@@ -358,12 +418,31 @@ class NacosChangeLog:
         check_log: bool = True,
         spec_changesets=[],
         allowed_data_ids: list = None,
+        read_only: bool = False,
+        remote_configs_cache: dict = None,
     ):
         """
         获取多个当前需要执行的changeset
+
+        :param read_only: Plan only, decide from the changelog without writing to it
+        :param remote_configs_cache: Remote configs fetched, by namespace/group
         """
+        plan = None
+        if check_log and read_only:
+            plan = changelog_utils.plan_change_sets(
+                [
+                    change_set_obj
+                    for change_set_obj in self.change_set_list
+                    if changelog_utils.is_ctx_included(
+                        contexts, change_set_obj.get("context")
+                    )
+                ],
+                nacos_id,
+                SystemType.NACOS,
+            )
         idx = 0
-        remote_configs_cache = {}
+        if remote_configs_cache is None:
+            remote_configs_cache = {}
         alter_change_configs = {}
         delete_change_configs = {}
         change_set_ids = []
@@ -384,7 +463,9 @@ class NacosChangeLog:
 
             is_execute = True
             # 查询log
-            if check_log:
+            if plan is not None:
+                is_execute = plan[change_set_id] in changelog_utils.PLAN_PENDING
+            elif check_log:
                 is_execute = self.__check_change_log__(
                     change_set_obj, nacos_id, contexts, vars
                 )
@@ -496,7 +577,7 @@ class NacosChangeLog:
             if count > 0 and idx >= count:
                 break
 
-        if check_log:
+        if check_log and plan is None:
             db.session.commit()
         return (
             change_set_ids,
@@ -504,8 +585,195 @@ class NacosChangeLog:
             list(delete_change_configs.values()),
         )
 
-    def _get_remote_config(
+    def create_plan(
         self,
+        client: ConfigOpsNacosClient,
+        nacos_id: str,
+        count: int = 0,
+        contexts: str = None,
+        vars: dict = {},
+        allowed_data_ids: list = None,
+    ) -> dict:
+        """
+        Get the change sets to execute like fetch_multi, and store the configs to push
+        as a plan on this worker, with the md5 of the remote configs it is based on.
+
+        :return: The plan id, the change set ids and the configs changed, without content
+        """
+        remote_configs_cache = {}
+        change_set_ids, changes, delete_changes = self.fetch_multi(
+            client=client,
+            nacos_id=nacos_id,
+            count=count,
+            contexts=contexts,
+            vars=vars,
+            allowed_data_ids=allowed_data_ids,
+            remote_configs_cache=remote_configs_cache,
+        )
+        if len(change_set_ids) == 0:
+            return {"ids": [], "planId": None, "changes": [], "deleteChanges": []}
+
+        plan_changes = []
+        for change in changes:
+            namespace = change["namespace"]
+            group = change["group"]
+            data_id = change["dataId"]
+            content = change["nextContent"]
+            _format = change["format"]
+            # Validated once here, applying the plan pushes the contents as they are
+            if content is None or len(content.strip()) == 0:
+                raise ChangeLogException(
+                    f"Push content is empty. namespace:{namespace}, group:{group}, data_id:{data_id}"
+                )
+            suc, msg = config_validator.validate_content(content, _format)
+            if not suc:
+                raise ChangeLogException(
+                    f"Push content format invalid. namespace:{namespace}, group:{group}, data_id:{data_id}, format:{_format}. {msg}"
+                )
+            remote_config, _ = self._get_remote_config(
+                remote_configs_cache, namespace, group, data_id, client
+            )
+            plan_changes.append(
+                {
+                    "namespace": namespace,
+                    "group": group,
+                    "dataId": data_id,
+                    "format": _format,
+                    "content": content,
+                    "md5": _remote_md5(remote_config),
+                }
+            )
+        plan_delete_changes = []
+        for change in delete_changes:
+            remote_config, _ = self._get_remote_config(
+                remote_configs_cache,
+                change["namespace"],
+                change["group"],
+                change["dataId"],
+                client,
+            )
+            plan_delete_changes.append(
+                {
+                    "namespace": change["namespace"],
+                    "group": change["group"],
+                    "dataId": change["dataId"],
+                    "md5": _remote_md5(remote_config),
+                }
+            )
+
+        plan_id, packed_plan = changelog_utils.pack_plan(
+            {
+                "systemId": nacos_id,
+                "changeSetIds": change_set_ids,
+                "changes": plan_changes,
+                "deleteChanges": plan_delete_changes,
+            },
+            _node_secret(self.app),
+        )
+        db.session.query(ConfigOpsChangePlan).filter(
+            ConfigOpsChangePlan.system_id == nacos_id,
+            ConfigOpsChangePlan.system_type == SystemType.NACOS.value,
+            ConfigOpsChangePlan.created_at < datetime.now() - PLAN_RETENTION,
+        ).delete(synchronize_session=False)
+        plan = db.session.get(ConfigOpsChangePlan, plan_id)
+        if plan is None:
+            plan = ConfigOpsChangePlan(
+                id=plan_id,
+                system_id=nacos_id,
+                system_type=SystemType.NACOS.value,
+                status=PLAN_STATUS_PENDING,
+                plan=packed_plan,
+            )
+            db.session.add(plan)
+        db.session.commit()
+
+        def summary(item):
+            return {key: item[key] for key in ("namespace", "group", "dataId")}
+
+        return {
+            "ids": change_set_ids,
+            "planId": plan_id,
+            "changes": [
+                dict(summary(item), format=item["format"]) for item in plan_changes
+            ],
+            "deleteChanges": [summary(item) for item in plan_delete_changes],
+        }
+
+    @staticmethod
+    def apply_plan(
+        plan_id: str, nacos_id: str, client: ConfigOpsNacosClient, app=None
+    ):
+        """
+        Apply a plan made by create_plan. The plan is rejected if a remote config
+        changed since, and is removed once applied or rejected. A plan failing for
+        another reason is kept, it may be applied again.
+        """
+        plan_filter = (
+            ConfigOpsChangePlan.id == plan_id,
+            ConfigOpsChangePlan.system_id == nacos_id,
+            ConfigOpsChangePlan.system_type == SystemType.NACOS.value,
+        )
+        plan_row = db.session.query(ConfigOpsChangePlan).filter(*plan_filter).first()
+        if plan_row is None:
+            raise ChangePlanNotFoundException(f"Change plan not found. planId:{plan_id}")
+        # Claimed by one apply at a time
+        claimed = (
+            db.session.query(ConfigOpsChangePlan)
+            .filter(*plan_filter, ConfigOpsChangePlan.status == PLAN_STATUS_PENDING)
+            .update({"status": PLAN_STATUS_APPLYING}, synchronize_session=False)
+        )
+        db.session.commit()
+        if claimed == 0:
+            raise ChangePlanDriftException(
+                f"Change plan is being applied. planId:{plan_id}"
+            )
+        db.session.refresh(plan_row)
+        plan = changelog_utils.unpack_plan(plan_row.plan, _node_secret(app))
+        changes = plan["changes"]
+        delete_changes = plan["deleteChanges"]
+
+        try:
+            remote_configs_cache = {}
+            drifted = []
+            for change in changes + delete_changes:
+                remote_config, _ = NacosChangeLog._get_remote_config(
+                    remote_configs_cache,
+                    change["namespace"],
+                    change["group"],
+                    change["dataId"],
+                    client,
+                )
+                if _remote_md5(remote_config) != change["md5"]:
+                    drifted.append(
+                        f"{change['namespace']}/{change['group']}/{change['dataId']}"
+                    )
+            if len(drifted) > 0:
+                raise ChangePlanDriftException(
+                    f"Nacos configs changed since the plan was made, get the change set again. planId:{plan_id}, namespace/group/dataId:{drifted}"
+                )
+            NacosChangeLog.apply_changes(
+                plan["changeSetIds"],
+                nacos_id,
+                client,
+                changes,
+                delete_changes,
+                validate=False,
+            )
+        except ChangePlanDriftException:
+            db.session.rollback()
+            db.session.delete(plan_row)
+            db.session.commit()
+            raise
+        except Exception:
+            db.session.rollback()
+            plan_row.status = PLAN_STATUS_PENDING
+            db.session.commit()
+            raise
+        db.session.delete(plan_row)
+        db.session.commit()
+
+    @staticmethod
+    def _get_remote_config(
         remote_configs_cache,
         namespace,
         group,
@@ -531,6 +799,7 @@ class NacosChangeLog:
         client: ConfigOpsNacosClient,
         changes: list,
         delete_changes: list,
+        validate: bool = True,
     ):
         logs = (
             db.session.query(ConfigOpsChangeLog)
@@ -548,7 +817,7 @@ class NacosChangeLog:
             )
 
         try:
-            NacosChangeLog.push_remote(client, changes, delete_changes)
+            NacosChangeLog.push_remote(client, changes, delete_changes, validate)
             for log in logs:
                 log.exectype = ChangelogExeType.EXECUTED.value
         except Exception as e:
@@ -559,7 +828,17 @@ class NacosChangeLog:
             db.session.commit()
 
     @staticmethod
-    def push_remote(client: ConfigOpsNacosClient, changes: list, delete_changes: list):
+    def push_remote(
+        client: ConfigOpsNacosClient,
+        changes: list,
+        delete_changes: list,
+        validate: bool = True,
+    ):
+        """
+        :param validate: Validate the contents before pushing. Changes of a plan carry
+            the md5 of the remote content they replace, and are published with it as
+            casMd5. A config changed or created since raises ChangePlanDriftException.
+        """
         if delete_changes and len(delete_changes) > 0:
             for change in delete_changes:
                 namespace = change.get("namespace")
@@ -572,7 +851,7 @@ class NacosChangeLog:
                         f"Delete config fail. namespace:{namespace}, group:{group}, data_id:{data_id}"
                     )
 
-        if changes and len(changes) > 0:
+        if changes and len(changes) > 0 and validate:
             for change in changes:
                 namespace = change.get("namespace")
                 group = change.get("group")
@@ -591,6 +870,7 @@ class NacosChangeLog:
                         f"Push content format invalid. namespace:{namespace}, group:{group}, data_id:{data_id}, format:{_format}. {validation_msg}"
                     )
 
+        if changes and len(changes) > 0:
             for change in changes:
                 namespace = change.get("namespace")
                 group = change.get("group")
@@ -598,10 +878,36 @@ class NacosChangeLog:
                 content = change.get("content")
                 _format = change.get("format")
                 client.namespace = namespace
-                res = client.publish_config_post(
-                    data_id=data_id, group=group, content=content, config_type=_format
-                )
+                planned = "md5" in change
+                cas_md5 = None
+                if planned:
+                    cas_md5 = change["md5"] or _ABSENT_CONFIG_MD5
+                try:
+                    res = client.publish_config_post(
+                        data_id=data_id,
+                        group=group,
+                        content=content,
+                        config_type=_format,
+                        cas_md5=cas_md5,
+                    )
+                except Exception:
+                    if planned:
+                        NacosChangeLog._check_drift(client, change)
+                    raise
                 if not res:
+                    if planned:
+                        NacosChangeLog._check_drift(client, change)
                     raise ConfigOpsException(
                         f"Push config fail. namespace:{namespace}, group:{group}, data_id:{data_id}"
                     )
+
+    @staticmethod
+    def _check_drift(client: ConfigOpsNacosClient, change):
+        """Raise ChangePlanDriftException if the config of a planned change changed"""
+        remote_config, _ = NacosChangeLog._get_remote_config(
+            {}, change["namespace"], change["group"], change["dataId"], client
+        )
+        if _remote_md5(remote_config) != change["md5"]:
+            raise ChangePlanDriftException(
+                f"Nacos config changed while the plan was applied. namespace:{change['namespace']}, group:{change['group']}, data_id:{change['dataId']}"
+            )
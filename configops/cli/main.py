@@ -1,7 +1,13 @@
-import logging, click
+import logging, os, click
+from flask import Flask
 from configops.utils import nacos_client
+from configops.utils.constants import SystemType
 from configops.utils.exception import ChangeLogException
 from configops.changelog.nacos_change import NacosChangeLog
+from configops.changelog.elasticsearch_change import ElasticsearchChangelog
+from configops.changelog.graphdb_change import GraphdbChangelog
+from configops.config import load_config, get_node_cfg
+from configops.database import db
 
 logger = logging.getLogger(__name__)
 
@@ -135,6 +141,78 @@ def update_nacos_check(changelog_file, url, username, password, contexts, var):
         click.echo(f"Vars missing key: {err}", err=True)
 
 
+@cli.command(
+    name="changelog-sync",
+    help="Mark the change sets in the changelog file as executed without applying them",
+)
+@click.option("--config", required=False, help="The worker YAML config file")
+@click.option(
+    "--system-type",
+    required=True,
+    type=click.Choice(
+        [
+            SystemType.NACOS.name,
+            SystemType.ELASTICSEARCH.name,
+            SystemType.GRAPHDB.name,
+        ],
+        case_sensitive=False,
+    ),
+    help="The system type of the target",
+)
+@click.option("--system-id", required=True, help="The target id in the config file")
+@click.option("--changelog-file", required=True, help="The changelog file")
+@click.option(
+    "--changesets",
+    required=False,
+    help="The specific changeset id to match. Use commas for multiple values",
+)
+@click.option(
+    "--contexts",
+    required=False,
+    help="The specific contexts to match. Use commas for multiple values",
+)
+@click.option(
+    "--workers",
+    required=False,
+    type=int,
+    default=os.cpu_count() or 1,
+    show_default=True,
+    help="The number of processes computing the checksums",
+)
+def changelog_sync(
+    config, system_type, system_id, changelog_file, changesets, contexts, workers
+):
+    app = Flask(__name__)
+    config_data = load_config(config)
+    if config_data is not None:
+        app.config.update(config_data)
+    spec_changesets = []
+    if changesets:
+        spec_changesets = [item for item in changesets.split(",") if item]
+    changelog_classes = {
+        SystemType.NACOS.name: NacosChangeLog,
+        SystemType.ELASTICSEARCH.name: ElasticsearchChangelog,
+        SystemType.GRAPHDB.name: GraphdbChangelog,
+    }
+    try:
+        db.init(app, get_node_cfg(app))
+        with app.app_context():
+            changelog = changelog_classes[system_type.upper()](
+                changelog_file=changelog_file, app=app
+            )
+            result = changelog.sync(
+                system_id,
+                contexts=contexts,
+                spec_changesets=spec_changesets,
+                workers=workers,
+            )
+        click.echo(
+            f"Changelog synced. inserted: {len(result['inserted'])}, updated: {len(result['updated'])}, unchanged: {len(result['unchanged'])}"
+        )
+    except ChangeLogException as err:
+        click.echo(f"Changelog invalid. {err}", err=True)
+
+
 def __print_banner():
     click.echo(
         """
@@ -0,0 +1,216 @@
+"""
+State shared by the controller processes.
+
+A single controller process keeps everything in memory (LocalClusterBus). When
+config.cluster.redis_uri is set, every process registers the worker sessions it
+holds in Redis (or any Redis compatible server), so a request served by one
+process can be sent to a worker connected to another one through the Socket.IO
+message queue. The worker answers the process holding its connection, which
+hands the reply back to the requesting process over a pub/sub channel. Changes
+to the worker records are broadcast the same way, so every process drops the
+cached credentials at once.
+"""
+
+import logging
+import os
+import socket
+import uuid
+from typing import Callable, Optional
+from redis import Redis
+from configops.cluster import codec
+from configops.cluster.registry import ClusterWorkerInfo
+
+logger = logging.getLogger(__name__)
+
+_KEY_PREFIX = "configops:cluster"
+# Seconds a session survives in the shared registry without a refresh
+SESSION_TTL = 90
+# Seconds between two refreshes of the sessions held by this process
+SESSION_REFRESH_INTERVAL = 30
+# Seconds a request owner is kept beyond the request timeout
+REQUEST_OWNER_SLACK = 30
+_AUTH_CHANNEL = f"{_KEY_PREFIX}:auth"
+
+
+def new_process_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class LocalClusterBus:
+    """Single process controller, nothing is shared."""
+
+    shared = False
+
+    def register_session(self, worker_info: ClusterWorkerInfo): ...
+
+    def unregister_session(self, worker_info: ClusterWorkerInfo): ...
+
+    def refresh_sessions(self, worker_infos: list): ...
+
+    def lookup(self, worker_id) -> Optional[ClusterWorkerInfo]:
+        return None
+
+    def track_request(self, request_id, timeout: float): ...
+
+    def forward_reply(self, request_id, message: dict) -> bool:
+        return False
+
+    def invalidate_worker_auth(self, name: str = None): ...
+
+    def listen(self, deliver: Callable, sleep: Callable, invalidate: Callable = None):
+        ...
+
+
+class RedisClusterBus:
+    """
+    Keys:
+      {prefix}:worker:{worker_id}   sorted set of sid scored by last seen time
+      {prefix}:session:{sid}        hash of the session info
+      {prefix}:request:{request_id} process id waiting for the response
+      {prefix}:reply:{process_id}   pub/sub channel of forwarded responses
+      {prefix}:auth                 pub/sub channel of changed worker names
+    """
+
+    shared = True
+
+    def __init__(self, redis_client, process_id: str = None):
+        self.redis = redis_client
+        self.process_id = process_id or new_process_id()
+
+    def _worker_key(self, worker_id) -> str:
+        return f"{_KEY_PREFIX}:worker:{worker_id}"
+
+    def _session_key(self, sid) -> str:
+        return f"{_KEY_PREFIX}:session:{sid}"
+
+    def _reply_channel(self, process_id) -> str:
+        return f"{_KEY_PREFIX}:reply:{process_id}"
+
+    def register_session(self, worker_info: ClusterWorkerInfo):
+        self.refresh_sessions([worker_info])
+
+    def unregister_session(self, worker_info: ClusterWorkerInfo):
+        pipe = self.redis.pipeline()
+        pipe.zrem(self._worker_key(worker_info.id), worker_info.sid)
+        pipe.delete(self._session_key(worker_info.sid))
+        pipe.execute()
+
+    def refresh_sessions(self, worker_infos: list):
+        if len(worker_infos) == 0:
+            return
+        pipe = self.redis.pipeline()
+        for worker_info in worker_infos:
+            worker_key = self._worker_key(worker_info.id)
+            session_key = self._session_key(worker_info.sid)
+            pipe.zadd(worker_key, {worker_info.sid: worker_info.last_seen})
+            pipe.expire(worker_key, SESSION_TTL)
+            pipe.hset(
+                session_key,
+                mapping={
+                    "worker_id": worker_info.id,
+                    "name": worker_info.name,
+                    "codec": worker_info.codec,
+                    "compression": worker_info.compression,
+                    "process_id": self.process_id,
+                },
+            )
+            pipe.expire(session_key, SESSION_TTL)
+        pipe.execute()
+
+    def lookup(self, worker_id) -> Optional[ClusterWorkerInfo]:
+        """The most recently seen live session of a worker, on any process."""
+        worker_key = self._worker_key(worker_id)
+        for sid in self.redis.zrevrange(worker_key, 0, -1):
+            sid = sid.decode() if isinstance(sid, bytes) else sid
+            info = self.redis.hgetall(self._session_key(sid))
+            if not info:
+                # Left behind by a process that went away
+                self.redis.zrem(worker_key, sid)
+                continue
+            info = {
+                (k.decode() if isinstance(k, bytes) else k): (
+                    v.decode() if isinstance(v, bytes) else v
+                )
+                for k, v in info.items()
+            }
+            return ClusterWorkerInfo(
+                info["worker_id"],
+                sid,
+                info["name"],
+                info["codec"],
+                info["compression"],
+            )
+        return None
+
+    def track_request(self, request_id, timeout: float):
+        self.redis.set(
+            f"{_KEY_PREFIX}:request:{request_id}",
+            self.process_id,
+            ex=int(timeout) + REQUEST_OWNER_SLACK,
+        )
+
+    def forward_reply(self, request_id, message: dict) -> bool:
+        """
+        Hand a response over to the process waiting for it.
+
+        :return: False if no other process waits for it
+        """
+        owner = self.redis.get(f"{_KEY_PREFIX}:request:{request_id}")
+        if owner is None:
+            return False
+        owner = owner.decode() if isinstance(owner, bytes) else owner
+        if owner == self.process_id:
+            return False
+        self.redis.publish(
+            self._reply_channel(owner),
+            codec.encode(message, codec.CODEC_MSGPACK, codec.COMPRESSION_ZLIB),
+        )
+        return True
+
+    def invalidate_worker_auth(self, name: str = None):
+        """Tell every process to drop the cached record of a worker, all if None."""
+        self.redis.publish(_AUTH_CHANNEL, name or "")
+
+    def listen(self, deliver: Callable, sleep: Callable, invalidate: Callable = None):
+        """
+        Background task delivering the responses forwarded to this process, and
+        the worker auth invalidations.
+        """
+        reply_channel = self._reply_channel(self.process_id)
+        while True:
+            pubsub = None
+            try:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(reply_channel, _AUTH_CHANNEL)
+                for item in pubsub.listen():
+                    channel = item["channel"]
+                    if isinstance(channel, bytes):
+                        channel = channel.decode()
+                    try:
+                        if channel == _AUTH_CHANNEL:
+                            if invalidate is not None:
+                                name = item["data"]
+                                if isinstance(name, bytes):
+                                    name = name.decode()
+                                invalidate(name or None)
+                        else:
+                            deliver(codec.decode(item["data"]))
+                    except Exception as e:
+                        logger.error(
+                            f"Deliver forwarded reply error. {e}", exc_info=True
+                        )
+            except Exception as e:
+                logger.error(f"Listen forwarded replies error. {e}", exc_info=True)
+                sleep(1)
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+
+
+def create_cluster_bus(redis_uri: str = None):
+    if not redis_uri:
+        return LocalClusterBus()
+    return RedisClusterBus(Redis.from_url(redis_uri))
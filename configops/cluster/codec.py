@@ -0,0 +1,103 @@
+"""
+Wire codec of controller<->worker messages.
+
+JSON dicts are the default and what older nodes speak. Nodes that both support it
+switch to msgpack frames sent as Socket.IO binary attachments, compressed with
+zstd (when installed) or zlib above a size threshold.
+
+Frame layout: one flag byte (the compression) followed by the msgpack payload.
+"""
+
+import logging
+import zlib
+import msgpack
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+CODEC_JSON = "json"
+CODEC_MSGPACK = "msgpack"
+
+COMPRESSION_NONE = "none"
+COMPRESSION_ZLIB = "zlib"
+COMPRESSION_ZSTD = "zstd"
+
+# Payloads smaller than this are not worth compressing
+COMPRESS_THRESHOLD = 1024
+
+_FLAGS = {COMPRESSION_NONE: 0, COMPRESSION_ZLIB: 1, COMPRESSION_ZSTD: 2}
+_FLAG_NAMES = {value: key for key, value in _FLAGS.items()}
+
+
+def supported_codecs() -> list:
+    return [CODEC_MSGPACK, CODEC_JSON]
+
+
+def supported_compressions() -> list:
+    """Supported compressions, most preferred first."""
+    compressions = [COMPRESSION_ZLIB]
+    if zstandard is not None:
+        compressions.insert(0, COMPRESSION_ZSTD)
+    return compressions
+
+
+def negotiate(codecs, compressions) -> tuple[str, str]:
+    """
+    Pick the codec and compression for a peer from what it advertised.
+
+    :return: (codec, compression). JSON if the peer advertised nothing.
+    """
+    codec = CODEC_JSON
+    if codecs and CODEC_MSGPACK in codecs:
+        codec = CODEC_MSGPACK
+    compression = COMPRESSION_NONE
+    if codec == CODEC_MSGPACK and compressions:
+        for item in supported_compressions():
+            if item in compressions:
+                compression = item
+                break
+    return codec, compression
+
+
+def encode(
+    data: dict,
+    codec: str = CODEC_JSON,
+    compression: str = COMPRESSION_NONE,
+    threshold: int = COMPRESS_THRESHOLD,
+):
+    """
+    :return: The dict itself for JSON, otherwise the binary frame
+    """
+    if codec != CODEC_MSGPACK:
+        return data
+    payload = msgpack.packb(data, use_bin_type=True)
+    if len(payload) < threshold or compression == COMPRESSION_NONE:
+        compression = COMPRESSION_NONE
+    elif compression == COMPRESSION_ZSTD and zstandard is not None:
+        payload = zstandard.ZstdCompressor().compress(payload)
+    else:
+        compression = COMPRESSION_ZLIB
+        payload = zlib.compress(payload)
+    return bytes([_FLAGS[compression]]) + payload
+
+
+def decode(data) -> dict:
+    """Decode a message, whichever codec the peer used."""
+    if not isinstance(data, (bytes, bytearray, memoryview)):
+        return data
+    data = bytes(data)
+    compression = _FLAG_NAMES.get(data[0])
+    payload = data[1:]
+    if compression == COMPRESSION_ZLIB:
+        payload = zlib.decompress(payload)
+    elif compression == COMPRESSION_ZSTD:
+        if zstandard is None:
+            raise ValueError("zstd compressed message but zstandard is not installed")
+        payload = zstandard.ZstdDecompressor().decompress(payload)
+    elif compression != COMPRESSION_NONE:
+        raise ValueError(f"Unknown message frame flag: {data[0]}")
+    return msgpack.unpackb(payload, raw=False)
@@ -1,59 +1,245 @@
+import json
 import logging
+import threading
+import time
+import sqlalchemy
 from flask import request
 from flask_socketio import Namespace, emit, disconnect
-from configops.utils.constants import CONTROLLER_NAMESPACE, FutureCallback
+from configops.utils.constants import CONTROLLER_NAMESPACE, ReplyCallback
 from configops.database.db import (
     db,
     Worker,
+    WorkerInventory,
     ManagedObjects,
     GroupPermission,
 )
+from configops.cluster import codec
+from configops.cluster.bus import (
+    LocalClusterBus,
+    SESSION_REFRESH_INTERVAL,
+    create_cluster_bus,
+)
 from configops.cluster.messages import Message, MessageType
+from configops.cluster.query_cache import QueryCache
+from configops.cluster.registry import (
+    ClusterWorkerInfo,
+    HandshakeLimiter,
+    PendingRequestRegistry,
+    WorkerAuthCache,
+    WorkerRoutingTable,
+)
+from configops.config import get_config
 from configops.utils.exception import ConfigOpsException
 from typing import Optional
 
 logger = logging.getLogger(__name__)
 
-
-class ClusterWorkerInfo:
-    def __init__(self, id, sid, name):
-        self.id = id
-        self.sid = sid
-        self.name = name
+# Seconds a worker has to answer a request
+DEFAULT_REQUEST_TIMEOUT = 5.0
+# Seconds between two sweeps of expired requests
+SWEEP_INTERVAL = 1.0
+# Workers stream responses larger than this in chunks
+RESPONSE_CHUNK_SIZE = 256 * 1024
+# Connection handshakes authenticated at the same time, excess workers retry later
+MAX_CONCURRENT_HANDSHAKES = 16
+HANDSHAKE_RETRY_AFTER = 5.0
+# Seconds a worker record is cached for connection authentication
+WORKER_AUTH_CACHE_TTL = 60.0
+# Managed objects are requested from the worker only when its inventory hash changed
+INVENTORY_ON_DEMAND = "hash"
 
 
 class ControllerNamespace(Namespace):
-    def __init__(self, namespace=None, app=None):
+    def __init__(self, namespace=None, app=None, cluster_bus=None):
         super().__init__(namespace)
         self.app = app
-        self.worker_map = {}
-        self.send_callback_map = {}
+        self.routing_table = WorkerRoutingTable()
+        self.pending_requests = PendingRequestRegistry()
+        self.cluster_bus = cluster_bus or LocalClusterBus()
+        self.query_cache = QueryCache()
+        self.worker_auth_cache = WorkerAuthCache(WORKER_AUTH_CACHE_TTL)
+        self.handshake_limiter = HandshakeLimiter(
+            MAX_CONCURRENT_HANDSHAKES, HANDSHAKE_RETRY_AFTER
+        )
 
     def is_worker_online(self, worker_id) -> Optional[ClusterWorkerInfo]:
-        for worker_info in self.worker_map.values():
-            if worker_info.id == worker_id:
-                return worker_info
-        return None
+        worker_info = self.routing_table.get(worker_id)
+        if worker_info is None:
+            # Connected to another controller process
+            worker_info = self.cluster_bus.lookup(worker_id)
+        return worker_info
 
-    def send_message(self, worker_id, message: Message, callback: FutureCallback = None):
+    def send_message(
+        self,
+        worker_id,
+        message: Message,
+        callback=None,
+        timeout: float = DEFAULT_REQUEST_TIMEOUT,
+    ):
         worker_info = self.is_worker_online(worker_id)
         if worker_info:
+            if callback:
+                # Register before sending, the response may arrive first
+                self.pending_requests.register(
+                    message.request_id, worker_id, worker_info.sid, callback, timeout
+                )
+                if self.routing_table.get_by_sid(worker_info.sid) is None:
+                    # The reply arrives at the process holding the connection
+                    self.cluster_bus.track_request(message.request_id, timeout)
             emit(
                 "message",
-                message.to_dict(),
+                codec.encode(
+                    message.to_dict(), worker_info.codec, worker_info.compression
+                ),
                 to=worker_info.sid,
                 namespace=self.namespace,
                 broadcast=False,
             )
-            if callback:
-                self.send_callback_map[message.request_id] = callback
         elif callback:
             callback.on_error(ConfigOpsException("Worker is offline"))
 
+    def send_query(
+        self,
+        worker_id,
+        object_key,
+        message: Message,
+        callback,
+        timeout: float = DEFAULT_REQUEST_TIMEOUT,
+    ):
+        """
+        Send a read request, answered from the short lived cache or joined to an
+        identical request in flight when possible.
+
+        :param object_key: Key of the queried object, used to invalidate on writes
+        """
+        query = (message.type.name, json.dumps(message.data, sort_keys=True))
+        self.query_cache.request(
+            object_key,
+            query,
+            callback,
+            lambda fanout: self.send_message(worker_id, message, fanout, timeout),
+        )
+
+    def create_event(self):
+        """An event of the server's concurrency model, e.g. gevent."""
+        server = getattr(self.socketio, "server", None)
+        if server is None:
+            return threading.Event()
+        return server.eio.create_event()
+
+    def request(
+        self, worker_id, message: Message, timeout: float = DEFAULT_REQUEST_TIMEOUT
+    ):
+        """
+        Send a request and block until the worker responds.
+
+        :raise TimeoutError: No response in time
+        :raise ConfigOpsException: The worker is offline or went away
+        """
+        callback = ReplyCallback(self.create_event())
+        self.send_message(worker_id, message, callback, timeout)
+        return callback.wait(timeout)
+
+    def query(
+        self,
+        worker_id,
+        object_key,
+        message: Message,
+        timeout: float = DEFAULT_REQUEST_TIMEOUT,
+    ):
+        """Same as request(), for reads going through send_query()."""
+        callback = ReplyCallback(self.create_event())
+        self.send_query(worker_id, object_key, message, callback, timeout)
+        return callback.wait(timeout)
+
+    def start_background_tasks(self, socketio):
+        socketio.start_background_task(self.sweep_pending_requests, socketio)
+        if self.cluster_bus.shared:
+            socketio.start_background_task(
+                self.cluster_bus.listen,
+                self.deliver_reply,
+                socketio.sleep,
+                self.worker_auth_cache.invalidate,
+            )
+
+    def invalidate_worker_auth(self, name: str = None):
+        """Drop cached worker records here and on the other controller processes."""
+        self.worker_auth_cache.invalidate(name)
+        try:
+            self.cluster_bus.invalidate_worker_auth(name)
+        except Exception as e:
+            # The other processes still expire it after WORKER_AUTH_CACHE_TTL
+            logger.error(
+                f"Broadcast worker auth invalidation error. {e}", exc_info=True
+            )
+
+    def deliver_reply(self, msg: dict):
+        """Deliver a worker response, forwarding it if another process waits for it."""
+        message = Message(message=msg)
+        if message.type == MessageType.RESPONSE_CHUNK:
+            data = message.data
+            delivered = self.pending_requests.add_chunk(
+                message.request_id, data["seq"], data["chunk"], data["last"]
+            )
+        else:
+            delivered = self.pending_requests.complete(message.request_id, message.data)
+        if not delivered and not self.cluster_bus.forward_reply(
+            message.request_id, msg
+        ):
+            logger.info(
+                f"Drop response of an expired or unknown request. request_id: {message.request_id}"
+            )
+
+    def sweep_pending_requests(self, socketio):
+        """
+        Background task failing the requests whose worker did not answer in time,
+        and keeping the sessions of this process alive in the shared registry.
+        """
+        last_refresh = time.monotonic()
+        while True:
+            socketio.sleep(SWEEP_INTERVAL)
+            if time.monotonic() - last_refresh >= SESSION_REFRESH_INTERVAL:
+                last_refresh = time.monotonic()
+                try:
+                    self.cluster_bus.refresh_sessions(self.routing_table.sessions())
+                except Exception as e:
+                    logger.error(f"Refresh shared sessions error. {e}", exc_info=True)
+            try:
+                expired = self.pending_requests.sweep(
+                    lambda pending: ConfigOpsException(
+                        f"Worker request timeout. request_id: {pending.request_id}"
+                    )
+                )
+                if expired > 0:
+                    logger.warning(f"Expired {expired} pending worker requests")
+            except Exception as e:
+                logger.error(f"Sweep pending requests error. {e}", exc_info=True)
+
     def on_connect(self, auth):
+        if not self.handshake_limiter.try_acquire():
+            # Spread a reconnect storm, the worker retries after a while
+            raise ConnectionRefusedError(
+                {
+                    "message": "Connection Failure: Controller is busy",
+                    "retry_after": self.handshake_limiter.retry_after,
+                }
+            )
+        try:
+            self.__accept__(auth)
+        finally:
+            self.handshake_limiter.release()
+
+    @staticmethod
+    def __load_worker__(name) -> Optional[dict]:
+        worker = db.session.query(Worker).filter(Worker.name == name).first()
+        if not worker:
+            return None
+        return {"id": worker.id, "name": worker.name, "secret": worker.secret}
+
+    def __accept__(self, auth):
         worker_name = auth["name"]
         worker_secret = auth["secret"]
-        worker = db.session.query(Worker).filter(Worker.name == worker_name).first()
+        worker = self.worker_auth_cache.get(worker_name, self.__load_worker__)
         if not worker:
             emit(
                 "error",
@@ -63,7 +249,10 @@ class ControllerNamespace(Namespace):
                 broadcast=False,
             )
             disconnect()
-        if worker_secret != worker.secret:
+            return
+        if worker_secret != worker["secret"]:
+            # The secret may have been rotated
+            self.worker_auth_cache.invalidate(worker_name)
             emit(
                 "error",
                 {"message": "Connection Failure: Unauthorized"},
@@ -72,16 +261,45 @@ class ControllerNamespace(Namespace):
                 broadcast=False,
             )
             disconnect()
-        worker_info = ClusterWorkerInfo(worker.id, request.sid, worker.name)
-        self.worker_map[request.sid] = worker_info
+            return
+        # Older workers advertise no codecs and keep speaking JSON
+        message_codec, compression = codec.negotiate(
+            auth.get("codecs"), auth.get("compressions")
+        )
+        worker_info = ClusterWorkerInfo(
+            worker["id"], request.sid, worker["name"], message_codec, compression
+        )
+        self.routing_table.add(worker_info)
+        self.cluster_bus.register_session(worker_info)
+        if auth.get("codecs"):
+            emit(
+                "codec",
+                {
+                    "codec": message_codec,
+                    "compression": compression,
+                    "chunk_size": RESPONSE_CHUNK_SIZE,
+                    # Workers may send the inventory hash alone
+                    "inventory": INVENTORY_ON_DEMAND,
+                },
+                to=request.sid,
+                namespace=self.namespace,
+                broadcast=False,
+            )
 
     def on_disconnect(self, reason):
         logger.info(f"Client disconnected, reason: {reason}")
         disconnect()
-        self.worker_map.pop(request.sid)
+        worker_info = self.routing_table.remove(request.sid)
+        if worker_info is not None:
+            self.cluster_bus.unregister_session(worker_info)
+        self.pending_requests.fail_session(
+            request.sid, ConfigOpsException("Worker disconnected")
+        )
 
     def on_message(self, msg):
+        msg = codec.decode(msg)
         logger.info(f"Received message: {msg}")
+        self.routing_table.touch(request.sid)
         message = Message(message=msg)
         handler = MESSAGE_HANDLER_MAP.get(message.type.name)
         if handler:
@@ -95,78 +313,138 @@ class BaseMessageHandler:
 
 class ManagedObjectsMessageHandler(BaseMessageHandler):
 
-    def handle_managed_objects(self, worker_info, items):
-        add_objects = []
-        remain_ids = []
-        for item in items:
-            managed_object = (
-                db.session.query(ManagedObjects)
-                .filter(
-                    ManagedObjects.worker_id == worker_info.id,
-                    ManagedObjects.system_id == item["id"],
-                    ManagedObjects.system_type == item["system_type"],
-                )
-                .first()
+    def inventory_unchanged(self, worker_info, inventory_hash, count) -> bool:
+        """
+        Whether the stored managed objects still match what the worker reports.
+        The row count is checked as well, rows may be removed behind our back.
+        """
+        if not inventory_hash:
+            return False
+        inventory = db.session.get(WorkerInventory, worker_info.id)
+        if inventory is None or inventory.inventory_hash != inventory_hash:
+            return False
+        stored = db.session.scalar(
+            sqlalchemy.select(sqlalchemy.func.count(ManagedObjects.id)).where(
+                ManagedObjects.worker_id == worker_info.id
             )
-            if managed_object:
-                managed_object.url = item["url"]
-                remain_ids.append(managed_object.id)
-            else:
-                managed_object = ManagedObjects(
-                    worker_id=worker_info.id,
-                    system_id=item["id"],
-                    system_type=item["system_type"],
-                    url=item["url"],
-                )
-                add_objects.append(managed_object)
-
-        delete_objects = (
-            db.session.query(ManagedObjects)
-            .filter(
-                ManagedObjects.worker_id == worker_info.id,
-                ManagedObjects.id.not_in(remain_ids),
-            )
-            .all()
         )
+        return stored == count
 
-        if len(delete_objects) > 0:
-            object_ids = [item.id for item in delete_objects]
+    def handle_managed_objects(self, worker_info, items, inventory_hash=None):
+        """
+        Sync the managed objects of a worker with a set-based diff. Skipped when
+        the worker reports the same inventory as last time.
+        """
+        if self.inventory_unchanged(worker_info, inventory_hash, len(items)):
+            logger.info(f"Managed objects unchanged. worker: {worker_info.name}")
+            return
 
-            db.session.query(GroupPermission).filter(
-                GroupPermission.source_id.in_(object_ids),
-                GroupPermission.type == "OBJECT",
-            ).delete()
+        inventory = db.session.get(WorkerInventory, worker_info.id)
+        existing = {
+            (row.system_type, row.system_id): row
+            for row in db.session.execute(
+                sqlalchemy.select(
+                    ManagedObjects.id,
+                    ManagedObjects.system_id,
+                    ManagedObjects.system_type,
+                    ManagedObjects.url,
+                ).where(ManagedObjects.worker_id == worker_info.id)
+            ).all()
+        }
+        reported = {(item["system_type"], item["id"]): item for item in items}
 
-            for item in delete_objects:
-                db.session.delete(item)
+        add_rows = [
+            {
+                "worker_id": worker_info.id,
+                "system_id": item["id"],
+                "system_type": item["system_type"],
+                "url": item["url"],
+            }
+            for key, item in reported.items()
+            if key not in existing
+        ]
+        update_rows = [
+            {"id": existing[key].id, "url": item["url"]}
+            for key, item in reported.items()
+            if key in existing and existing[key].url != item["url"]
+        ]
+        delete_ids = [row.id for key, row in existing.items() if key not in reported]
 
-        if len(add_objects) > 0:
-            db.session.add_all(add_objects)
+        if len(delete_ids) > 0:
+            db.session.execute(
+                sqlalchemy.delete(GroupPermission).where(
+                    GroupPermission.source_id.in_(delete_ids),
+                    GroupPermission.type == "OBJECT",
+                )
+            )
+            db.session.execute(
+                sqlalchemy.delete(ManagedObjects).where(
+                    ManagedObjects.id.in_(delete_ids)
+                )
+            )
+        if len(add_rows) > 0:
+            db.session.execute(sqlalchemy.insert(ManagedObjects), add_rows)
+        if len(update_rows) > 0:
+            db.session.execute(sqlalchemy.update(ManagedObjects), update_rows)
 
+        if inventory_hash:
+            if inventory:
+                inventory.inventory_hash = inventory_hash
+            else:
+                db.session.add(
+                    WorkerInventory(
+                        worker_id=worker_info.id, inventory_hash=inventory_hash
+                    )
+                )
+        elif inventory:
+            db.session.delete(inventory)
         db.session.commit()
+        logger.info(
+            f"Managed objects synced. worker: {worker_info.name}, added: {len(add_rows)}, updated: {len(update_rows)}, deleted: {len(delete_ids)}"
+        )
 
     def handle(self, sid, message: Message, namespace: ControllerNamespace):
         logger.info("Handle managed objects")
-        worker_info = namespace.worker_map[sid]
-        self.handle_managed_objects(worker_info, message.data)
+        worker_info = namespace.routing_table.get_by_sid(sid)
+        data = message.data
+        if isinstance(data, dict):
+            # Requested by the controller after a hash-only worker info
+            self.handle_managed_objects(
+                worker_info, data["managed_objects"], data.get("managed_objects_hash")
+            )
+        else:
+            self.handle_managed_objects(worker_info, data)
 
 
 class WorkerInfoMessageHandler(ManagedObjectsMessageHandler):
     def handle(self, sid, message: Message, namespace: ControllerNamespace):
         logger.info("Handle worker info")
-        worker_info = namespace.worker_map[sid]
-        self.handle_managed_objects(worker_info, message.data["managed_objects"])
+        worker_info = namespace.routing_table.get_by_sid(sid)
+        if "managed_objects" in message.data:
+            self.handle_managed_objects(
+                worker_info,
+                message.data["managed_objects"],
+                message.data.get("managed_objects_hash"),
+            )
+        elif not self.inventory_unchanged(
+            worker_info,
+            message.data.get("managed_objects_hash"),
+            message.data.get("managed_objects_count"),
+        ):
+            # Only the hash was sent, ask the worker for the full inventory
+            namespace.send_message(
+                worker_info.id, Message(type=MessageType.MANAGED_OBJECTS)
+            )
         worker = db.session.query(Worker).filter(Worker.id == worker_info.id).first()
-        worker.version = message.data["version"]
-        db.session.commit()
+        if worker.version != message.data["version"]:
+            worker.version = message.data["version"]
+            db.session.commit()
 
 
 class CommonFuturedMessageHandler(BaseMessageHandler):
-    
+
     def handle(self, sid, message: Message, namespace: ControllerNamespace):
-        callable = namespace.send_callback_map.pop(message.request_id)
-        if callable:
-            callable.on_complete(message.data)
+        namespace.deliver_reply(message.to_dict())
 
 MESSAGE_HANDLER_MAP = {}
 
@@ -195,8 +473,16 @@ def register(socketio, app) -> ControllerNamespace:
         CommonFuturedMessageHandler()
     )
     MESSAGE_HANDLER_MAP[MessageType.UPGRADE_WORKER.name] = CommonFuturedMessageHandler()
+    MESSAGE_HANDLER_MAP[MessageType.RESPONSE_CHUNK.name] = (
+        CommonFuturedMessageHandler()
+    )
+    MESSAGE_HANDLER_MAP[MessageType.WORKER_STATS.name] = CommonFuturedMessageHandler()
 
-    controller = ControllerNamespace("/controller", app)
+    redis_uri = get_config(app, "config.cluster.redis_uri")
+    controller = ControllerNamespace(
+        "/controller", app, create_cluster_bus(redis_uri)
+    )
     socketio.on_namespace(controller)
     app.config[CONTROLLER_NAMESPACE] = controller
     logger.info("SocketIO namespace registered")
+    return controller
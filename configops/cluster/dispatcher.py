@@ -0,0 +1,110 @@
+import collections
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+# Queued messages of one type above which a warning is logged
+QUEUE_DEPTH_WARNING = 32
+
+
+class _TypeState:
+    __slots__ = ("limit", "running", "waiting", "processed", "max_depth")
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.running = 0
+        self.waiting = collections.deque()
+        self.processed = 0
+        self.max_depth = 0
+
+
+class MessageDispatcher:
+    """
+    Runs message handlers on a bounded thread pool.
+
+    Every message type has its own concurrency limit. Messages over the limit wait
+    in a per type queue instead of occupying a pool thread, so a slow type (e.g. an
+    upgrade download) can not starve the others.
+    """
+
+    def __init__(self, max_workers: int = 8, type_limits: dict = None):
+        self.max_workers = max_workers
+        self.type_limits = type_limits or {}
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="worker-message"
+        )
+        self._lock = threading.Lock()
+        self._states = {}
+
+    def _state(self, message_type: str) -> _TypeState:
+        state = self._states.get(message_type)
+        if state is None:
+            limit = self.type_limits.get(message_type, self.max_workers)
+            state = _TypeState(max(1, min(limit, self.max_workers)))
+            self._states[message_type] = state
+        return state
+
+    def dispatch(self, message_type: str, task: Callable):
+        with self._lock:
+            state = self._state(message_type)
+            if state.running < state.limit:
+                state.running += 1
+            else:
+                state.waiting.append(task)
+                depth = len(state.waiting)
+                state.max_depth = max(state.max_depth, depth)
+                if depth >= QUEUE_DEPTH_WARNING and depth % QUEUE_DEPTH_WARNING == 0:
+                    logger.warning(
+                        f"Message queue is deep. type: {message_type}, depth: {depth}"
+                    )
+                return
+        self._executor.submit(self._run, message_type, task)
+
+    def _run(self, message_type: str, task: Callable):
+        while task is not None:
+            try:
+                task()
+            except Exception as e:
+                logger.error(
+                    f"Handle [{message_type}] message error. {e}", exc_info=True
+                )
+            with self._lock:
+                state = self._states[message_type]
+                state.processed += 1
+                if state.waiting:
+                    # Keep the slot and run the next queued message of this type
+                    task = state.waiting.popleft()
+                else:
+                    state.running -= 1
+                    task = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                message_type: {
+                    "limit": state.limit,
+                    "running": state.running,
+                    "queued": len(state.waiting),
+                    "max_queued": state.max_depth,
+                    "processed": state.processed,
+                }
+                for message_type, state in self._states.items()
+            }
+
+    def report(self) -> dict:
+        """Queue depths and saturation of the pool, with the stats of every type."""
+        types = self.stats()
+        running = sum(item["running"] for item in types.values())
+        return {
+            "max_workers": self.max_workers,
+            "running": running,
+            "queued": sum(item["queued"] for item in types.values()),
+            "saturation": running / self.max_workers if self.max_workers else 0.0,
+            "types": types,
+        }
+
+    def shutdown(self, wait: bool = False):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
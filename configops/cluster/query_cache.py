@@ -0,0 +1,168 @@
+import json
+import logging
+import threading
+import time
+from typing import Callable
+from configops.api.utils import RESP_OK
+from configops.utils.exception import ConfigOpsException
+
+logger = logging.getLogger(__name__)
+
+# Seconds a read result is served from the cache
+QUERY_CACHE_TTL = 5.0
+# Streamed responses larger than this are neither cached nor joined once past it
+MAX_BUFFERED_BYTES = 4 * 1024 * 1024
+# Expired results are purged once the cache holds more entries than this
+MAX_CACHED_RESULTS = 1024
+
+
+def _is_streaming(callback) -> bool:
+    return hasattr(callback, "on_chunk")
+
+
+def _deliver(callback, value):
+    """Hand a result, a dict or a JSON encoded body, to a callback."""
+    if isinstance(value, bytes):
+        if _is_streaming(callback):
+            callback.on_chunk(value, True)
+        else:
+            callback.on_complete(json.loads(value))
+    else:
+        callback.on_complete(value)
+
+
+class _InFlightQuery:
+    """
+    Fans the response of one worker request out to every caller waiting for it.
+    Streamed chunks are buffered, so callers joining late are replayed the start.
+    """
+
+    def __init__(self, cache, key, generation):
+        self.cache = cache
+        self.key = key
+        self.generation = generation
+        self.lock = threading.Lock()
+        self.waiters = []
+        self.chunks = []
+        self.buffered = 0
+        self.overflow = False
+        self.done = False
+
+    def join(self, callback) -> bool:
+        with self.lock:
+            if self.done or self.overflow:
+                return False
+            if _is_streaming(callback):
+                for chunk in self.chunks:
+                    callback.on_chunk(chunk, False)
+            self.waiters.append(callback)
+            return True
+
+    def on_chunk(self, chunk: bytes, last: bool):
+        with self.lock:
+            waiters = list(self.waiters)
+            # Callers without on_chunk get the whole response, whatever its size
+            assembling = any(not _is_streaming(waiter) for waiter in waiters)
+            self.buffered += len(chunk)
+            if not self.overflow and self.buffered > MAX_BUFFERED_BYTES:
+                self.overflow = True
+            if assembling or not self.overflow:
+                self.chunks.append(chunk)
+            else:
+                self.chunks = []
+            if last:
+                self.done = True
+            body = b"".join(self.chunks) if last and self.chunks else None
+        for waiter in waiters:
+            if _is_streaming(waiter):
+                waiter.on_chunk(chunk, last)
+        if not last:
+            return
+        self.cache._finish(self, None if self.overflow else body)
+        for waiter in waiters:
+            if not _is_streaming(waiter):
+                waiter.on_complete(json.loads(body))
+
+    def on_complete(self, result):
+        with self.lock:
+            self.done = True
+            waiters = list(self.waiters)
+        cacheable = isinstance(result, dict) and result.get("code") == RESP_OK
+        self.cache._finish(self, result if cacheable else None)
+        for waiter in waiters:
+            waiter.on_complete(result)
+
+    def on_error(self, error: Exception):
+        with self.lock:
+            self.done = True
+            waiters = list(self.waiters)
+        self.cache._finish(self, None)
+        for waiter in waiters:
+            waiter.on_error(error)
+
+
+class QueryCache:
+    """
+    Coalesces identical read requests to workers and caches their results for a
+    short while. Keys are (object key, query). Writes to an object invalidate its
+    entries, results of requests in flight during a write are not cached.
+    """
+
+    def __init__(self, ttl: float = QUERY_CACHE_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._results = {}  # key -> (expire at, value)
+        self._in_flight = {}  # key -> _InFlightQuery
+        self._generations = {}  # object key -> generation
+
+    def request(self, object_key, query, callback, send: Callable):
+        """
+        :param send: Called with the callback of a new worker request when neither a
+            cached result nor an identical request in flight exists
+        """
+        key = (object_key, query)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is not None and cached[0] <= now:
+                self._results.pop(key, None)
+                cached = None
+            in_flight = None if cached else self._in_flight.get(key)
+            if in_flight is not None and not in_flight.join(callback):
+                in_flight = None
+            if cached is None and in_flight is None:
+                in_flight = _InFlightQuery(
+                    self, key, self._generations.get(object_key, 0)
+                )
+                in_flight.join(callback)
+                self._in_flight[key] = in_flight
+                new_request = True
+            else:
+                new_request = False
+        if cached is not None:
+            _deliver(callback, cached[1])
+        elif new_request:
+            send(in_flight)
+
+    def _finish(self, in_flight: _InFlightQuery, value):
+        object_key = in_flight.key[0]
+        with self._lock:
+            if self._in_flight.get(in_flight.key) is in_flight:
+                self._in_flight.pop(in_flight.key, None)
+            if value is not None and in_flight.generation == self._generations.get(
+                object_key, 0
+            ):
+                now = time.monotonic()
+                if len(self._results) >= MAX_CACHED_RESULTS:
+                    for key in [k for k, v in self._results.items() if v[0] <= now]:
+                        self._results.pop(key, None)
+                self._results[in_flight.key] = (now + self.ttl, value)
+
+    def invalidate(self, object_key):
+        with self._lock:
+            self._generations[object_key] = self._generations.get(object_key, 0) + 1
+            for key in [key for key in self._results if key[0] == object_key]:
+                self._results.pop(key, None)
+            # Later callers must not join requests started before the write
+            for key in [key for key in self._in_flight if key[0] == object_key]:
+                self._in_flight.pop(key, None)
@@ -0,0 +1,316 @@
+import json
+import threading
+import time
+from typing import Optional
+from configops.cluster.codec import CODEC_JSON, COMPRESSION_NONE
+
+
+class ClusterWorkerInfo:
+    def __init__(
+        self, id, sid, name, codec=CODEC_JSON, compression=COMPRESSION_NONE
+    ):
+        self.id = id
+        self.sid = sid
+        self.name = name
+        self.codec = codec
+        self.compression = compression
+        self.connected_at = time.time()
+        self.last_seen = self.connected_at
+
+
+class WorkerRoutingTable:
+    """
+    Routing table of connected workers, indexed by socket session id and by worker id.
+
+    A worker may hold more than one session for a while, e.g. when it reconnects
+    before the controller noticed the old connection dropped. Messages are routed
+    to the session seen most recently.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions = {}  # sid -> ClusterWorkerInfo
+        self._worker_sids = {}  # worker id -> set of sid
+
+    def add(self, worker_info: ClusterWorkerInfo):
+        with self._lock:
+            previous = self._sessions.get(worker_info.sid)
+            if previous is not None:
+                self._discard(previous)
+            self._sessions[worker_info.sid] = worker_info
+            self._worker_sids.setdefault(worker_info.id, set()).add(worker_info.sid)
+
+    def remove(self, sid) -> Optional[ClusterWorkerInfo]:
+        with self._lock:
+            worker_info = self._sessions.pop(sid, None)
+            if worker_info is not None:
+                self._discard(worker_info)
+            return worker_info
+
+    def _discard(self, worker_info: ClusterWorkerInfo):
+        sids = self._worker_sids.get(worker_info.id)
+        if sids is not None:
+            sids.discard(worker_info.sid)
+            if len(sids) == 0:
+                self._worker_sids.pop(worker_info.id, None)
+
+    def touch(self, sid) -> Optional[ClusterWorkerInfo]:
+        worker_info = self._sessions.get(sid)
+        if worker_info is not None:
+            worker_info.last_seen = time.time()
+        return worker_info
+
+    def get_by_sid(self, sid) -> Optional[ClusterWorkerInfo]:
+        return self._sessions.get(sid)
+
+    def get(self, worker_id) -> Optional[ClusterWorkerInfo]:
+        """Get the live session of a worker, the most recently seen one if several."""
+        with self._lock:
+            sids = self._worker_sids.get(worker_id)
+            if not sids:
+                return None
+            if len(sids) == 1:
+                return self._sessions.get(next(iter(sids)))
+            return max(
+                (self._sessions[sid] for sid in sids),
+                key=lambda item: (item.last_seen, item.connected_at),
+            )
+
+    def get_sessions(self, worker_id) -> list:
+        with self._lock:
+            sids = self._worker_sids.get(worker_id, ())
+            return [self._sessions[sid] for sid in sids]
+
+    def sessions(self) -> list:
+        with self._lock:
+            return list(self._sessions.values())
+
+    def worker_ids(self) -> list:
+        with self._lock:
+            return list(self._worker_sids.keys())
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+class _PendingRequest:
+    __slots__ = (
+        "request_id",
+        "worker_id",
+        "sid",
+        "callback",
+        "timeout",
+        "deadline",
+        "next_seq",
+        "chunks",
+    )
+
+    def __init__(self, request_id, worker_id, sid, callback, timeout):
+        self.request_id = request_id
+        self.worker_id = worker_id
+        self.sid = sid
+        self.callback = callback
+        self.timeout = timeout
+        self.deadline = time.monotonic() + timeout
+        self.next_seq = 0
+        self.chunks = []
+
+
+class _WorkerRequestStats:
+    __slots__ = ("in_flight", "completed", "timeouts", "failed")
+
+    def __init__(self):
+        self.in_flight = 0
+        self.completed = 0
+        self.timeouts = 0
+        self.failed = 0
+
+    def to_dict(self) -> dict:
+        finished = self.completed + self.timeouts + self.failed
+        return {
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "timeouts": self.timeouts,
+            "failed": self.failed,
+            "timeout_rate": self.timeouts / finished if finished else 0.0,
+        }
+
+
+class PendingRequestRegistry:
+    """
+    Callbacks of controller->worker requests waiting for a response.
+
+    Every request has a deadline. Requests past their deadline are failed by
+    sweep(), requests sent to a session that disconnects are failed at once,
+    so no callback outlives its caller.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}  # request id -> _PendingRequest
+        self._stats = {}  # worker id -> _WorkerRequestStats
+
+    def _worker_stats(self, worker_id) -> _WorkerRequestStats:
+        stats = self._stats.get(worker_id)
+        if stats is None:
+            stats = _WorkerRequestStats()
+            self._stats[worker_id] = stats
+        return stats
+
+    def register(self, request_id, worker_id, sid, callback, timeout: float):
+        with self._lock:
+            self._pending[request_id] = _PendingRequest(
+                request_id, worker_id, sid, callback, timeout
+            )
+            self._worker_stats(worker_id).in_flight += 1
+
+    def _pop(self, request_id) -> Optional[_PendingRequest]:
+        pending = self._pending.pop(request_id, None)
+        if pending is not None:
+            self._worker_stats(pending.worker_id).in_flight -= 1
+        return pending
+
+    def complete(self, request_id, result) -> bool:
+        """
+        :return: False if the request is unknown, e.g. it already timed out
+        """
+        with self._lock:
+            pending = self._pop(request_id)
+            if pending is None:
+                return False
+            self._worker_stats(pending.worker_id).completed += 1
+        pending.callback.on_complete(result)
+        return True
+
+    def add_chunk(self, request_id, seq: int, chunk: bytes, last: bool) -> bool:
+        """
+        Receive one chunk of a streamed response. Every chunk restarts the deadline.
+        Callbacks with on_chunk get the chunks as they come, others get the
+        reassembled response once the last chunk arrived.
+
+        :return: False if the request is unknown, e.g. it already timed out
+        """
+        error = None
+        with self._lock:
+            pending = self._pending.get(request_id)
+            if pending is None:
+                return False
+            if seq != pending.next_seq:
+                self._pop(request_id)
+                self._worker_stats(pending.worker_id).failed += 1
+                error = ValueError(
+                    f"Response chunk out of order. expected: {pending.next_seq}, actual: {seq}"
+                )
+            else:
+                pending.next_seq += 1
+                pending.deadline = time.monotonic() + pending.timeout
+                if last:
+                    self._pop(request_id)
+                    self._worker_stats(pending.worker_id).completed += 1
+        if error is not None:
+            pending.chunks = []
+            pending.callback.on_error(error)
+            return True
+
+        on_chunk = getattr(pending.callback, "on_chunk", None)
+        if on_chunk is not None:
+            on_chunk(chunk, last)
+        else:
+            pending.chunks.append(chunk)
+            if last:
+                body = b"".join(pending.chunks)
+                pending.chunks = []
+                pending.callback.on_complete(json.loads(body))
+        return True
+
+    def fail_session(self, sid, error: Exception) -> int:
+        """Fail the requests sent to a session that went away."""
+        with self._lock:
+            failed = [
+                self._pop(item.request_id)
+                for item in list(self._pending.values())
+                if item.sid == sid
+            ]
+            for pending in failed:
+                self._worker_stats(pending.worker_id).failed += 1
+        for pending in failed:
+            pending.callback.on_error(error)
+        return len(failed)
+
+    def sweep(self, error_factory, now: float = None) -> int:
+        """Fail the requests past their deadline."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            expired = [
+                self._pop(item.request_id)
+                for item in list(self._pending.values())
+                if item.deadline <= now
+            ]
+            for pending in expired:
+                self._worker_stats(pending.worker_id).timeouts += 1
+        for pending in expired:
+            pending.callback.on_error(error_factory(pending))
+        return len(expired)
+
+    def stats(self, worker_id=None) -> dict:
+        with self._lock:
+            if worker_id is not None:
+                return self._worker_stats(worker_id).to_dict()
+            return {key: value.to_dict() for key, value in self._stats.items()}
+
+    def __len__(self):
+        return len(self._pending)
+
+
+class WorkerAuthCache:
+    """
+    Short lived cache of the worker records used to authenticate connections, so a
+    reconnect storm does not load every worker from the database again.
+    """
+
+    def __init__(self, ttl: float = 60.0):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._items = {}  # name -> (expire at, worker info dict)
+
+    def get(self, name: str, loader) -> Optional[dict]:
+        now = time.monotonic()
+        with self._lock:
+            item = self._items.get(name)
+            if item is not None and item[0] > now:
+                return item[1]
+        worker = loader(name)
+        if worker is not None:
+            with self._lock:
+                self._items[name] = (now + self.ttl, worker)
+        return worker
+
+    def invalidate(self, name: str = None):
+        with self._lock:
+            if name is None:
+                self._items.clear()
+            else:
+                self._items.pop(name, None)
+
+
+class HandshakeLimiter:
+    """Caps the number of connection handshakes authenticated at the same time."""
+
+    def __init__(self, max_concurrent: int = 16, retry_after: float = 5.0):
+        self.max_concurrent = max_concurrent
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._running = 0
+        self.rejected = 0
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self._running >= self.max_concurrent:
+                self.rejected += 1
+                return False
+            self._running += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._running -= 1
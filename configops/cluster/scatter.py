@@ -0,0 +1,84 @@
+"""
+Scatter-gather of a read request over many managed objects.
+
+The request is sent to every target at once, each one gets the same deadline.
+Targets answering late or failing do not fail the whole request, their status
+is reported next to the results gathered from the others.
+"""
+
+import heapq
+import itertools
+import logging
+import time
+from typing import Callable
+from configops.api.utils import RESP_OK
+from configops.cluster.messages import Message
+from configops.utils.constants import ReplyCallback
+
+logger = logging.getLogger(__name__)
+
+STATUS_OK = "OK"
+STATUS_OFFLINE = "OFFLINE"
+STATUS_TIMEOUT = "TIMEOUT"
+STATUS_ERROR = "ERROR"
+# Set by callers, the worker answered but is too old for the request
+STATUS_UNSUPPORTED = "UNSUPPORTED"
+
+
+class ScatterTarget:
+    def __init__(self, id, worker_id, message: Message):
+        self.id = id
+        self.worker_id = worker_id
+        self.message = message
+        self.status = None
+        self.msg = None
+        self.result = None
+
+    def to_dict(self) -> dict:
+        return {"id": self.id, "status": self.status, "msg": self.msg}
+
+
+def scatter(controller_namespace, targets: list, timeout: float) -> list:
+    """
+    Send the message of every target to its worker and wait for the responses until
+    the deadline. Sets status, msg and result of every target.
+    """
+    deadline = time.monotonic() + timeout
+    callbacks = []
+    for target in targets:
+        if not controller_namespace.is_worker_online(target.worker_id):
+            target.status = STATUS_OFFLINE
+            target.msg = "Worker is offline"
+            continue
+        callback = ReplyCallback(controller_namespace.create_event())
+        callbacks.append((target, callback))
+        controller_namespace.send_query(
+            target.worker_id, target.id, target.message, callback, timeout
+        )
+
+    for target, callback in callbacks:
+        try:
+            result = callback.wait(max(0.0, deadline - time.monotonic()))
+        except TimeoutError:
+            target.status = STATUS_TIMEOUT
+            target.msg = f"No response in {timeout}s"
+            continue
+        except Exception as e:
+            target.status = STATUS_ERROR
+            target.msg = str(e)
+            continue
+        if isinstance(result, dict) and result.get("code") == RESP_OK:
+            target.status = STATUS_OK
+            target.result = result
+        else:
+            target.status = STATUS_ERROR
+            target.msg = result.get("msg") if isinstance(result, dict) else None
+    return targets
+
+
+def merge_sorted(
+    item_lists: list, key: Callable, offset: int, size: int, reverse: bool = False
+) -> list:
+    """k-way merge of lists sorted by the same key, returns one page of the result."""
+    merged = heapq.merge(*item_lists, key=key, reverse=reverse)
+    return list(itertools.islice(merged, offset, offset + size))
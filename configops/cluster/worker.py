@@ -1,5 +1,9 @@
+import hashlib
+import json
 import logging
+import random
 import socketio
+import threading
 import time
 from configops.utils.exception import ConfigOpsException
 from configops.utils.constants import (
@@ -8,6 +12,8 @@ from configops.utils.constants import (
 )
 import configops
 from configops.config import get_config, get_node_cfg
+from configops.cluster import codec
+from configops.cluster.dispatcher import MessageDispatcher
 from configops.cluster.messages import Message, MessageType
 from configops.cluster.worker_handler import MESSAGE_HANDLER_MAP
 from configops.api.utils import BaseResult
@@ -16,25 +22,95 @@ from urllib.parse import urlparse
 
 logger = logging.getLogger(__name__)
 
+# Reconnect backoff in seconds, randomized so workers do not reconnect in lockstep
+RECONNECT_DELAY = 2
+RECONNECT_DELAY_MAX = 60
+
+# Reconnects are driven by WorkerNamespace.reconnect(), which honours retry_after
 sio = socketio.Client(
-    reconnection=True,
-    reconnection_delay_max=10,
-    reconnection_delay=2,
+    reconnection=False,
     logger=True,
     engineio_logger=True,
 )
 
 
+def get_retry_delay(attempt: int, retry_after: float = None) -> float:
+    """Exponential backoff with full jitter, at least what the controller asked for."""
+    delay = random.uniform(0, min(RECONNECT_DELAY_MAX, RECONNECT_DELAY * 2**attempt))
+    if retry_after:
+        delay = max(delay, retry_after * random.uniform(1, 2))
+    return delay
+
+
+# Default number of threads handling controller messages
+DEFAULT_MESSAGE_WORKERS = 8
+# Concurrency limits per message type. Changelog edits run one at a time to keep
+# their order, a worker upgrade is never run twice at once.
+MESSAGE_TYPE_LIMITS = {
+    MessageType.UPGRADE_WORKER.name: 1,
+    MessageType.DELETE_CHANGE_LOG.name: 1,
+    MessageType.EDIT_CHNAGE_LOG.name: 1,
+    MessageType.QUERY_CHANGE_LOG.name: 4,
+    MessageType.QUERY_CHANGE_SET.name: 4,
+    MessageType.QUERY_SECRET.name: 4,
+}
+
+
 class WorkerNamespace(socketio.ClientNamespace):
     def __init__(self, app, namespace=None):
         super().__init__(namespace)
         self.app = app
+        node_config = get_node_cfg(app) or {}
+        self.dispatcher = MessageDispatcher(
+            node_config.get("message_workers") or DEFAULT_MESSAGE_WORKERS,
+            MESSAGE_TYPE_LIMITS,
+        )
+        self.send_lock = threading.Lock()
+        self.reconnect_lock = threading.Lock()
+        self.retry_after = None
+        self.codec = codec.CODEC_JSON
+        self.compression = codec.COMPRESSION_NONE
+        self.chunk_size = None
+        self.inventory_on_demand = False
+
+    def send_message(self, message: Message):
+        data = codec.encode(message.to_dict(), self.codec, self.compression)
+        with self.send_lock:
+            self.send(data)
+
+    def send_response(self, resp: Message):
+        """Send a response, in ordered chunks if it is large and the controller supports it."""
+        if self.chunk_size:
+            body = json.dumps(resp.data, ensure_ascii=False).encode("utf-8")
+            if len(body) > self.chunk_size:
+                for seq, offset in enumerate(range(0, len(body), self.chunk_size)):
+                    end = offset + self.chunk_size
+                    chunk = Message(
+                        type=MessageType.RESPONSE_CHUNK,
+                        data={
+                            "type": resp.type.name,
+                            "seq": seq,
+                            "last": end >= len(body),
+                            "chunk": body[offset:end],
+                        },
+                        request_id=resp.request_id,
+                    )
+                    self.send_message(chunk)
+                return
+        self.send_message(resp)
 
     def on_error(self, data):
         logger.error(f"Error: {data}")
 
-    def on_connect(self):
-        logger.info("Connected to the controller")
+    def on_codec(self, data):
+        logger.info(f"Message codec negotiated: {data}")
+        self.codec = data.get("codec", codec.CODEC_JSON)
+        self.compression = data.get("compression", codec.COMPRESSION_NONE)
+        self.chunk_size = data.get("chunk_size")
+        self.inventory_on_demand = data.get("inventory") == "hash"
+
+    def collect_managed_objects(self):
+        """Managed objects from the node config, with a hash of them."""
         managed_objects = []
         nacos_cfg_map = get_config(self.app, "nacos")
         if nacos_cfg_map and len(nacos_cfg_map) > 0:
@@ -84,22 +160,84 @@ class WorkerNamespace(socketio.ClientNamespace):
                         "dialect": "",
                     }
                 )
-        data = {"version": configops.__version__, "managed_objects": managed_objects}
+        managed_objects_hash = hashlib.sha256(
+            json.dumps(managed_objects, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+        return managed_objects, managed_objects_hash
+
+    def on_connect(self):
+        logger.info("Connected to the controller")
+        managed_objects, managed_objects_hash = self.collect_managed_objects()
+        data = {
+            "version": configops.__version__,
+            "managed_objects_hash": managed_objects_hash,
+            "managed_objects_count": len(managed_objects),
+        }
+        if not self.inventory_on_demand:
+            # Older controllers expect the full inventory on every connect
+            data["managed_objects"] = managed_objects
         message = Message(type=MessageType.WORKER_INFO, data=data)
-        self.send(message.to_dict())
+        self.send_message(message)
+
+    def send_managed_objects(self):
+        managed_objects, managed_objects_hash = self.collect_managed_objects()
+        message = Message(
+            type=MessageType.MANAGED_OBJECTS,
+            data={
+                "managed_objects": managed_objects,
+                "managed_objects_hash": managed_objects_hash,
+            },
+        )
+        self.send_message(message)
 
-    def on_disconnect(self):
-        logger.info("❌ Disconnected from controller")
-        # self.connect_with_retry()
+    def on_disconnect(self, reason=None):
+        logger.info(f"❌ Disconnected from controller, reason: {reason}")
+        # Negotiated again on the next connection
+        self.codec = codec.CODEC_JSON
+        self.compression = codec.COMPRESSION_NONE
+        self.chunk_size = None
+        self.inventory_on_demand = False
+        if reason != sio.reason.CLIENT_DISCONNECT:
+            sio.start_background_task(self.reconnect)
 
     def on_connect_error(self, data):
         print("⚠️ Connection failed:", data)
+        if isinstance(data, dict) and data.get("retry_after"):
+            self.retry_after = data["retry_after"]
 
-    def on_reconnect(self):
-        print("🔄 Reconnected")
+    def reconnect(self):
+        # Jittered, a restarted controller is not hit by every worker at once
+        if not self.reconnect_lock.acquire(blocking=False):
+            return
+        try:
+            delay = get_retry_delay(0, self.retry_after)
+            self.retry_after = None
+            time.sleep(delay)
+            self.connect_with_retry()
+            print("🔄 Reconnected")
+        finally:
+            self.reconnect_lock.release()
 
     def on_message(self, msg):
-        req = Message(message=msg)
+        # Handlers run on the dispatcher threads, responses may go back out of order
+        req = Message(message=codec.decode(msg))
+        if req.type == MessageType.WORKER_STATS:
+            # Answered at once, even when every dispatcher thread is busy
+            self.send_response(
+                Message(
+                    type=req.type,
+                    data=BaseResult.ok(self.dispatcher.report()).to_dict(),
+                    request_id=req.request_id,
+                )
+            )
+            return
+        if req.type == MessageType.MANAGED_OBJECTS:
+            # The controller found the stored inventory out of date
+            self.send_managed_objects()
+            return
+        self.dispatcher.dispatch(req.type.name, lambda: self.handle_message(req))
+
+    def handle_message(self, req: Message):
         resp = None
         try:
             handler = MESSAGE_HANDLER_MAP.get(req.type.name)
@@ -126,7 +264,7 @@ class WorkerNamespace(socketio.ClientNamespace):
                 ).to_dict(),
                 request_id=req.request_id,
             )
-        self.send(resp.to_dict())
+        self.send_response(resp)
 
     def connect_with_retry(self):
         node_config = get_node_cfg(self.app)
@@ -155,18 +293,27 @@ class WorkerNamespace(socketio.ClientNamespace):
         if not socketio_path:
             socketio_path = "socket.io"
 
+        attempt = 0
         while not sio.connected:
             try:
                 logger.info("Trying to connect")
                 sio.connect(
                     url=connection_url,
-                    auth={"name": name, "secret": secret},
+                    auth={
+                        "name": name,
+                        "secret": secret,
+                        "codecs": codec.supported_codecs(),
+                        "compressions": codec.supported_compressions(),
+                    },
                     namespaces=["/controller"],
                     socketio_path=socketio_path,
                 )
             except Exception as e:
-                logger.info(f"Connect fail. retry. {e}")
-                time.sleep(5)
+                delay = get_retry_delay(attempt, self.retry_after)
+                self.retry_after = None
+                attempt += 1
+                logger.info(f"Connect fail. retry in {delay:.1f}s. {e}")
+                time.sleep(delay)
 
 
 # =======================================================================================
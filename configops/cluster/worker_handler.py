@@ -3,7 +3,7 @@ import zipfile
 import logging
 import os
 import requests
-import datetime
+from datetime import datetime
 import base64
 import sqlalchemy
 from io import BytesIO
@@ -17,7 +17,10 @@ from configops.database.db import (
     ConfigOpsChangeLogChanges,
     ConfigOpsProvisionSecret,
     paginate,
+    count_capped,
+    keyset_paginate,
 )
+from configops.database.search import changelog_search_condition
 from configops.database.utils import create_database_engine
 from configops.api.utils import BaseResult
 from configops.changelog import changelog_utils
@@ -25,6 +28,14 @@ from configops.changelog import changelog_utils
 
 logger = logging.getLogger(__name__)
 
+COUNT_EXACT = "exact"
+COUNT_CAPPED = "capped"
+COUNT_NONE = "none"
+# Changelog totals above this are reported as this, with total_exact false
+MAX_COUNTED_CHANGELOGS = 10000
+# Max values of one IN list of bulk changelog edits
+IN_CHUNK_SIZE = 500
+
 
 class BaseMessageHandler:
 
@@ -40,20 +51,53 @@ class QueryChangelogMessageHandler(BaseMessageHandler):
 
         if system_type == SystemType.DATABASE:
             db_config = get_database_cfg(namespace.app, system_id)
-            items, total = self.__query_databae_change_log__(db_config, data)
-            return BaseResult.ok(data=items, total=total)
+            result = self.__query_databae_change_log__(db_config, data)
+        else:
+            result = self.__query_change_log__(namespace.app, data)
+        if "cursor" in data or "count" in data or data.get("with_counts"):
+            # counts: changelogs per exectype, regardless of the exectypes filter
+            total = result.pop("total")
+            return BaseResult.ok(data=result, total=total)
+        return BaseResult.ok(data=result["items"], total=result["total"])
+
+    def __fetch_page__(self, execute, stmt, columns: list, key, data) -> dict:
+        """
+        Fetch one page, by cursor if the request has one (even empty for the first
+        page), otherwise by page number.
+
+        :param columns: Sort key columns of the cursor, newest first
+        """
+        size = int(data.get("size", 20))
+        keyset = "cursor" in data
+        count = data.get("count", COUNT_CAPPED if keyset else COUNT_EXACT)
+        if count == COUNT_NONE:
+            total, exact = None, False
+        else:
+            total, exact = count_capped(
+                execute, stmt, MAX_COUNTED_CHANGELOGS if count == COUNT_CAPPED else None
+            )
+        if keyset:
+            rows, next_cursor = keyset_paginate(
+                execute, stmt, columns, key, data.get("cursor"), size
+            )
         else:
-            items, total = self.__query_change_log__(namespace.app, data)
-            return BaseResult.ok(data=items, total=total)
+            page = int(data.get("page", 1))
+            rows = execute(stmt.offset((page - 1) * size).limit(size)).all()
+            next_cursor = None
+        return {
+            "rows": rows,
+            "total": total,
+            "total_exact": exact,
+            "next_cursor": next_cursor,
+        }
 
     def __query_change_log__(self, app, data):
         system_id = data["system_id"]
         system_type = SystemType[data["system_type"]]
-        page = int(data.get("page", 1))
-        size = int(data.get("size", 20))
         start_time = data.get("start_time")
         end_time = data.get("end_time")
         q = data.get("q")
+        exectypes = data.get("exectypes")
         conditions = [
             ConfigOpsChangeLog.system_id == system_id,
             ConfigOpsChangeLog.system_type == system_type.name,
@@ -67,16 +111,21 @@ class QueryChangelogMessageHandler(BaseMessageHandler):
             conditions.append(ConfigOpsChangeLog.updated_at <= dt)
 
         if q:
-            conditions.append(
-                sqlalchemy.or_(
-                    ConfigOpsChangeLog.change_set_id.like(f"%{q}%"),
-                    ConfigOpsChangeLog.author.like(f"%{q}%"),
-                    ConfigOpsChangeLog.comment.like(f"%{q}%"),
-                    ConfigOpsChangeLog.filename.like(f"%{q}%"),
-                )
-            )
+            conditions.append(changelog_search_condition(app, q))
 
         with app.app_context():
+            counts = None
+            if data.get("with_counts"):
+                count_stmt = (
+                    sqlalchemy.select(
+                        ConfigOpsChangeLog.exectype, sqlalchemy.func.count()
+                    )
+                    .where(*conditions)
+                    .group_by(ConfigOpsChangeLog.exectype)
+                )
+                counts = dict(db.session.execute(count_stmt).all())
+            if exectypes:
+                conditions.append(ConfigOpsChangeLog.exectype.in_(exectypes))
             stmt = (
                 sqlalchemy.select(
                     ConfigOpsChangeLog.change_set_id,
@@ -88,12 +137,19 @@ class QueryChangelogMessageHandler(BaseMessageHandler):
                     ConfigOpsChangeLog.filename,
                     ConfigOpsChangeLog.comment,
                     ConfigOpsChangeLog.updated_at.label("execute_date"),
+                    ConfigOpsChangeLog.id,
                 )
                 .where(*conditions)
                 .order_by(ConfigOpsChangeLog.updated_at.desc())
             )
-            items, total = paginate(stmt, page, size)
-            final_items = [
+            result = self.__fetch_page__(
+                db.session.execute,
+                stmt,
+                [ConfigOpsChangeLog.updated_at, ConfigOpsChangeLog.id],
+                lambda row: (row.execute_date, row.id),
+                data,
+            )
+            result["items"] = [
                 {
                     "change_set_id": item.change_set_id,
                     "system_id": item.system_id,
@@ -105,19 +161,25 @@ class QueryChangelogMessageHandler(BaseMessageHandler):
                     "comment": item.comment,
                     "execute_date": item.execute_date.strftime("%Y-%m-%d %H:%M:%S"),
                 }
-                for item in items
+                for item in result.pop("rows")
             ]
-            return final_items, total
+            result["counts"] = counts
+            return result
 
     def __query_databae_change_log__(self, db_config, data):
         if db_config is None:
-            return [], 0
+            return {
+                "items": [],
+                "total": 0,
+                "total_exact": True,
+                "next_cursor": None,
+                "counts": {} if data.get("with_counts") else None,
+            }
         system_id = data["system_id"]
-        page = int(data.get("page", 1))
-        size = int(data.get("size", 20))
         start_time = data.get("start_time")
         end_time = data.get("end_time")
         q = data.get("q")
+        exectypes = data.get("exectypes")
         engine = create_database_engine(
             db_config, db_config.get("changelogschema", "liquibase")
         )
@@ -142,6 +204,15 @@ class QueryChangelogMessageHandler(BaseMessageHandler):
                     changelog.c.FILENAME.like(f"%{q}%"),
                 )
             )
+        count_stmt = None
+        if data.get("with_counts"):
+            count_stmt = (
+                sqlalchemy.select(changelog.c.EXECTYPE, sqlalchemy.func.count())
+                .where(*conditions)
+                .group_by(changelog.c.EXECTYPE)
+            )
+        if exectypes:
+            conditions.append(changelog.c.EXECTYPE.in_(exectypes))
         stmt = (
             sqlalchemy.select(
                 changelog.c.ID.label("change_set_id"),
@@ -151,18 +222,24 @@ class QueryChangelogMessageHandler(BaseMessageHandler):
                 changelog.c.FILENAME.label("filename"),
                 changelog.c.COMMENTS.label("comment"),
                 changelog.c.DATEEXECUTED.label("execute_date"),
+                changelog.c.ORDEREXECUTED.label("order_executed"),
             )
             .where(*conditions)
             .order_by(changelog.c.DATEEXECUTED.desc())
         )
 
         with engine.connect() as conn:
-            total_stmt = sqlalchemy.select(sqlalchemy.func.count()).select_from(
-                stmt.subquery()
+            result = self.__fetch_page__(
+                conn.execute,
+                stmt,
+                [changelog.c.DATEEXECUTED, changelog.c.ORDEREXECUTED],
+                lambda row: (row.execute_date, row.order_executed),
+                data,
             )
-            total = conn.execute(total_stmt).scalar()
-            items = conn.execute(stmt.offset((page - 1) * size).limit(size)).all()
-            final_items = [
+            counts = (
+                dict(conn.execute(count_stmt).all()) if count_stmt is not None else None
+            )
+            result["items"] = [
                 {
                     "change_set_id": item.change_set_id,
                     "system_id": system_id,
@@ -173,9 +250,17 @@ class QueryChangelogMessageHandler(BaseMessageHandler):
                     "filename": item.filename,
                     "execute_date": item.execute_date.strftime("%Y-%m-%d %H:%M:%S"),
                 }
-                for item in items
+                for item in result.pop("rows")
             ]
-            return final_items, total
+            result["counts"] = counts
+            return result
+
+
+def _chunks(items: list, size: int = None):
+    # IN_CHUNK_SIZE is read at call time
+    size = size or IN_CHUNK_SIZE
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
 
 
 class DeleteChangelogMessageHandler(BaseMessageHandler):
@@ -183,8 +268,9 @@ class DeleteChangelogMessageHandler(BaseMessageHandler):
         data = message.data
         system_id = data["system_id"]
         system_type = SystemType[data["system_type"]]
-        change_set_ids = data["change_set_ids"]
+        change_set_ids = list(set(data["change_set_ids"]))
         app = namespace.app
+        deleted = 0
         if system_type == SystemType.DATABASE:
             db_config = get_database_cfg(app, system_id)
             engine = create_database_engine(
@@ -194,22 +280,21 @@ class DeleteChangelogMessageHandler(BaseMessageHandler):
             changelog = sqlalchemy.Table(
                 "DATABASECHANGELOG", metadata, autoload_with=engine
             )
-            stmt = sqlalchemy.delete(changelog).where(
-                changelog.c.ID.in_(change_set_ids)
-            )
-            with engine.connect() as conn:
-                conn.execute(stmt)
-                conn.commit()
+            with engine.begin() as conn:
+                for ids in _chunks(change_set_ids):
+                    stmt = sqlalchemy.delete(changelog).where(changelog.c.ID.in_(ids))
+                    deleted += conn.execute(stmt).rowcount
         else:
             with app.app_context():
-                stmt = sqlalchemy.delete(ConfigOpsChangeLog).where(
-                    ConfigOpsChangeLog.system_id == system_id,
-                    ConfigOpsChangeLog.system_type == system_type.name,
-                    ConfigOpsChangeLog.change_set_id.in_(change_set_ids),
-                )
-                db.session.execute(stmt)
+                for ids in _chunks(change_set_ids):
+                    stmt = sqlalchemy.delete(ConfigOpsChangeLog).where(
+                        ConfigOpsChangeLog.system_id == system_id,
+                        ConfigOpsChangeLog.system_type == system_type.name,
+                        ConfigOpsChangeLog.change_set_id.in_(ids),
+                    )
+                    deleted += db.session.execute(stmt).rowcount
                 db.session.commit()
-        return BaseResult.ok()
+        return BaseResult.ok(data={"deleted": deleted})
 
 
 class UpdateChangelogMessageHandler(BaseMessageHandler):
@@ -217,19 +302,65 @@ class UpdateChangelogMessageHandler(BaseMessageHandler):
         data = message.data
         system_id = data["system_id"]
         system_type = SystemType[data["system_type"]]
-        change_sets = data["change_sets"]
+        # change set id -> new status, the last one wins
+        statuses = {
+            change_set["change_set_id"]: change_set["exec_status"]
+            for change_set in data["change_sets"]
+        }
         app = namespace.app
+        found = set()
+        updated = 0
         with app.app_context():
-            for change_set in change_sets:
-                log = db.session.query(ConfigOpsChangeLog).filter(
-                    ConfigOpsChangeLog.system_id == system_id,
-                    ConfigOpsChangeLog.system_type == system_type.name,
-                    ConfigOpsChangeLog.change_set_id == change_set["change_set_id"],
-                ).first()
-                log.checksum = changelog_utils.get_edit_new_checksum(log.checksum, log.exectype, change_set["exec_status"])
-                log.exectype = change_set["exec_status"]
+            for ids in _chunks(list(statuses.keys())):
+                logs = db.session.execute(
+                    sqlalchemy.select(
+                        ConfigOpsChangeLog.id,
+                        ConfigOpsChangeLog.change_set_id,
+                        ConfigOpsChangeLog.checksum,
+                        ConfigOpsChangeLog.exectype,
+                    ).where(
+                        ConfigOpsChangeLog.system_id == system_id,
+                        ConfigOpsChangeLog.system_type == system_type.name,
+                        ConfigOpsChangeLog.change_set_id.in_(ids),
+                    )
+                ).all()
+                # Rows keeping their checksum are updated per target status in one
+                # statement, the others by primary key in one executemany
+                same_checksum = {}
+                new_checksum = []
+                for log in logs:
+                    found.add(log.change_set_id)
+                    status = statuses[log.change_set_id]
+                    if log.exectype == status:
+                        continue
+                    checksum = changelog_utils.get_edit_new_checksum(
+                        log.checksum, log.exectype, status
+                    )
+                    if checksum == log.checksum:
+                        same_checksum.setdefault(status, []).append(log.id)
+                    else:
+                        new_checksum.append(
+                            {"id": log.id, "checksum": checksum, "exectype": status}
+                        )
+                for status, log_ids in same_checksum.items():
+                    db.session.execute(
+                        sqlalchemy.update(ConfigOpsChangeLog)
+                        .where(ConfigOpsChangeLog.id.in_(log_ids))
+                        .values(exectype=status)
+                    )
+                    updated += len(log_ids)
+                if new_checksum:
+                    db.session.execute(
+                        sqlalchemy.update(ConfigOpsChangeLog), new_checksum
+                    )
+                    updated += len(new_checksum)
             db.session.commit()
-        return BaseResult.ok()
+        missing = [
+            change_set_id for change_set_id in statuses if change_set_id not in found
+        ]
+        if missing:
+            logger.warning(f"Changelogs to update not found: {missing}")
+        return BaseResult.ok(data={"updated": updated, "missing": missing})
 
 
 class QueryChangesetMessageHandler(BaseMessageHandler):
@@ -121,6 +121,17 @@ CONFIG_SCHEMA = {
                             "type": "string",
                             "description": "Elasticsearch8.X API Key",
                         },
+                        "concurrency": {
+                            "type": "integer",
+                            "default": 1,
+                            "minimum": 1,
+                            "description": "Max number of independent change sets executed concurrently",
+                        },
+                        "skip_if_identical": {
+                            "type": "boolean",
+                            "default": False,
+                            "description": "Skip template, pipeline, settings and mapping writes whose body is already in place",
+                        },
                         "secretmanager": {"$ref": "#/definitions/SecretManager"},
                     },
                     "required": ["url"],
@@ -147,6 +158,24 @@ CONFIG_SCHEMA = {
                             "type": ["string", "number"],
                             "description": "Graphdb port. Example: 8182",
                         },
+                        "max_in_flight": {
+                            "type": "integer",
+                            "minimum": 1,
+                            "default": 8,
+                            "description": "Max gremlin statements in flight for pipelined changes",
+                        },
+                        "max_statements_per_request": {
+                            "type": "integer",
+                            "minimum": 1,
+                            "default": 500,
+                            "description": "Max openCypher statements per neo4j transactional request",
+                        },
+                        "max_sparql_update_bytes": {
+                            "type": "integer",
+                            "minimum": 1,
+                            "default": 1048576,
+                            "description": "Max size of one batched SPARQL update request",
+                        },
                         "username": {
                             "type": "string",
                             "description": "Graphdb username",
@@ -176,6 +205,10 @@ CONFIG_SCHEMA = {
                                     "type": "string",
                                     "description": "AWS secret access key for IAM authentication",
                                 },
+                                "profile": {
+                                    "type": "string",
+                                    "description": "AWS profile used when no access key is configured",
+                                },
                             },
                         },
                         "secretmanager": {"$ref": "#/definitions/SecretManager"},
@@ -293,6 +326,12 @@ CONFIG_SCHEMA = {
                             "type": ["string", "null"],
                             "description": "Secret for node communication",
                         },
+                        "message_workers": {
+                            "type": "integer",
+                            "minimum": 1,
+                            "default": 8,
+                            "description": "Number of threads a worker handles controller messages with",
+                        },
                     },
                 },
                 "redis_uri": {
@@ -301,6 +340,17 @@ CONFIG_SCHEMA = {
                     "default": "redis://localhost:6379/0",
                     "description": "Redis connection URI",
                 },
+                "cluster": {
+                    "type": "object",
+                    "description": "Controller cluster configurations",
+                    "properties": {
+                        "redis_uri": {
+                            "type": ["string", "null"],
+                            "format": "uri",
+                            "description": "Redis connection URI shared by the controller processes, a single controller process keeps its state in memory when unset",
+                        },
+                    },
+                },
                 "database-uri": {
                     "type": "string",
                     "default": "sqlite:///configops.db",
@@ -398,9 +448,19 @@ class EsConfig(Schema):
     password = fields.Str(required=False)
     api_id = fields.Str(required=False)
     api_key = fields.Str(required=False)
+    concurrency = fields.Integer(required=False, load_default=1)
+    skip_if_identical = fields.Boolean(required=False, load_default=False)
     secretmanager = fields.Nested(SecretManager, required=False)
 
 
+class AwsIamAuthentication(Schema):
+    enabled = fields.Boolean(required=False, load_default=False)
+    region = fields.Str(required=False)
+    access_key = fields.Str(required=False)
+    secret_key = fields.Str(required=False)
+    profile = fields.Str(required=False)
+
+
 class GraphdbConfig(Schema):
     dialect = fields.Str(required=True)
     host = fields.Str(required=True)
@@ -408,6 +468,10 @@ class GraphdbConfig(Schema):
     username = fields.Str(required=False)
     password = fields.Str(required=False)
     secure = fields.Boolean(required=False)
+    max_in_flight = fields.Integer(required=False)
+    max_statements_per_request = fields.Integer(required=False)
+    max_sparql_update_bytes = fields.Integer(required=False)
+    aws_iam_authentication = fields.Nested(AwsIamAuthentication, required=False)
     secretmanager = fields.Nested(SecretManager, required=False)
 
 
@@ -424,6 +488,7 @@ class NodeConfig(Schema):
     controller_url = fields.Str(required=False, validate=validate.URL())
     secret = fields.Str(required=False)
     name = fields.Str(required=False)
+    message_workers = fields.Integer(required=False)
 
 
 class OidcConfig(Schema):
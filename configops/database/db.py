@@ -5,12 +5,17 @@ from sqlalchemy import (
     BigInteger,
     Integer,
     DateTime,
+    Index,
     LargeBinary,
+    Text,
     UniqueConstraint,
     func,
     select,
 )
+from datetime import datetime
 import sqlalchemy
+import base64
+import json
 import os
 import logging
 import uuid
@@ -54,10 +59,12 @@ class ConfigOpsChangeLog(Base):
     filename = mapped_column(String(1024))
     # contexts = mapped_column(String(1024), comment="执行上下文")
     comment = mapped_column(String(2048))
+    # Existing databases get idx_change_log_history from migrations/sql/worker
     __table_args__ = (
         UniqueConstraint(
             "change_set_id", "system_type", "system_id", name="uix_change"
         ),
+        Index("idx_change_log_history", "system_type", "system_id", "updated_at"),
     )
 
 
@@ -77,6 +84,39 @@ class ConfigOpsChangeLogChanges(Base):
     )
 
 
+class ConfigOpsChangeLogTask(Base):
+    """Long running request of a change set, submitted to the target as a task"""
+
+    __tablename__ = "CONFIGOPS_CHANGE_LOG_TASK"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    change_set_id = mapped_column(String(100), nullable=False, comment="变更集ID")
+    system_id = mapped_column(String(32), nullable=False, comment="系统ID")
+    system_type = mapped_column(String(30), nullable=False, comment="系统类型")
+    change_index = mapped_column(Integer, nullable=False, comment="变更序号")
+    task_id = mapped_column(String(255), nullable=False, comment="任务ID")
+    status = mapped_column(String(30), nullable=False, comment="任务状态")
+    checksum = mapped_column(String(128), nullable=True, comment="checksum")
+    change_count = mapped_column(Integer, nullable=True, comment="变更数")
+    progress = mapped_column(Text, nullable=True, comment="任务进度")
+    __table_args__ = (
+        UniqueConstraint(
+            "change_set_id", "system_type", "system_id", name="uix_change_task"
+        ),
+    )
+
+
+class ConfigOpsChangePlan(Base):
+    __tablename__ = "CONFIGOPS_CHANGE_PLAN"
+    # sha256 of the plan content
+    id = mapped_column(String(64), primary_key=True)
+    system_id = mapped_column(String(32), nullable=False, comment="系统ID")
+    system_type = mapped_column(String(30), nullable=False, comment="系统类型")
+    status = mapped_column(String(30), nullable=False, comment="计划状态")
+    plan: Mapped[bytes] = mapped_column(
+        LargeBinary(length=(2**32) - 1), comment="压缩的计划数据"
+    )
+
+
 class ConfigOpsProvisionSecret(Base):
     __tablename__ = "CONFIGOPS_PROVISION_SECRET"
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
@@ -129,6 +169,14 @@ class ManagedObjects(Base):
     )
 
 
+class WorkerInventory(Base):
+    """Content hash of the managed objects a worker reported last"""
+
+    __tablename__ = f"{table_name_prefix}worker_inventory"
+    worker_id = mapped_column(String(36), primary_key=True)
+    inventory_hash = mapped_column(String(64), nullable=False)
+
+
 class User(Base):
     __tablename__ = f"{table_name_prefix}user"
     id = mapped_column(String(32), primary_key=True, nullable=False)
@@ -171,6 +219,65 @@ def paginate(stmt, page: int = 1, size: int = 10):
     return items, total
 
 
+def count_capped(execute, stmt, cap: int = None) -> tuple[int, bool]:
+    """
+    Count the rows of a statement, stopping at cap.
+
+    :param execute: Session.execute or Connection.execute
+    :return: (total, exact). total is cap when there are more rows than cap.
+    """
+    if cap is None:
+        total_stmt = select(func.count()).select_from(stmt.subquery())
+        return execute(total_stmt).scalar(), True
+    limited = stmt.order_by(None).limit(cap + 1).subquery()
+    total = execute(select(func.count()).select_from(limited)).scalar()
+    return min(total, cap), total <= cap
+
+
+def encode_cursor(values) -> str:
+    """Opaque keyset pagination cursor of the sort key values of the last row."""
+    items = [
+        {"dt": value.isoformat()} if isinstance(value, datetime) else value
+        for value in values
+    ]
+    return base64.urlsafe_b64encode(json.dumps(items).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> list:
+    items = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    return [
+        datetime.fromisoformat(item["dt"]) if isinstance(item, dict) else item
+        for item in items
+    ]
+
+
+def keyset_paginate(execute, stmt, columns: list, key, cursor: str = None, size=10):
+    """
+    Page through a statement by its sort key instead of an offset, so deep pages
+    cost as much as the first one. Rows are ordered by columns descending, the
+    last column must make the key unique.
+
+    :param execute: Session.execute or Connection.execute
+    :param key: Function returning the sort key values of a row
+    :param cursor: next_cursor of the previous page, None for the first page
+    :return: (items, next_cursor). next_cursor is None on the last page.
+    """
+    if cursor:
+        values = decode_cursor(cursor)
+        # (c1, c2) < (v1, v2) spelled out, row values are not portable
+        conditions = []
+        for i, column in enumerate(columns):
+            equals = [columns[j] == values[j] for j in range(i)]
+            conditions.append(sqlalchemy.and_(*equals, column < values[i]))
+        stmt = stmt.where(sqlalchemy.or_(*conditions))
+    stmt = stmt.order_by(None).order_by(*[column.desc() for column in columns])
+    items = execute(stmt.limit(size + 1)).all()
+    if len(items) <= size:
+        return items, None
+    items = items[:size]
+    return items, encode_cursor(key(items[-1]))
+
+
 def init(app, node_config):
     if app.config.get("SQLALCHEMY_DATABASE_URI") is None:
         db_uri = None
@@ -184,19 +291,42 @@ def init(app, node_config):
         app.config["SQLALCHEMY_DATABASE_URI"] = db_uri
     db.init_app(app)
     with app.app_context():
+        # create_all() builds a new database up to date, its migrations are not run
+        new_database = not sqlalchemy.inspect(db.engine).has_table(
+            MigrationHistory.__tablename__
+        )
         db.create_all()
 
         result = db.session.query(MigrationHistory).all()
         executed = {row.fname for row in result}
+        dialect = db.engine.dialect.name
         sql_dir = _BASE_SQL_DIR + "/" + node_config["role"]
         if os.path.exists(sql_dir):
-            for fname in sorted(os.listdir(sql_dir)):
-                if fname.endswith(".sql") and fname not in executed:
-                    path = os.path.join(sql_dir, fname)
+            for fname, path in _migration_files(sql_dir, dialect):
+                if fname in executed:
+                    continue
+                if not new_database:
                     with open(path, "r") as f:
                         sql_list = f.read().split(";")
                         for sql in sql_list:
                             if sql.strip():
                                 db.session.execute(sqlalchemy.text(sql.strip()))
-                        db.session.add(MigrationHistory(fname=fname))
-                        db.session.commit()
+                db.session.add(MigrationHistory(fname=fname))
+                db.session.commit()
+
+
+def _migration_files(sql_dir, dialect):
+    """
+    Migrations in name order. A file named <name>.<dialect>.sql replaces <name>.sql
+    on that dialect, e.g. for the quoting of PostgreSQL. Recorded as <name>.sql.
+    """
+    files = {}
+    for fname in sorted(os.listdir(sql_dir)):
+        if not fname.endswith(".sql"):
+            continue
+        name, _, file_dialect = fname[: -len(".sql")].partition(".")
+        if file_dialect and file_dialect != dialect:
+            continue
+        if file_dialect or name + ".sql" not in files:
+            files[name + ".sql"] = os.path.join(sql_dir, fname)
+    return sorted(files.items())
@@ -0,0 +1,164 @@
+"""
+Search index of the changelog history (CONFIGOPS_CHANGE_LOG), over change_set_id,
+author, comment and filename.
+
+- SQLite: FTS5 trigram table kept in sync by triggers
+- MySQL: ngram FULLTEXT index
+- PostgreSQL: pg_trgm GIN indexes, used by the LIKE predicates as they are
+
+Searches fall back to LIKE when the index could not be created, or the search
+term is too short for it.
+"""
+
+import logging
+import sqlalchemy
+from configops.database.db import ConfigOpsChangeLog
+
+logger = logging.getLogger(__name__)
+
+SEARCH_FTS5 = "fts5"
+SEARCH_FULLTEXT = "fulltext"
+SEARCH_LIKE = "like"
+
+_EXTENSION_KEY = "configops_changelog_search"
+_FTS_TABLE = "CONFIGOPS_CHANGE_LOG_FTS"
+_INDEX_NAME = "idx_change_log_search"
+_COLUMNS = ["change_set_id", "author", "comment", "filename"]
+# Shortest terms the indexes can match
+_MIN_TERM_LENGTH = {SEARCH_FTS5: 3, SEARCH_FULLTEXT: 2}
+
+
+def __create_sqlite_index__(conn) -> bool:
+    table = ConfigOpsChangeLog.__tablename__
+    exists = conn.execute(
+        sqlalchemy.text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"
+        ),
+        {"name": _FTS_TABLE},
+    ).first()
+    if exists:
+        return True
+    columns = ", ".join(_COLUMNS)
+    new_values = ", ".join(f"new.{column}" for column in _COLUMNS)
+    old_values = ", ".join(f"old.{column}" for column in _COLUMNS)
+    conn.execute(
+        sqlalchemy.text(
+            f"CREATE VIRTUAL TABLE {_FTS_TABLE} USING fts5({columns}, "
+            f"content='{table}', content_rowid='id', tokenize='trigram')"
+        )
+    )
+    conn.execute(
+        sqlalchemy.text(
+            f"CREATE TRIGGER {_FTS_TABLE}_ai AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO {_FTS_TABLE}(rowid, {columns}) VALUES (new.id, {new_values}); "
+            "END"
+        )
+    )
+    conn.execute(
+        sqlalchemy.text(
+            f"CREATE TRIGGER {_FTS_TABLE}_ad AFTER DELETE ON {table} BEGIN "
+            f"INSERT INTO {_FTS_TABLE}({_FTS_TABLE}, rowid, {columns}) "
+            f"VALUES ('delete', old.id, {old_values}); "
+            "END"
+        )
+    )
+    conn.execute(
+        sqlalchemy.text(
+            f"CREATE TRIGGER {_FTS_TABLE}_au AFTER UPDATE ON {table} BEGIN "
+            f"INSERT INTO {_FTS_TABLE}({_FTS_TABLE}, rowid, {columns}) "
+            f"VALUES ('delete', old.id, {old_values}); "
+            f"INSERT INTO {_FTS_TABLE}(rowid, {columns}) VALUES (new.id, {new_values}); "
+            "END"
+        )
+    )
+    # Index the rows written before
+    conn.execute(
+        sqlalchemy.text(f"INSERT INTO {_FTS_TABLE}({_FTS_TABLE}) VALUES ('rebuild')")
+    )
+    return True
+
+
+def __create_mysql_index__(conn) -> bool:
+    table = ConfigOpsChangeLog.__tablename__
+    exists = conn.execute(
+        sqlalchemy.text(
+            "SELECT 1 FROM information_schema.statistics "
+            "WHERE table_schema = DATABASE() AND table_name = :table AND index_name = :index"
+        ),
+        {"table": table, "index": _INDEX_NAME},
+    ).first()
+    if not exists:
+        conn.execute(
+            sqlalchemy.text(
+                f"CREATE FULLTEXT INDEX {_INDEX_NAME} ON {table} "
+                f"({', '.join(_COLUMNS)}) WITH PARSER ngram"
+            )
+        )
+    return True
+
+
+def __create_postgresql_index__(conn) -> bool:
+    table = ConfigOpsChangeLog.__tablename__
+    conn.execute(sqlalchemy.text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    for column in _COLUMNS:
+        conn.execute(
+            sqlalchemy.text(
+                f"CREATE INDEX IF NOT EXISTS {_INDEX_NAME}_{column} "
+                f'ON "{table}" USING gin ({column} gin_trgm_ops)'
+            )
+        )
+    # The LIKE predicates use the trigram indexes
+    return False
+
+
+def init_changelog_search(app, engine) -> str:
+    """
+    Create the search index if missing. Called at startup of workers.
+
+    :return: The search mode used by changelog_search_condition()
+    """
+    creators = {
+        "sqlite": __create_sqlite_index__,
+        "mysql": __create_mysql_index__,
+        "postgresql": __create_postgresql_index__,
+    }
+    mode = SEARCH_LIKE
+    creator = creators.get(engine.dialect.name)
+    if creator is not None:
+        try:
+            with engine.begin() as conn:
+                if creator(conn):
+                    mode = (
+                        SEARCH_FTS5 if engine.dialect.name == "sqlite" else SEARCH_FULLTEXT
+                    )
+        except Exception as e:
+            logger.warning(
+                f"Create changelog search index failed, searching with LIKE. {e}"
+            )
+    logger.info(f"Changelog search mode: {mode}")
+    app.extensions[_EXTENSION_KEY] = mode
+    return mode
+
+
+def changelog_search_condition(app, q: str):
+    """Condition matching the changelogs containing q in any of the searched columns."""
+    mode = app.extensions.get(_EXTENSION_KEY, SEARCH_LIKE)
+    if len(q) >= _MIN_TERM_LENGTH.get(mode, 0):
+        # Searched as a phrase, so it matches like a substring
+        if mode == SEARCH_FTS5:
+            phrase = '"' + q.replace('"', '""') + '"'
+            return ConfigOpsChangeLog.id.in_(
+                sqlalchemy.select(sqlalchemy.literal_column("rowid"))
+                .select_from(sqlalchemy.table(_FTS_TABLE))
+                .where(
+                    sqlalchemy.text(f"{_FTS_TABLE} MATCH :q").bindparams(q=phrase)
+                )
+            )
+        if mode == SEARCH_FULLTEXT:
+            phrase = '"' + q.replace('"', " ") + '"'
+            return sqlalchemy.text(
+                f"MATCH ({', '.join(_COLUMNS)}) AGAINST (:q IN BOOLEAN MODE)"
+            ).bindparams(q=phrase)
+    return sqlalchemy.or_(
+        *[getattr(ConfigOpsChangeLog, column).like(f"%{q}%") for column in _COLUMNS]
+    )
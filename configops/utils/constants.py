@@ -1,4 +1,7 @@
+import json
+import queue
 import re
+import threading
 from enum import Enum
 
 PROPERTIES = "properties"
@@ -39,6 +42,7 @@ class ChangelogExeType(Enum):
     INIT = "INIT"
     EXECUTED = "EXECUTED"
     FAILED = "FAILED"
+    RUNNING = "RUNNING"  # 执行中，如等待elasticsearch异步任务结束
     # RERUN = "RERUN"
 
     def matches(self, value):
@@ -110,15 +114,102 @@ def extract_version(name):
         return version_numbers, suffix
     return (0,), ""  # 默认返回最小版本
 
-class FutureCallback:
-    def __init__(self, future, loop):
-        self.future = future
-        self.loop = loop
+# Chunks of a streamed response held for a slow HTTP client before it is cancelled
+STREAM_MAX_BUFFERED_CHUNKS = 64
+
+
+class ReplyCallback:
+    """
+    Receives a worker response for a caller blocking on it. The event comes from
+    the Socket.IO server, so waiting only parks the greenlet under gevent.
+    """
+
+    def __init__(self, event=None):
+        self.event = event if event is not None else threading.Event()
+        self.result = None
+        self.error = None
+
+    def on_complete(self, result: any):
+        if not self.event.is_set():
+            self.result = result
+            self.event.set()
+
+    def on_error(self, error: Exception):
+        if not self.event.is_set():
+            self.error = error
+            self.event.set()
+
+    def wait(self, timeout: float):
+        """
+        :return: The response
+        :raise TimeoutError: Nothing arrived in time
+        """
+        if not self.event.wait(timeout):
+            raise TimeoutError(f"No response in {timeout}s")
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class StreamCallback:
+    """
+    Receives a worker response as a stream of JSON encoded byte chunks, so it can
+    be passed on to the HTTP client without holding it in memory.
+
+    Workers do not wait for the client, at most max_buffered_chunks chunks are held.
+    When a slow client lets more pile up the stream is cancelled, the chunks arriving
+    later are dropped and the client sees a truncated body.
+    """
+
+    _END = object()
+
+    def __init__(self, max_buffered_chunks: int = STREAM_MAX_BUFFERED_CHUNKS):
+        # One more slot for the end marker or the error
+        self.queue = queue.Queue(maxsize=max_buffered_chunks + 1)
+        self.max_buffered_chunks = max_buffered_chunks
+        self.cancelled = None
+
+    def _cancel(self, error: Exception):
+        if self.cancelled is None:
+            self.cancelled = error
+
+    def on_chunk(self, chunk: bytes, last: bool):
+        if self.cancelled is not None:
+            return
+        if self.queue.qsize() >= self.max_buffered_chunks:
+            self._cancel(
+                OverflowError(
+                    f"Stream cancelled, more than {self.max_buffered_chunks} chunks buffered"
+                )
+            )
+            return
+        self.queue.put_nowait(chunk)
+        if last:
+            self.queue.put_nowait(StreamCallback._END)
 
     def on_complete(self, result: any):
-        if self.future and not self.future.done():
-            self.loop.call_soon_threadsafe(self.future.set_result, result)
+        # Small responses are not chunked
+        self.queue.put(json.dumps(result, ensure_ascii=False).encode("utf-8"))
+        self.queue.put(StreamCallback._END)
 
     def on_error(self, error: Exception):
-        if self.future and not self.future.done():
-            self.loop.call_soon_threadsafe(self.future.set_exception, error)
\ No newline at end of file
+        self._cancel(error)
+        try:
+            # Wakes up a reader waiting on an empty queue
+            self.queue.put_nowait(error)
+        except queue.Full:
+            pass
+
+    def next_chunk(self, timeout: float):
+        """
+        :return: The next chunk, None at the end of the response
+        :raise queue.Empty: Nothing arrived in time
+        """
+        if self.cancelled is not None:
+            raise self.cancelled
+        item = self.queue.get(timeout=timeout)
+        if item is StreamCallback._END:
+            return None
+        if isinstance(item, Exception):
+            raise item
+        return item
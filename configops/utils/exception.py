@@ -4,3 +4,11 @@ class ConfigOpsException(Exception):
 
 class ChangeLogException(Exception):
     pass
+
+
+class ChangePlanNotFoundException(ChangeLogException):
+    pass
+
+
+class ChangePlanDriftException(ChangeLogException):
+    pass
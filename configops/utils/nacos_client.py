@@ -57,8 +57,19 @@ class ConfigOpsNacosClient(nacos.NacosClient):
         return None
 
     def publish_config_post(
-        self, data_id, group, content, app_name=None, config_type=None, timeout=None
+        self,
+        data_id,
+        group,
+        content,
+        app_name=None,
+        config_type=None,
+        timeout=None,
+        cas_md5=None,
     ):
+        """
+        :param cas_md5: Publish only if the md5 of the current content is this one.
+            Nacos creates a missing config whatever the md5.
+        """
         if content is None:
             raise NacosException("Can not publish none content, use remove instead.")
 
@@ -86,10 +97,16 @@ class ConfigOpsNacosClient(nacos.NacosClient):
         if config_type:
             data["type"] = config_type
 
+        headers = None
+        if cas_md5:
+            # Read from the header by Nacos 2.x, from the form by older servers
+            data["casMd5"] = cas_md5
+            headers = {"casMd5": cas_md5}
+
         try:
             resp = self._do_sync_req(
                 "/nacos/v1/cs/configs",
-                None,
+                headers,
                 None,
                 data,
                 timeout or self.default_timeout,
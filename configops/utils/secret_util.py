@@ -1,4 +1,4 @@
-import threading, logging, json, os
+import threading, logging, json, os, hashlib
 import string
 import secrets
 import botocore
@@ -7,6 +7,7 @@ from botocore.awsrequest import AWSRequest
 from dataclasses import dataclass
 from types import SimpleNamespace
 
+import botocore.credentials
 import botocore.session
 from configops import config as configops_config
 import aws_secretsmanager_caching
@@ -23,34 +24,136 @@ DEFAULT_AWS_REGION = "us-east-1"
 DEFAULT_PROFILE = "default"
 
 
-def _get_aws_creds(aws_cfg) -> tuple[SimpleNamespace, str]:
-    access_key = aws_cfg.get("access_key")
-    secret_key = aws_cfg.get("secret_key")
-    region = aws_cfg.get("region", DEFAULT_AWS_REGION)
-    profile = aws_cfg.get("profile", DEFAULT_PROFILE)
-    if access_key and secret_key:
-        return SimpleNamespace(access_key=access_key, secret_key=secret_key), region
+# Refresh expiring credentials in the background inside this window, and
+# synchronously inside the mandatory one
+_AWS_ADVISORY_REFRESH_SECONDS = 15 * 60
+_AWS_MANDATORY_REFRESH_SECONDS = 10 * 60
+
+aws_credentials_lock = threading.Lock()
+aws_credentials_map = {}
 
+
+def _create_botocore_session(profile: str) -> botocore.session.Session:
+    session = botocore.session.Session(profile=profile)
     global_aws_config = configops_config.get_aws_cfg()
     if global_aws_config:
+        # Point this session at the configured files instead of mutating os.environ
         if "credentials" in global_aws_config:
-            os.environ["AWS_SHARED_CREDENTIALS_FILE"] = global_aws_config["credentials"]
+            session.set_config_variable(
+                "credentials_file", global_aws_config["credentials"]
+            )
         if "config" in global_aws_config:
-            os.environ["AWS_CONFIG_FILE"] = global_aws_config["config"]
-        access_key = global_aws_config.get("access_key")
-        secret_key = global_aws_config.get("secret_key")
-        region = global_aws_config.get("region", DEFAULT_AWS_REGION)
+            session.set_config_variable("config_file", global_aws_config["config"])
+    return session
 
-        if access_key and secret_key:
-            return SimpleNamespace(access_key=access_key, secret_key=secret_key), region
 
-    session = botocore.session.Session(profile=profile)
-    credentials = session.get_credentials()
-    creds = credentials.get_frozen_credentials()
-    return (
-        SimpleNamespace(access_key=creds.access_key, secret_key=creds.secret_key),
-        region,
-    )
+class _CachedAwsCredentials:
+    """
+    Credentials resolved once and reused until they are about to expire, with the
+    SigV4 signers built from them.
+    """
+
+    def __init__(self, credentials, region: str):
+        self.region = region
+        self._credentials = credentials
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._signers = {}
+        self._frozen = None
+        self._freeze()
+
+    def _freeze(self):
+        creds = self._credentials.get_frozen_credentials()
+        frozen = SimpleNamespace(
+            access_key=creds.access_key,
+            secret_key=creds.secret_key,
+            token=creds.token,
+        )
+        with self._lock:
+            if self._frozen != frozen:
+                self._frozen = frozen
+                self._signers = {}
+
+    def _refresh_in_background(self):
+        try:
+            self._freeze()
+        except Exception as e:
+            logger.warning(f"Refresh aws credentials error. {e}")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _refresh_needed(self, seconds: int) -> bool:
+        refresh_needed = getattr(self._credentials, "refresh_needed", None)
+        return refresh_needed is not None and refresh_needed(seconds)
+
+    def get(self) -> SimpleNamespace:
+        if self._refresh_needed(_AWS_MANDATORY_REFRESH_SECONDS):
+            self._freeze()
+        elif self._refresh_needed(_AWS_ADVISORY_REFRESH_SECONDS):
+            with self._lock:
+                start = not self._refreshing
+                self._refreshing = True
+            if start:
+                threading.Thread(
+                    target=self._refresh_in_background,
+                    name="aws-credentials-refresh",
+                    daemon=True,
+                ).start()
+        return self._frozen
+
+    def get_signer(self, service: str) -> SigV4Auth:
+        creds = self.get()
+        with self._lock:
+            signer = self._signers.get(service)
+            if signer is None or signer.credentials is not creds:
+                signer = SigV4Auth(creds, service, self.region)
+                self._signers[service] = signer
+            return signer
+
+
+def _get_cached_aws_creds(aws_cfg) -> _CachedAwsCredentials:
+    access_key = aws_cfg.get("access_key")
+    secret_key = aws_cfg.get("secret_key")
+    region = aws_cfg.get("region", DEFAULT_AWS_REGION)
+    profile = aws_cfg.get("profile", DEFAULT_PROFILE)
+
+    if not (access_key and secret_key):
+        global_aws_config = configops_config.get_aws_cfg()
+        if global_aws_config:
+            region = global_aws_config.get("region", DEFAULT_AWS_REGION)
+            if global_aws_config.get("access_key") and global_aws_config.get(
+                "secret_key"
+            ):
+                access_key = global_aws_config["access_key"]
+                secret_key = global_aws_config["secret_key"]
+
+    if access_key and secret_key:
+        key = (None, access_key, region)
+    else:
+        key = (profile, None, region)
+
+    with aws_credentials_lock:
+        cached = aws_credentials_map.get(key)
+        if cached is not None and access_key and secret_key:
+            # Same access key with a rotated secret
+            if cached.get().secret_key != secret_key:
+                cached = None
+        if cached is None:
+            if access_key and secret_key:
+                credentials = botocore.credentials.Credentials(access_key, secret_key)
+            else:
+                credentials = _create_botocore_session(profile).get_credentials()
+                if credentials is None:
+                    raise ValueError(f"No aws credentials found. profile: {profile}")
+            cached = _CachedAwsCredentials(credentials, region)
+            aws_credentials_map[key] = cached
+        return cached
+
+
+def _get_aws_creds(aws_cfg) -> tuple[SimpleNamespace, str]:
+    cached = _get_cached_aws_creds(aws_cfg)
+    return cached.get(), cached.region
 
 
 @dataclass
@@ -73,10 +176,11 @@ def __get_or_create_botocore_cache(
         profile_key = "prifile_" + profile
         if profile_key not in botocore_client_map:
             creds, region = _get_aws_creds({"profile": profile})
-            client = botocore.session.Session(profile=profile).create_client(
+            client = _create_botocore_session(profile).create_client(
                 "secretsmanager",
                 aws_access_key_id=creds.access_key,
                 aws_secret_access_key=creds.secret_key,
+                aws_session_token=creds.token,
                 region_name=region,
             )
             cache_config = (
@@ -104,6 +208,11 @@ def get_secret_data(cfg: map, password_name="password") -> SecretData:
     return SecretData(password=cfg.get(password_name))
 
 
+def is_aws_iam_enabled(aws_cfg: dict) -> bool:
+    """Whether requests are signed with the AWS IAM authentication configuration."""
+    return bool(aws_cfg and aws_cfg.get("enabled", False))
+
+
 def get_aws_request_headers(
     aws_cfg: dict, method, service, request_url, payload
 ) -> dict:
@@ -117,16 +226,32 @@ def get_aws_request_headers(
     :param payload: The request payload (data for POST, params for GET)
     :return: A dictionary of headers to be included in the request"""
 
-    if not aws_cfg or not aws_cfg.get("enabled", False):
+    if not is_aws_iam_enabled(aws_cfg):
         return {}
-    creds, region = _get_aws_creds(aws_cfg)
+    signer = _get_cached_aws_creds(aws_cfg).get_signer(service)
     data = payload if method == "POST" else None
     params = payload if method == "GET" else None
     request = AWSRequest(method=method, url=request_url, data=data, params=params)
-    SigV4Auth(creds, service, region).add_auth(request)
+    signer.add_auth(request)
     return request.headers.items()
 
 
+def get_aws_credentials_fingerprint(aws_cfg: dict) -> str:
+    """
+    Fingerprint of the AWS credentials used to sign requests, changes when they rotate.
+
+    :param aws_cfg: AWS configuration dictionary containing access_key, secret_key, region, etc.
+    :return: The fingerprint, empty when IAM authentication is disabled
+    """
+    if not is_aws_iam_enabled(aws_cfg):
+        return ""
+    creds, region = _get_aws_creds(aws_cfg)
+    token = getattr(creds, "token", None)
+    return hashlib.sha256(
+        f"{creds.access_key}:{creds.secret_key}:{token}:{region}".encode()
+    ).hexdigest()
+
+
 def encrypt_data(data: bytes, secret_key: bytes) -> bytes:
     """使用 AES CBC 模式加密数据"""
     # 填充数据至 AES 块大小的倍数
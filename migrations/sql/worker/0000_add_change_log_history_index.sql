@@ -0,0 +1 @@
+CREATE INDEX idx_change_log_history ON `CONFIGOPS_CHANGE_LOG` (system_type, system_id, updated_at);
@@ -0,0 +1,64 @@
+import logging
+import unittest
+from unittest import mock
+from flask import Flask
+from configops.api import dashboard
+from configops.database.db import db, ManagedObjects
+from configops.utils.constants import CONTROLLER_NAMESPACE
+
+logger = logging.getLogger(__name__)
+
+
+class TestGetChangeset(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+        db.init_app(self.app)
+        self.app.register_blueprint(dashboard.bp)
+        self.controller = mock.Mock()
+        self.app.config[CONTROLLER_NAMESPACE] = self.controller
+        with self.app.app_context():
+            db.create_all()
+            db.session.add(
+                ManagedObjects(
+                    id="m1",
+                    worker_id="w1",
+                    system_id="s1",
+                    system_type="NACOS",
+                    url="url",
+                )
+            )
+            db.session.commit()
+        patcher = mock.patch.object(dashboard, "do_check_auth", return_value=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.drop_all()
+
+    def _get(self):
+        return self.app.test_client().get(
+            "/api/dashboard/changeset/v1",
+            query_string={
+                "managed_object_id": "m1",
+                "change_set_id": "c1",
+                "system_id": "s1",
+                "system_type": "NACOS",
+            },
+        )
+
+    def test_stream_errors(self):
+        for error in (
+            OverflowError("Too many response chunks buffered"),
+            ValueError("Response chunk out of order. expected: 1, actual: 2"),
+        ):
+            self.controller.send_query.side_effect = (
+                lambda worker_id, object_key, message, callback: callback.on_error(
+                    error
+                )
+            )
+            resp = self._get()
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn(str(error), resp.get_json()["msg"])
@@ -3,9 +3,11 @@ import unittest
 import secrets
 import base64
 from configops.changelog.changelog_utils import (
+    get_change_set_checksum_v2,
     pack_changes,
     unpack_changes,
 )
+from configops.utils.constants import SystemType
 
 logger = logging.getLogger(__name__)
 
@@ -37,3 +39,19 @@ class TestChangelogUtils(unittest.TestCase):
 
         _changes = unpack_changes(changes_bytes, secret)
         logger.info(f"changes: {_changes}")
+
+    def test_checksum_ignores_execution_flags(self):
+        es_change = {"method": "PUT", "path": "/movies", "body": "{}"}
+        self.assertEqual(
+            get_change_set_checksum_v2([es_change], SystemType.ELASTICSEARCH),
+            get_change_set_checksum_v2(
+                [dict(es_change, skipIfIdentical=True)], SystemType.ELASTICSEARCH
+            ),
+        )
+        graph_change = {"query": "g.V().drop()"}
+        self.assertEqual(
+            get_change_set_checksum_v2([graph_change], SystemType.GRAPHDB),
+            get_change_set_checksum_v2(
+                [dict(graph_change, pipelined=True)], SystemType.GRAPHDB
+            ),
+        )
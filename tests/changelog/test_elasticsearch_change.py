@@ -1,7 +1,16 @@
 import logging
+import json
+from datetime import datetime
 import unittest
+from unittest import mock
+from flask import Flask
 from configops.changelog import changelog_utils
-from configops.changelog.elasticsearch_change import ElasticsearchChangelog
+from configops.changelog.elasticsearch_change import (
+    ElasticsearchChangelog,
+    ElasticTaskPoller,
+    is_identical_resource,
+)
+from configops.database.db import db, ConfigOpsChangeLog, ConfigOpsChangeLogTask
 from configops.utils.constants import SystemType
 
 
@@ -25,3 +34,247 @@ class TestElasticsearchChangeLog(unittest.TestCase):
                 change_set_obj["changes"], SystemType.ELASTICSEARCH
             )
             logger.info(f"change_set_id: {change_set_obj['id']}, checksum: {checksum}")
+
+    def test_is_task_request(self):
+        self.assertTrue(
+            ElasticsearchChangelog.__is_task_request__("POST", "/_reindex")
+        )
+        self.assertTrue(
+            ElasticsearchChangelog.__is_task_request__(
+                "POST", "/movies/_update_by_query?conflicts=proceed"
+            )
+        )
+        self.assertFalse(
+            ElasticsearchChangelog.__is_task_request__(
+                "POST", "/_reindex?wait_for_completion=true"
+            )
+        )
+        self.assertFalse(
+            ElasticsearchChangelog.__is_task_request__("PUT", "/movies/_doc/1")
+        )
+
+    def test_run_task(self):
+        changelog_file = "tests/changelog/elasticsearch/changelog-root.yaml"
+        es_change_log = ElasticsearchChangelog(changelog_file=changelog_file, app=None)
+        responses = [
+            {"task": "node-1:42"},
+            {"completed": False, "task": {"status": {"total": 10, "created": 3}}},
+            {"completed": True, "response": {"total": 10, "created": 10, "failures": []}},
+            {"result": "deleted"},
+        ]
+        paths = []
+
+        def fake_request(cfg, method, path, data, headers=None):
+            paths.append(path)
+            resp = mock.Mock()
+            resp.json.return_value = responses[len(paths) - 1]
+            return resp
+
+        with mock.patch.object(
+            es_change_log, "__request__", side_effect=fake_request
+        ), mock.patch("time.sleep"):
+            message = es_change_log.__run_task__(
+                {}, {}, "cs-1", "POST", "/movies/_update_by_query?conflicts=proceed", None
+            )
+        self.assertEqual(
+            paths[0], "/movies/_update_by_query?conflicts=proceed&wait_for_completion=false"
+        )
+        self.assertEqual(paths[1], "/_tasks/node-1:42")
+        # The task result is removed from the .tasks index once read
+        self.assertEqual(paths[3], "/.tasks/_doc/node-1:42")
+        self.assertIn('"created": 10', message)
+
+    def test_is_identical_resource(self):
+        body = {
+            "index_patterns": ["tenant-a-*"],
+            "template": {
+                "settings": {"index.number_of_shards": 1, "number_of_replicas": 0},
+                "mappings": {"dynamic": False, "properties": {"id": {"type": "long"}}},
+            },
+        }
+        current = {
+            "index_patterns": ["tenant-a-*"],
+            "composed_of": [],
+            "template": {
+                "settings": {"index": {"number_of_shards": "1", "number_of_replicas": "0"}},
+                "mappings": {"dynamic": "false", "properties": {"id": {"type": "long"}}},
+            },
+        }
+        self.assertTrue(is_identical_resource(body, current, merge=False))
+        current["template"]["settings"]["index"]["number_of_replicas"] = "1"
+        self.assertFalse(is_identical_resource(body, current, merge=False))
+
+        mapping = {"properties": {"id": {"type": "long"}}}
+        current_mapping = {
+            "properties": {"id": {"type": "long"}, "name": {"type": "keyword"}}
+        }
+        self.assertTrue(is_identical_resource(mapping, current_mapping, merge=True))
+        self.assertFalse(is_identical_resource(current_mapping, mapping, merge=True))
+
+
+class TestElasticsearchChangeLogTasks(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        self.task_completed = False
+        self.requests = []
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def new_changelog(self):
+        changelog = ElasticsearchChangelog(
+            changelog_file="tests/changelog/elasticsearch/changelog-root.yaml",
+            app=self.app,
+        )
+        changelog.change_set_list = [
+            {
+                "id": "reindex-1",
+                "filename": "changelog-tasks.yaml",
+                "changes": [
+                    {
+                        "method": "POST",
+                        "path": "/_reindex",
+                        "body": '{"source": {"index": "a"}, "dest": {"index": "b"}}',
+                    },
+                    {"method": "PUT", "path": "/b/_settings", "body": "{}"},
+                ],
+            }
+        ]
+        return changelog
+
+    def fake_request(self, cfg, method, path, data, headers=None):
+        self.requests.append((method, path))
+        resp = mock.Mock()
+        resp.text = "{}"
+        if path.startswith("/_reindex"):
+            resp.json.return_value = {"task": "node-1:7"}
+        elif path.startswith("/_tasks/"):
+            resp.json.return_value = {
+                "completed": self.task_completed,
+                "task": {"status": {"total": 10, "created": 4}},
+                "response": {"failures": []},
+            }
+        else:
+            resp.json.return_value = {}
+        return resp
+
+    def apply(self):
+        # A new changelog per run, as every request loads the files again
+        changelog = self.new_changelog()
+        with mock.patch.object(
+            changelog, "__request__", side_effect=self.fake_request
+        ), mock.patch("time.sleep") as sleep:
+            result = changelog.apply({"url": "http://es"}, "es")
+        sleep.assert_not_called()
+        return result
+
+    def get_log(self):
+        return db.session.query(ConfigOpsChangeLog).filter_by(
+            change_set_id="reindex-1"
+        ).one()
+
+    def test_task_resumed_on_next_run(self):
+        result = self.apply()
+        self.assertTrue(result[0]["changes"][0]["running"])
+        self.assertNotIn(("PUT", "/b/_settings"), self.requests)
+        self.assertEqual(self.get_log().exectype, "RUNNING")
+        task = db.session.query(ConfigOpsChangeLogTask).one()
+        self.assertEqual((task.task_id, task.change_index), ("node-1:7", 0))
+
+        # Still running, nothing else runs
+        self.requests = []
+        self.apply()
+        self.assertEqual(self.requests, [("GET", "/_tasks/node-1:7")])
+        self.assertEqual(self.get_log().exectype, "RUNNING")
+
+        self.task_completed = True
+        self.requests = []
+        result = self.apply()
+        self.assertEqual(
+            self.requests,
+            [
+                ("GET", "/_tasks/node-1:7"),
+                ("DELETE", "/.tasks/_doc/node-1:7"),
+                ("PUT", "/b/_settings"),
+            ],
+        )
+        self.assertEqual(self.get_log().exectype, "EXECUTED")
+        self.assertEqual(db.session.query(ConfigOpsChangeLogTask).count(), 0)
+
+    def test_abandoned_running_marked_failed(self):
+        db.session.add(
+            ConfigOpsChangeLog(
+                change_set_id="reindex-1",
+                system_id="es",
+                system_type=SystemType.ELASTICSEARCH.value,
+                exectype="RUNNING",
+                filename="changelog-tasks.yaml",
+                updated_at=datetime(2000, 1, 1),
+            )
+        )
+        db.session.commit()
+        self.apply()
+        # Failed, so it ran again and submitted its task
+        self.assertEqual(self.get_log().exectype, "RUNNING")
+        self.assertEqual(db.session.query(ConfigOpsChangeLogTask).count(), 1)
+
+    def poll(self, poller, now):
+        with mock.patch.object(
+            poller.changelog, "__request__", side_effect=self.fake_request
+        ), mock.patch(
+            "configops.changelog.elasticsearch_change.get_elasticsearch_cfg",
+            return_value={"url": "http://es"},
+        ):
+            poller.poll(now)
+
+    def test_poller_settles_last_change(self):
+        changelog = self.new_changelog()
+        del changelog.change_set_list[0]["changes"][1]
+        with mock.patch.object(
+            changelog, "__request__", side_effect=self.fake_request
+        ):
+            changelog.apply({"url": "http://es"}, "es")
+        poller = ElasticTaskPoller(self.app)
+
+        self.requests = []
+        self.poll(poller, 100.0)
+        self.assertEqual(self.requests, [("GET", "/_tasks/node-1:7")])
+        self.assertEqual(self.get_log().exectype, "RUNNING")
+        task = db.session.query(ConfigOpsChangeLogTask).one()
+        self.assertEqual(json.loads(task.progress), {"total": 10, "created": 4})
+
+        # Backed off, not polled again before its interval
+        self.requests = []
+        self.poll(poller, 100.5)
+        self.assertEqual(self.requests, [])
+
+        # Settled without another apply
+        self.task_completed = True
+        self.poll(poller, 102.0)
+        self.assertEqual(
+            self.requests,
+            [("GET", "/_tasks/node-1:7"), ("DELETE", "/.tasks/_doc/node-1:7")],
+        )
+        self.assertEqual(self.get_log().exectype, "EXECUTED")
+        self.assertEqual(db.session.query(ConfigOpsChangeLogTask).count(), 0)
+
+    def test_poller_leaves_remaining_changes_to_next_apply(self):
+        self.apply()
+        self.task_completed = True
+        self.poll(ElasticTaskPoller(self.app), 100.0)
+        self.assertEqual(self.get_log().exectype, "INIT")
+        task = db.session.query(ConfigOpsChangeLogTask).one()
+        self.assertEqual(task.status, "COMPLETED")
+
+        self.requests = []
+        self.apply()
+        self.assertEqual(self.requests, [("PUT", "/b/_settings")])
+        self.assertEqual(self.get_log().exectype, "EXECUTED")
+        self.assertEqual(db.session.query(ConfigOpsChangeLogTask).count(), 0)
@@ -0,0 +1,100 @@
+import logging
+import threading
+import time
+import unittest
+from configops.changelog import elasticsearch_planner
+from configops.changelog.elasticsearch_planner import (
+    GLOBAL_KEY,
+    KIND_INDEX,
+    KIND_PIPELINE,
+    KIND_TEMPLATE,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _change_set(id, *changes):
+    return {
+        "id": id,
+        "changes": [
+            {"method": method, "path": path, "body": body}
+            for method, path, body in changes
+        ],
+    }
+
+
+class TestElasticsearchPlanner(unittest.TestCase):
+
+    def test_resource_keys(self):
+        self.assertEqual(
+            elasticsearch_planner.get_resource_keys("/movies/_doc/4"),
+            {(KIND_INDEX, "movies")},
+        )
+        self.assertEqual(
+            elasticsearch_planner.get_resource_keys("/_ingest/pipeline/p1?pretty"),
+            {(KIND_PIPELINE, "p1")},
+        )
+        self.assertEqual(
+            elasticsearch_planner.get_resource_keys(
+                "/_index_template/t1",
+                '{"index_patterns": ["tenant-a-*"], "template": {"settings": {"index.default_pipeline": "p1"}}}',
+            ),
+            {
+                (KIND_TEMPLATE, "t1"),
+                (KIND_INDEX, "tenant-a-*"),
+                (KIND_PIPELINE, "p1"),
+            },
+        )
+        self.assertEqual(
+            elasticsearch_planner.get_resource_keys("/idx/_alias/a1"),
+            {(KIND_INDEX, "idx"), (KIND_INDEX, "a1")},
+        )
+        self.assertEqual(
+            elasticsearch_planner.get_resource_keys("/_aliases"), {GLOBAL_KEY}
+        )
+
+    def test_build_dependencies(self):
+        change_sets = [
+            _change_set("1", ("PUT", "/_index_template/a", '{"index_patterns": ["tenant-a-*"]}')),
+            _change_set("2", ("PUT", "/_index_template/b", '{"index_patterns": ["tenant-b-*"]}')),
+            _change_set("3", ("PUT", "/tenant-a-1", None)),
+            _change_set("4", ("PUT", "/tenant-b-1", None)),
+            _change_set("5", ("POST", "/_aliases", '{"actions": []}')),
+            _change_set("6", ("PUT", "/tenant-c-1", None)),
+        ]
+        deps = elasticsearch_planner.build_dependencies(change_sets)
+        self.assertEqual(deps[0], set())
+        self.assertEqual(deps[1], set())
+        self.assertEqual(deps[2], {0})
+        self.assertEqual(deps[3], {1})
+        self.assertEqual(deps[4], {0, 1, 2, 3})
+        self.assertEqual(deps[5], {4})
+
+    def test_execute_plan_concurrent(self):
+        change_sets = [
+            _change_set(str(i), ("PUT", f"/tenant-{i}", None)) for i in range(4)
+        ]
+        change_sets.append(_change_set("last", ("PUT", "/tenant-0/_settings", "{}")))
+        lock = threading.Lock()
+        state = {"running": 0, "max": 0}
+        completed = []
+
+        def run(change_set):
+            with lock:
+                state["running"] += 1
+                state["max"] = max(state["max"], state["running"])
+            time.sleep(0.05)
+            with lock:
+                state["running"] -= 1
+            if change_set["id"] == "2":
+                raise ValueError("boom")
+
+        def on_complete(change_set, error):
+            completed.append((change_set["id"], error is None))
+
+        elasticsearch_planner.execute_plan(change_sets, run, on_complete, 4)
+        self.assertGreater(state["max"], 1)
+        self.assertEqual(len(completed), 5)
+        self.assertIn(("2", False), completed)
+        ids = [item[0] for item in completed]
+        self.assertLess(ids.index("0"), ids.index("last"))
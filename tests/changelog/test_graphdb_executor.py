@@ -0,0 +1,302 @@
+import logging
+import unittest
+from unittest import mock
+from gremlin_python.driver.protocol import GremlinServerError
+from configops.changelog import graphdb_executor
+from configops.changelog.graphdb_executor import (
+    GremlinClientPool,
+    JanusgraphExecutor,
+    Neo4jExecutor,
+    NeptuneExecutor,
+    is_sparql_update,
+    submit_gremlin,
+    submit_sparql,
+)
+from configops.changelog.graphdb_change import GraphdbChangelog
+from configops.utils.exception import ChangeLogException
+
+logger = logging.getLogger(__name__)
+
+
+class TestGremlinClientPool(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = GremlinClientPool(idle_timeout=300)
+
+    def tearDown(self):
+        self.pool.close_all()
+
+    def test_reuse_client(self):
+        factory = mock.Mock(side_effect=lambda: mock.Mock())
+        with self.pool.client("ws://a/gremlin", "k1", factory) as c1:
+            pass
+        with self.pool.client("ws://a/gremlin", "k1", factory) as c2:
+            pass
+        self.assertIs(c1, c2)
+        self.assertEqual(factory.call_count, 1)
+        c1.close.assert_not_called()
+
+    def test_credentials_rotation(self):
+        factory = mock.Mock(side_effect=lambda: mock.Mock())
+        with self.pool.client("ws://a/gremlin", "k1", factory) as c1:
+            with self.pool.client("ws://a/gremlin", "k2", factory) as c2:
+                self.assertIsNot(c1, c2)
+                # Still in use by the outer change
+                c1.close.assert_not_called()
+        c1.close.assert_called_once()
+        c2.close.assert_not_called()
+
+    def test_discard_on_error(self):
+        factory = mock.Mock(side_effect=lambda: mock.Mock())
+        with self.assertRaises(ConnectionError):
+            with self.pool.client("ws://a/gremlin", "k1", factory) as c1:
+                raise ConnectionError("closed")
+        c1.close.assert_called_once()
+        with self.pool.client("ws://a/gremlin", "k1", factory) as c2:
+            self.assertIsNot(c1, c2)
+
+
+    def test_max_age(self):
+        factory = mock.Mock(side_effect=lambda: mock.Mock())
+        with mock.patch("time.monotonic", return_value=1000.0):
+            with self.pool.client("ws://a/gremlin", "k1", factory, 240) as c1:
+                pass
+        with mock.patch("time.monotonic", return_value=1200.0):
+            with self.pool.client("ws://a/gremlin", "k1", factory, 240) as c2:
+                pass
+        self.assertIs(c1, c2)
+        # Past the max age, even though it was used recently
+        with mock.patch("time.monotonic", return_value=1241.0):
+            with self.pool.client("ws://a/gremlin", "k1", factory, 240) as c3:
+                pass
+        self.assertIsNot(c1, c3)
+        c1.close.assert_called_once()
+        self.assertEqual(factory.call_count, 2)
+
+
+class _FakeFuture:
+    def __init__(self, value=None, error=None):
+        self.value = value
+        self.error = error
+
+    def result(self):
+        if self.error:
+            raise self.error
+        result_set = mock.Mock()
+        result_set.one.return_value = self.value
+        return result_set
+
+
+class TestSubmitGremlin(unittest.TestCase):
+
+    def test_pipelined_in_order(self):
+        in_flight = {"current": 0, "max": 0}
+        client = mock.Mock()
+
+        def submit_async(part):
+            in_flight["current"] += 1
+            in_flight["max"] = max(in_flight["max"], in_flight["current"])
+            return _FakeFuture(value=part)
+
+        def one_done(*args):
+            in_flight["current"] -= 1
+
+        client.submit_async.side_effect = submit_async
+        with mock.patch(
+            "configops.changelog.graphdb_executor._gremlin_one",
+            side_effect=lambda f: (one_done(), f.value)[1],
+        ):
+            results = submit_gremlin(
+                client, ["g.addV('a');g.addV('b')", "g.addV('c');"], True, 2
+            )
+        self.assertEqual(results, ["g.addV('a')", "g.addV('b')", "g.addV('c')"])
+        self.assertEqual(in_flight["max"], 2)
+
+    def test_pipelined_stop_at_first_failure(self):
+        client = mock.Mock()
+        client.submit_async.side_effect = [
+            _FakeFuture(value=1),
+            _FakeFuture(error=GremlinServerError({"code": 500, "message": "bad", "attributes": {}})),
+            _FakeFuture(value=3),
+            _FakeFuture(value=4),
+        ]
+        with self.assertRaises(ChangeLogException) as ctx:
+            submit_gremlin(client, ["a;b;c;d;e;f"], True, 2)
+        self.assertIn("2/6", str(ctx.exception))
+        self.assertEqual(client.submit_async.call_count, 3)
+
+
+def _response(body, status_code=200):
+    response = mock.Mock(status_code=status_code, text=str(body))
+    response.json.return_value = body
+    return response
+
+
+class TestGremlinExecutor(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = GremlinClientPool(idle_timeout=300)
+        self.addCleanup(self.pool.close_all)
+        patcher = mock.patch.object(
+            graphdb_executor, "_gremlin_client_pool", self.pool
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def execute(self, executor, max_in_flight=None, **cfg):
+        system_cfg = {"host": "g", "port": 8182, "max_in_flight": max_in_flight, **cfg}
+        with mock.patch.object(
+            graphdb_executor.gremlin_client, "Client"
+        ) as client, mock.patch.object(graphdb_executor.secret_util, "get_secret_data"):
+            executor.execute_gremlin(system_cfg, ["g.V().count()"], pipelined=True)
+        return client.call_args.kwargs["pool_size"]
+
+    def test_pool_size_follows_max_in_flight(self):
+        for executor in (NeptuneExecutor(), JanusgraphExecutor()):
+            self.assertEqual(self.execute(executor, 32), 32)
+            # Not below the default pool size
+            self.assertEqual(self.execute(executor, 2), 8)
+
+    def test_neptune_max_age_when_iam_enabled(self):
+        with mock.patch.object(self.pool, "client", wraps=self.pool.client) as client:
+            # IAM authentication configured but disabled, nothing to rotate
+            self.execute(
+                NeptuneExecutor(), aws_iam_authentication={"enabled": False}
+            )
+            self.assertIsNone(client.call_args.args[3])
+            with mock.patch.object(
+                graphdb_executor.secret_util, "get_aws_request_headers"
+            ), mock.patch.object(
+                graphdb_executor.secret_util, "get_aws_credentials_fingerprint"
+            ):
+                self.execute(
+                    NeptuneExecutor(), aws_iam_authentication={"enabled": True}
+                )
+            self.assertEqual(
+                client.call_args.args[3], graphdb_executor._NEPTUNE_CLIENT_MAX_AGE
+            )
+
+
+class TestOpenCypher(unittest.TestCase):
+
+    def test_batch_changes(self):
+        changes = [
+            {"type": "openCypher", "query": "q1", "dataset": "neo4j"},
+            {"type": "openCypher", "query": "q2", "dataset": "neo4j"},
+            {"type": "gremlin", "query": "g1"},
+            {"type": "openCypher", "query": "q3", "dataset": "other"},
+        ]
+        batches = GraphdbChangelog.__batch_changes__(changes)
+        self.assertEqual(
+            [querys for _, querys in batches], [["q1", "q2"], ["g1"], ["q3"]]
+        )
+
+    def test_neo4j_chunked_transaction_rollback(self):
+        session = mock.Mock()
+        session.post.side_effect = [
+            _response({"commit": "http://h:7474/db/neo4j/tx/5/commit", "errors": []}),
+            _response(
+                {
+                    "results": [{}],
+                    "errors": [{"message": "syntax error"}],
+                }
+            ),
+        ]
+        system_cfg = {
+            "host": "h",
+            "port": 7474,
+            "username": "neo4j",
+            "password": "pwd",
+            "max_statements_per_request": 2,
+        }
+        with mock.patch(
+            "configops.changelog.graphdb_executor.get_http_session",
+            return_value=session,
+        ):
+            with self.assertRaises(ChangeLogException) as ctx:
+                Neo4jExecutor().execute_opencypher(
+                    system_cfg, ["s1;s2", "s3;s4;s5"], dataset="neo4j"
+                )
+        self.assertIn("Statement 4/5 failed: s4", str(ctx.exception))
+        urls = [call.args[0] for call in session.post.call_args_list]
+        self.assertEqual(
+            urls, ["http://h:7474/db/neo4j/tx", "http://h:7474/db/neo4j/tx/5"]
+        )
+        session.delete.assert_called_once()
+        self.assertEqual(
+            session.delete.call_args.args[0], "http://h:7474/db/neo4j/tx/5"
+        )
+
+
+class TestSubmitSparql(unittest.TestCase):
+
+    def test_is_sparql_update(self):
+        self.assertTrue(
+            is_sparql_update(
+                "PREFIX ex: <http://example.org/>\nINSERT DATA { ex:a ex:b ex:c }"
+            )
+        )
+        self.assertFalse(is_sparql_update("SELECT * WHERE { ?s ?p ?o }"))
+
+    def test_batch_failure_not_replayed(self):
+        querys = [
+            "INSERT DATA { <a> <b> <c> }",
+            "INSERT DATA { <a> <b> <d> }",
+            "INSERT DATA { <a> <b> bad }",
+            "SELECT * WHERE { ?s ?p ?o }",
+        ]
+        session = mock.Mock()
+
+        def post(url, headers, data, auth, verify):
+            body = data.get("update", data.get("query"))
+            return _response({}, 400 if "bad" in body else 200)
+
+        session.post.side_effect = post
+        with mock.patch.object(graphdb_executor, "_parse_sparql_update", None):
+            with self.assertRaises(ChangeLogException) as ctx:
+                submit_sparql(session, "http://h/ds", querys)
+        self.assertIn("SPARQL operations 1-3/4 failed", str(ctx.exception))
+        sent = [call.kwargs["data"] for call in session.post.call_args_list]
+        # The batch is atomic, its operations are not sent again one by one
+        self.assertEqual(sent, [{"update": " ;\n".join(querys[:3])}])
+
+    @unittest.skipIf(
+        graphdb_executor._parse_sparql_update is None, "rdflib is not installed"
+    )
+    def test_batch_failure_located(self):
+        querys = [
+            "INSERT DATA { <a> <b> <c> }",
+            "INSERT DATA { <a> <b> bad }",
+            "INSERT DATA { <a> <b> <d> }",
+        ]
+        session = mock.Mock()
+        session.post.return_value = _response({}, 400)
+        with self.assertRaises(ChangeLogException) as ctx:
+            submit_sparql(session, "http://h/ds", querys)
+        self.assertIn("SPARQL operation 2/3 is invalid", str(ctx.exception))
+        self.assertIn("None of operations 1-3 was applied", str(ctx.exception))
+        self.assertEqual(session.post.call_count, 1)
+
+    def test_trailing_separator(self):
+        querys = ["INSERT DATA { <a> <b> <c> } ;", "INSERT DATA { <a> <b> <d> };\n"]
+        session = mock.Mock()
+        session.post.return_value = _response({}, 200)
+        submit_sparql(session, "http://h/ds", querys)
+        update = session.post.call_args.kwargs["data"]["update"]
+        self.assertEqual(
+            update, "INSERT DATA { <a> <b> <c> } ;\nINSERT DATA { <a> <b> <d> }"
+        )
+        if graphdb_executor._parse_sparql_update is not None:
+            graphdb_executor._parse_sparql_update(update)
+
+    def test_batch_size_counts_separator(self):
+        querys = ["INSERT DATA { <a> <b> <c> }", "INSERT DATA { <a> <b> <d> }"]
+        session = mock.Mock()
+        session.post.return_value = _response({}, 200)
+        # Room for both operations, but not for the separator joining them
+        submit_sparql(session, "http://h/ds", querys, max_bytes=len(querys[0]) * 2)
+        self.assertEqual(session.post.call_count, 2)
+        submit_sparql(
+            session, "http://h/ds", querys, max_bytes=len(querys[0]) * 2 + 3
+        )
+        self.assertEqual(session.post.call_count, 3)
@@ -1,9 +1,18 @@
+import hashlib
 import logging
 from ruamel import yaml as ryaml
 from configops.changelog import changelog_utils, nacos_change
 from jsonschema import Draft7Validator, ValidationError
 import unittest
+import marshmallow
+from flask import Flask
+from configops.api.nacos import SyncChangeSetSchema
+from configops.database.db import db, ConfigOpsChangeLog, ConfigOpsChangePlan
 from configops.utils.constants import SystemType
+from configops.utils.exception import (
+    ChangePlanDriftException,
+    ChangePlanNotFoundException,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -65,3 +74,237 @@ nacosChangeLog:
 
         except ValidationError as e:
             logger.error(f"YAML 数据校验失败 {e}")
+
+
+class TestNacosChangelogSync(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_sync(self):
+        changelog = nacos_change.NacosChangeLog(
+            changelog_file="tests/changelog/nacos/changelog-1.0.yaml", app=self.app
+        )
+        ids = [str(change_set["id"]) for change_set in changelog.change_set_list]
+        self.assertTrue(len(ids) > 0)
+        db.session.add(
+            ConfigOpsChangeLog(
+                change_set_id=ids[0],
+                system_id="nacos",
+                system_type=SystemType.NACOS.value,
+                exectype="FAILED",
+                filename=changelog.change_set_list[0]["filename"],
+            )
+        )
+        db.session.commit()
+
+        result = changelog.sync("nacos", workers=2)
+        self.assertEqual(result["updated"], ids[:1])
+        self.assertEqual(result["inserted"], ids[1:])
+        logs = db.session.query(ConfigOpsChangeLog).all()
+        self.assertEqual(len(logs), len(ids))
+        for log in logs:
+            self.assertEqual(log.exectype, "EXECUTED")
+            change_set = changelog.change_set_dict[log.change_set_id]
+            self.assertEqual(
+                log.checksum,
+                changelog_utils.get_change_set_checksum_v2(
+                    change_set["changes"], SystemType.NACOS
+                ),
+            )
+
+        result = changelog.sync("nacos")
+        self.assertEqual(result["unchanged"], ids)
+
+    def test_sync_workers_bounded(self):
+        data = {"nacosId": "nacos", "changeLogFile": "changelog.yaml"}
+        self.assertEqual(SyncChangeSetSchema().load(data)["workers"], 1)
+        for workers in (0, changelog_utils.MAX_CHECKSUM_WORKERS + 1):
+            with self.assertRaises(marshmallow.ValidationError):
+                SyncChangeSetSchema().load(dict(data, workers=workers))
+
+    def test_pending_summary(self):
+        changelog = nacos_change.NacosChangeLog(
+            changelog_file="tests/changelog/nacos/changelog-1.0.yaml", app=self.app
+        )
+        ids = [str(change_set["id"]) for change_set in changelog.change_set_list]
+        db.session.add(
+            ConfigOpsChangeLog(
+                change_set_id=ids[0],
+                system_id="nacos",
+                system_type=SystemType.NACOS.value,
+                exectype="FAILED",
+                filename=changelog.change_set_list[0]["filename"],
+            )
+        )
+        db.session.commit()
+
+        summary = changelog.pending_summary("nacos")
+        self.assertEqual(summary["pending"], ids)
+        self.assertEqual(summary["total"], len(ids))
+        self.assertEqual(summary["counts"].get(changelog_utils.PLAN_FAILED), 1)
+        # Planning writes nothing
+        self.assertEqual(db.session.query(ConfigOpsChangeLog).count(), 1)
+
+        changelog.sync("nacos")
+        summary = changelog.pending_summary("nacos")
+        self.assertEqual(summary["pending"], [])
+        self.assertEqual(summary["counts"], {changelog_utils.PLAN_EXECUTED: len(ids)})
+
+
+class _FakeNacosClient:
+    def __init__(self, configs: dict):
+        self.namespace = None
+        self.configs = configs  # (namespace, group, dataId) -> (format, content)
+        self.published = []
+        self.before_publish = None
+
+    def get_configs(self, no_snapshot=None, group=None):
+        items = [
+            {"id": f"{key[2]}", "dataId": key[2], "type": value[0], "content": value[1]}
+            for key, value in self.configs.items()
+            if key[0] == self.namespace and key[1] == group
+        ]
+        return {"pageItems": items}
+
+    def publish_config_post(self, data_id, group, content, config_type=None, cas_md5=None):
+        key = (self.namespace, group, data_id)
+        if self.before_publish:
+            self.before_publish(key)
+        # Like Nacos, a missing config is created whatever the casMd5
+        if cas_md5 and key in self.configs:
+            current = hashlib.md5(self.configs[key][1].encode("utf-8")).hexdigest()
+            if current != cas_md5:
+                raise Exception("Request Error, code is 500")
+        self.published.append((self.namespace, group, data_id, cas_md5))
+        self.configs[key] = (config_type, content)
+        return True
+
+    def remove_config(self, data_id, group):
+        self.configs.pop((self.namespace, group, data_id), None)
+        return True
+
+
+class TestNacosChangePlan(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        self.client = _FakeNacosClient(
+            {
+                ("blue", "group", "config.yaml"): ("yaml", "server:\n  port: 8080\n"),
+                ("blue", "group", "config.properties"): (
+                    "properties",
+                    "delete.aaa = 9\nkeep = 1\n",
+                ),
+            }
+        )
+        self.changelog = nacos_change.NacosChangeLog(
+            changelog_file="tests/changelog/nacos/changelog-1.0.yaml", app=self.app
+        )
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_apply_plan(self):
+        result = self.changelog.create_plan(self.client, "nacos")
+        self.assertEqual(result["ids"], ["configops-1.0-11"])
+        self.assertEqual(len(result["changes"]), 3)
+        self.assertNotIn("content", result["changes"][0])
+        plan = db.session.get(ConfigOpsChangePlan, result["planId"])
+        self.assertIsNotNone(plan)
+
+        nacos_change.NacosChangeLog.apply_plan(
+            result["planId"], "nacos", self.client, self.app
+        )
+        self.assertEqual(len(self.client.published), 3)
+        # Existing configs are published with the md5 they were planned on
+        cas = {item[2]: item[3] for item in self.client.published}
+        self.assertIsNotNone(cas["config.yaml"])
+        # New configs only match a config that still does not exist
+        self.assertEqual(cas["config.json"], hashlib.md5(b"").hexdigest())
+        self.assertIn("spring", self.client.configs[("blue", "group", "config.yaml")][1])
+        log = db.session.query(ConfigOpsChangeLog).one()
+        self.assertEqual(log.exectype, "EXECUTED")
+        self.assertIsNone(db.session.get(ConfigOpsChangePlan, result["planId"]))
+
+        with self.assertRaises(ChangePlanNotFoundException):
+            nacos_change.NacosChangeLog.apply_plan(
+                result["planId"], "nacos", self.client, self.app
+            )
+
+    def test_apply_plan_drift(self):
+        result = self.changelog.create_plan(self.client, "nacos")
+        self.client.configs[("blue", "group", "config.yaml")] = ("yaml", "edited: 1\n")
+        with self.assertRaises(ChangePlanDriftException):
+            nacos_change.NacosChangeLog.apply_plan(
+                result["planId"], "nacos", self.client, self.app
+            )
+        self.assertEqual(self.client.published, [])
+        log = db.session.query(ConfigOpsChangeLog).one()
+        self.assertEqual(log.exectype, "INIT")
+
+    def test_apply_plan_created_meanwhile(self):
+        result = self.changelog.create_plan(self.client, "nacos")
+        created = ("blue", "group", "config.json")
+
+        def create(key):
+            # Created by someone else once the plan passed the drift check
+            self.client.configs.setdefault(created, ("json", '{"a": 1}'))
+
+        self.client.before_publish = create
+        with self.assertRaises(ChangePlanDriftException):
+            nacos_change.NacosChangeLog.apply_plan(
+                result["planId"], "nacos", self.client, self.app
+            )
+        self.assertEqual(self.client.configs[created], ("json", '{"a": 1}'))
+        self.assertIsNone(db.session.get(ConfigOpsChangePlan, result["planId"]))
+
+    def test_apply_plan_failure_keeps_plan(self):
+        result = self.changelog.create_plan(self.client, "nacos")
+
+        def fail(key):
+            raise Exception("Nacos is unavailable")
+
+        self.client.before_publish = fail
+        with self.assertRaises(Exception):
+            nacos_change.NacosChangeLog.apply_plan(
+                result["planId"], "nacos", self.client, self.app
+            )
+        plan = db.session.get(ConfigOpsChangePlan, result["planId"])
+        self.assertEqual(plan.status, nacos_change.PLAN_STATUS_PENDING)
+
+        self.client.before_publish = None
+        nacos_change.NacosChangeLog.apply_plan(
+            result["planId"], "nacos", self.client, self.app
+        )
+        self.assertEqual(len(self.client.published), 3)
+        self.assertIsNone(db.session.get(ConfigOpsChangePlan, result["planId"]))
+
+    def test_apply_plan_once(self):
+        result = self.changelog.create_plan(self.client, "nacos")
+        plan = db.session.get(ConfigOpsChangePlan, result["planId"])
+        plan.status = nacos_change.PLAN_STATUS_APPLYING
+        db.session.commit()
+        with self.assertRaises(ChangePlanDriftException):
+            nacos_change.NacosChangeLog.apply_plan(
+                result["planId"], "nacos", self.client, self.app
+            )
+        self.assertEqual(self.client.published, [])
+        self.assertIsNotNone(db.session.get(ConfigOpsChangePlan, result["planId"]))
@@ -0,0 +1,137 @@
+import logging
+import threading
+import time
+import unittest
+from unittest import mock
+from configops.cluster import codec
+from configops.cluster.bus import RedisClusterBus
+from configops.cluster.controller import ControllerNamespace
+from configops.cluster.registry import ClusterWorkerInfo
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+logger = logging.getLogger(__name__)
+
+
+class TestRedisClusterBus(unittest.TestCase):
+
+    def test_lookup_skips_stale_sessions(self):
+        redis = mock.Mock()
+        redis.zrevrange.return_value = [b"stale", b"live"]
+        redis.hgetall.side_effect = lambda key: (
+            {}
+            if key.endswith(":stale")
+            else {
+                b"worker_id": b"w1",
+                b"name": b"worker-1",
+                b"codec": b"msgpack",
+                b"compression": b"zlib",
+            }
+        )
+        worker_info = RedisClusterBus(redis, "p1").lookup("w1")
+        self.assertEqual(worker_info.sid, "live")
+        self.assertEqual(worker_info.codec, "msgpack")
+        redis.zrem.assert_called_once_with("configops:cluster:worker:w1", "stale")
+
+    def test_forward_reply(self):
+        redis = mock.Mock()
+        bus = RedisClusterBus(redis, "p1")
+        redis.get.return_value = b"p1"
+        self.assertFalse(bus.forward_reply("r1", {}))
+        redis.get.return_value = None
+        self.assertFalse(bus.forward_reply("r1", {}))
+
+        message = {"type": "QUERY_SECRET", "request_id": "r1", "data": {"code": 0}}
+        redis.get.return_value = b"p2"
+        self.assertTrue(bus.forward_reply("r1", message))
+        channel, data = redis.publish.call_args.args
+        self.assertEqual(channel, "configops:cluster:reply:p2")
+        self.assertEqual(codec.decode(data), message)
+
+    def test_invalidate_worker_auth(self):
+        redis = mock.Mock()
+        RedisClusterBus(redis, "p1").invalidate_worker_auth("worker-1")
+        redis.publish.assert_called_once_with("configops:cluster:auth", "worker-1")
+
+
+class _StopListening(BaseException):
+    pass
+
+
+@unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+class TestRedisClusterBusShared(unittest.TestCase):
+    """Two controller processes sharing a Redis compatible server."""
+
+    def setUp(self):
+        server = fakeredis.FakeServer()
+        self.bus1 = RedisClusterBus(fakeredis.FakeRedis(server=server), "p1")
+        self.bus2 = RedisClusterBus(fakeredis.FakeRedis(server=server), "p2")
+
+    def _listen(self, bus, deliver, invalidate):
+        def run():
+            try:
+                bus.listen(deliver, lambda seconds: None, invalidate)
+            except _StopListening:
+                pass
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        channel = f"configops:cluster:reply:{bus.process_id}"
+        for _ in range(200):
+            if dict(bus.redis.pubsub_numsub(channel)).get(channel.encode()):
+                break
+            time.sleep(0.01)
+        return thread
+
+    def test_session_lookup(self):
+        worker_info = ClusterWorkerInfo("w1", "sid1", "worker-1", "msgpack", "zlib")
+        self.bus1.register_session(worker_info)
+        found = self.bus2.lookup("w1")
+        self.assertEqual(found.sid, "sid1")
+        self.assertEqual(found.compression, "zlib")
+        self.bus1.unregister_session(worker_info)
+        self.assertIsNone(self.bus2.lookup("w1"))
+
+    def test_forward_reply_and_invalidation(self):
+        replies, names = [], []
+
+        def invalidate(name):
+            names.append(name)
+            if name is None:
+                raise _StopListening()
+
+        thread = self._listen(self.bus1, replies.append, invalidate)
+        message = {"type": "QUERY_SECRET", "request_id": "r1", "data": {"code": 0}}
+        self.bus1.track_request("r1", 5)
+        # The worker answered the process holding its connection
+        self.assertTrue(self.bus2.forward_reply("r1", message))
+        self.bus2.invalidate_worker_auth("worker-1")
+        self.bus2.invalidate_worker_auth()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(replies, [message])
+        self.assertEqual(names, ["worker-1", None])
+
+
+class TestControllerDeliverReply(unittest.TestCase):
+
+    def test_deliver_local_or_forward(self):
+        bus = mock.Mock()
+        bus.forward_reply.return_value = True
+        controller = ControllerNamespace("/controller", None, bus)
+        callback = mock.Mock()
+        controller.pending_requests.register("r1", "w1", "sid1", callback, 5)
+
+        controller.deliver_reply(
+            {"type": "QUERY_SECRET", "request_id": "r1", "data": {"code": 0}}
+        )
+        callback.on_complete.assert_called_once_with({"code": 0})
+        bus.forward_reply.assert_not_called()
+
+        # Not waited for here, handed to the process that sent the request
+        other = {"type": "QUERY_SECRET", "request_id": "r2", "data": {}}
+        controller.deliver_reply(other)
+        bus.forward_reply.assert_called_once_with("r2", other)
@@ -0,0 +1,38 @@
+import logging
+import unittest
+from configops.cluster import codec
+
+logger = logging.getLogger(__name__)
+
+
+class TestCodec(unittest.TestCase):
+
+    def test_negotiate(self):
+        self.assertEqual(
+            codec.negotiate(None, None), (codec.CODEC_JSON, codec.COMPRESSION_NONE)
+        )
+        self.assertEqual(
+            codec.negotiate(["msgpack", "json"], ["zlib"]),
+            (codec.CODEC_MSGPACK, codec.COMPRESSION_ZLIB),
+        )
+
+    def test_round_trip(self):
+        message = {
+            "type": "QUERY_CHANGE_SET",
+            "request_id": "r1",
+            "data": {"content": "key: value\n" * 1000},
+        }
+        self.assertIs(codec.encode(message), message)
+        self.assertEqual(codec.decode(message), message)
+        for compression in [codec.COMPRESSION_NONE] + codec.supported_compressions():
+            frame = codec.encode(message, codec.CODEC_MSGPACK, compression)
+            self.assertIsInstance(frame, bytes)
+            self.assertEqual(codec.decode(frame), message)
+            if compression != codec.COMPRESSION_NONE:
+                self.assertLess(len(frame), 1000)
+
+    def test_small_payload_not_compressed(self):
+        frame = codec.encode(
+            {"type": "WORKER_INFO"}, codec.CODEC_MSGPACK, codec.COMPRESSION_ZLIB
+        )
+        self.assertEqual(frame[0], 0)
@@ -0,0 +1,136 @@
+import logging
+import unittest
+from unittest import mock
+from flask import Flask
+from configops.cluster.controller import (
+    ManagedObjectsMessageHandler,
+    WorkerInfoMessageHandler,
+)
+from configops.cluster.messages import Message, MessageType
+from configops.cluster.registry import ClusterWorkerInfo
+from configops.database.db import (
+    db,
+    ManagedObjects,
+    GroupPermission,
+    Worker,
+    WorkerInventory,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _object(id, url, system_type="NACOS"):
+    return {"id": id, "system_type": system_type, "url": url, "dialect": ""}
+
+
+class TestManagedObjectsSync(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        self.worker = ClusterWorkerInfo("w1", "sid1", "worker-1")
+        self.handler = ManagedObjectsMessageHandler()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def _objects(self):
+        return {
+            (item.system_type, item.system_id): item.url
+            for item in db.session.query(ManagedObjects).all()
+        }
+
+    def test_diff_sync(self):
+        self.handler.handle_managed_objects(
+            self.worker, [_object("a", "url-a"), _object("b", "url-b")], "h1"
+        )
+        self.assertEqual(
+            self._objects(), {("NACOS", "a"): "url-a", ("NACOS", "b"): "url-b"}
+        )
+        object_b = db.session.query(ManagedObjects).filter_by(system_id="b").one()
+        db.session.add(
+            GroupPermission(
+                id=1,
+                group_id="g",
+                source_id=object_b.id,
+                type="OBJECT",
+                permission="p",
+            )
+        )
+        db.session.commit()
+
+        self.handler.handle_managed_objects(
+            self.worker, [_object("a", "url-a2"), _object("c", "url-c")], "h2"
+        )
+        self.assertEqual(
+            self._objects(), {("NACOS", "a"): "url-a2", ("NACOS", "c"): "url-c"}
+        )
+        self.assertEqual(db.session.query(GroupPermission).count(), 0)
+        self.assertEqual(db.session.get(WorkerInventory, "w1").inventory_hash, "h2")
+
+    def test_skip_unchanged_inventory(self):
+        self.handler.handle_managed_objects(self.worker, [_object("a", "url-a")], "h1")
+        # Same hash and row count, the reported items are not looked at
+        self.handler.handle_managed_objects(self.worker, [_object("a", "url-x")], "h1")
+        self.assertEqual(self._objects(), {("NACOS", "a"): "url-a"})
+
+    def test_repair_deleted_rows(self):
+        self.handler.handle_managed_objects(
+            self.worker, [_object("a", "url-a"), _object("b", "url-b")], "h1"
+        )
+        db.session.query(ManagedObjects).filter_by(system_id="b").delete()
+        db.session.commit()
+        self.handler.handle_managed_objects(
+            self.worker, [_object("a", "url-a"), _object("b", "url-b")], "h1"
+        )
+        self.assertEqual(
+            self._objects(), {("NACOS", "a"): "url-a", ("NACOS", "b"): "url-b"}
+        )
+
+    def _worker_info(self, data):
+        namespace = mock.Mock()
+        namespace.routing_table.get_by_sid.return_value = self.worker
+        WorkerInfoMessageHandler().handle(
+            "sid1", Message(type=MessageType.WORKER_INFO, data=data), namespace
+        )
+        return namespace
+
+    def test_hash_only_worker_info(self):
+        db.session.add(
+            Worker(id="w1", workspace_id="ws", name="worker-1", secret="s")
+        )
+        self.handler.handle_managed_objects(self.worker, [_object("a", "url-a")], "h1")
+        data = {
+            "version": "1.0",
+            "managed_objects_hash": "h1",
+            "managed_objects_count": 1,
+        }
+        namespace = self._worker_info(data)
+        namespace.send_message.assert_not_called()
+
+        data["managed_objects_hash"] = "h2"
+        namespace = self._worker_info(data)
+        worker_id, message = namespace.send_message.call_args.args
+        self.assertEqual(worker_id, "w1")
+        self.assertEqual(message.type, MessageType.MANAGED_OBJECTS)
+
+        # The worker answers with its full inventory
+        self.handler.handle(
+            "sid1",
+            Message(
+                type=MessageType.MANAGED_OBJECTS,
+                data={
+                    "managed_objects": [_object("b", "url-b")],
+                    "managed_objects_hash": "h2",
+                },
+            ),
+            namespace,
+        )
+        self.assertEqual(self._objects(), {("NACOS", "b"): "url-b"})
+        self.assertEqual(db.session.get(WorkerInventory, "w1").inventory_hash, "h2")
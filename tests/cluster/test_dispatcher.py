@@ -0,0 +1,66 @@
+import logging
+import threading
+import time
+import unittest
+from configops.cluster.dispatcher import MessageDispatcher
+
+logger = logging.getLogger(__name__)
+
+
+class TestMessageDispatcher(unittest.TestCase):
+
+    def test_slow_type_does_not_block_others(self):
+        dispatcher = MessageDispatcher(max_workers=4, type_limits={"UPGRADE": 1})
+        release = threading.Event()
+        done = []
+        lock = threading.Lock()
+
+        def slow(idx):
+            release.wait(5)
+            with lock:
+                done.append(("UPGRADE", idx))
+
+        def fast(idx):
+            with lock:
+                done.append(("QUERY", idx))
+
+        for idx in range(3):
+            dispatcher.dispatch("UPGRADE", lambda idx=idx: slow(idx))
+        for idx in range(5):
+            dispatcher.dispatch("QUERY", lambda idx=idx: fast(idx))
+
+        deadline = time.time() + 5
+        while len(done) < 5 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual({item[0] for item in done}, {"QUERY"})
+        stats = dispatcher.stats()
+        self.assertEqual(stats["UPGRADE"]["running"], 1)
+        self.assertEqual(stats["UPGRADE"]["queued"], 2)
+
+        release.set()
+        deadline = time.time() + 5
+        while len(done) < 8 and time.time() < deadline:
+            time.sleep(0.01)
+        # Queued messages of a type run in arrival order
+        self.assertEqual(
+            [item[1] for item in done if item[0] == "UPGRADE"], [0, 1, 2]
+        )
+        self.assertEqual(dispatcher.stats()["UPGRADE"]["processed"], 3)
+        dispatcher.shutdown(wait=True)
+
+    def test_report(self):
+        dispatcher = MessageDispatcher(max_workers=2, type_limits={"UPGRADE": 1})
+        release = threading.Event()
+        for _ in range(3):
+            dispatcher.dispatch("UPGRADE", lambda: release.wait(5))
+        deadline = time.time() + 5
+        while dispatcher.report()["running"] < 1 and time.time() < deadline:
+            time.sleep(0.01)
+        report = dispatcher.report()
+        self.assertEqual(report["max_workers"], 2)
+        self.assertEqual(report["running"], 1)
+        self.assertEqual(report["queued"], 2)
+        self.assertEqual(report["saturation"], 0.5)
+        self.assertEqual(report["types"]["UPGRADE"]["max_queued"], 2)
+        release.set()
+        dispatcher.shutdown(wait=True)
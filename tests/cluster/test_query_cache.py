@@ -0,0 +1,94 @@
+import logging
+import unittest
+from unittest import mock
+from configops.cluster.query_cache import QueryCache
+from configops.utils.constants import StreamCallback
+
+logger = logging.getLogger(__name__)
+
+
+class TestQueryCache(unittest.TestCase):
+
+    def test_coalesce_and_cache(self):
+        cache = QueryCache(ttl=60)
+        sent = []
+        first, second, third = mock.Mock(), mock.Mock(), mock.Mock()
+        cache.request("obj", "q", first, sent.append)
+        cache.request("obj", "q", second, sent.append)
+        self.assertEqual(len(sent), 1)
+
+        sent[0].on_complete({"code": 0, "data": [1]})
+        first.on_complete.assert_called_once_with({"code": 0, "data": [1]})
+        second.on_complete.assert_called_once_with({"code": 0, "data": [1]})
+
+        cache.request("obj", "q", third, sent.append)
+        self.assertEqual(len(sent), 1)
+        third.on_complete.assert_called_once_with({"code": 0, "data": [1]})
+
+    def test_errors_not_cached(self):
+        cache = QueryCache(ttl=60)
+        sent = []
+        cache.request("obj", "q", mock.Mock(), sent.append)
+        sent[0].on_complete({"code": -1, "msg": "boom"})
+        cache.request("obj", "q", mock.Mock(), sent.append)
+        self.assertEqual(len(sent), 2)
+
+    def test_invalidate(self):
+        cache = QueryCache(ttl=60)
+        sent = []
+        cache.request("obj", "q", mock.Mock(), sent.append)
+        # A write while the read is in flight, its result must not be cached
+        cache.invalidate("obj")
+        cache.request("obj", "q", mock.Mock(), sent.append)
+        self.assertEqual(len(sent), 2)
+        sent[0].on_complete({"code": 0, "data": "old"})
+        sent[1].on_complete({"code": 0, "data": "new"})
+        latest = mock.Mock()
+        cache.request("obj", "q", latest, sent.append)
+        latest.on_complete.assert_called_once_with({"code": 0, "data": "new"})
+        cache.invalidate("obj")
+        cache.request("obj", "q", mock.Mock(), sent.append)
+        self.assertEqual(len(sent), 3)
+
+    def test_stream_late_join(self):
+        cache = QueryCache(ttl=60)
+        sent = []
+        early, late = StreamCallback(), StreamCallback()
+        cache.request("obj", "q", early, sent.append)
+        sent[0].on_chunk(b'{"a":', False)
+        cache.request("obj", "q", late, sent.append)
+        sent[0].on_chunk(b"1}", True)
+        for callback in (early, late):
+            chunks = []
+            while (chunk := callback.next_chunk(timeout=1)) is not None:
+                chunks.append(chunk)
+            self.assertEqual(b"".join(chunks), b'{"a":1}')
+        # Cached as the whole body
+        cached = mock.Mock(spec=["on_complete", "on_error"])
+        cache.request("obj", "q", cached, sent.append)
+        cached.on_complete.assert_called_once_with({"a": 1})
+        self.assertEqual(len(sent), 1)
+
+    def test_large_reply_not_cached(self):
+        cache = QueryCache(ttl=60)
+        sent = []
+        waiter = mock.Mock(spec=["on_complete", "on_error"])
+        stream = StreamCallback(max_buffered_chunks=16)
+        cache.request("obj", "q", waiter, sent.append)
+        cache.request("obj", "q", stream, sent.append)
+        data = "x" * (5 * 1024 * 1024)
+        body = ('{"code": 0, "data": "' + data + '"}').encode()
+        chunk_size = 1024 * 1024
+        chunks = [body[i : i + chunk_size] for i in range(0, len(body), chunk_size)]
+        for idx, chunk in enumerate(chunks):
+            sent[0].on_chunk(chunk, idx == len(chunks) - 1)
+        # Past the buffer limit, the reply still reaches every caller in full
+        waiter.on_error.assert_not_called()
+        waiter.on_complete.assert_called_once_with({"code": 0, "data": data})
+        streamed = []
+        while (chunk := stream.next_chunk(timeout=1)) is not None:
+            streamed.append(chunk)
+        self.assertEqual(b"".join(streamed), body)
+        # Too large to be cached
+        cache.request("obj", "q", mock.Mock(spec=["on_complete"]), sent.append)
+        self.assertEqual(len(sent), 2)
@@ -0,0 +1,135 @@
+import logging
+import unittest
+from unittest import mock
+from configops.utils.constants import StreamCallback
+from configops.cluster.registry import (
+    ClusterWorkerInfo,
+    HandshakeLimiter,
+    PendingRequestRegistry,
+    WorkerAuthCache,
+    WorkerRoutingTable,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class TestWorkerRoutingTable(unittest.TestCase):
+
+    def test_add_remove(self):
+        table = WorkerRoutingTable()
+        table.add(ClusterWorkerInfo(1, "sid1", "w1"))
+        table.add(ClusterWorkerInfo(2, "sid2", "w2"))
+        self.assertEqual(table.get(1).sid, "sid1")
+        self.assertEqual(table.get_by_sid("sid2").id, 2)
+        self.assertEqual(table.remove("sid1").id, 1)
+        self.assertIsNone(table.get(1))
+        self.assertIsNone(table.remove("sid1"))
+        self.assertEqual(table.worker_ids(), [2])
+        self.assertEqual(len(table), 1)
+
+    def test_reconnect(self):
+        table = WorkerRoutingTable()
+        old = ClusterWorkerInfo(1, "old", "w1")
+        new = ClusterWorkerInfo(1, "new", "w1")
+        table.add(old)
+        table.add(new)
+        new.last_seen = old.last_seen + 1
+        self.assertEqual(len(table.get_sessions(1)), 2)
+        self.assertIs(table.get(1), new)
+        # The stale session dropping must not take the worker offline
+        table.remove("old")
+        self.assertIs(table.get(1), new)
+        table.remove("new")
+        self.assertIsNone(table.get(1))
+
+
+class TestPendingRequestRegistry(unittest.TestCase):
+
+    def test_complete_and_expire(self):
+        registry = PendingRequestRegistry()
+        done = mock.Mock()
+        late = mock.Mock()
+        registry.register("r1", 1, "sid1", done, timeout=5)
+        registry.register("r2", 1, "sid1", late, timeout=0)
+        self.assertEqual(registry.stats(1)["in_flight"], 2)
+
+        self.assertTrue(registry.complete("r1", {"code": 0}))
+        done.on_complete.assert_called_once_with({"code": 0})
+        expired = registry.sweep(lambda item: TimeoutError(item.request_id))
+        self.assertEqual(expired, 1)
+        late.on_error.assert_called_once()
+        # A late response of an expired request is dropped
+        self.assertFalse(registry.complete("r2", {}))
+        late.on_complete.assert_not_called()
+        self.assertEqual(len(registry), 0)
+        stats = registry.stats(1)
+        self.assertEqual(stats["in_flight"], 0)
+        self.assertEqual(stats["timeout_rate"], 0.5)
+
+    def test_fail_session(self):
+        registry = PendingRequestRegistry()
+        callbacks = [mock.Mock(), mock.Mock(), mock.Mock()]
+        registry.register("r1", 1, "sid1", callbacks[0], timeout=5)
+        registry.register("r2", 1, "sid1", callbacks[1], timeout=5)
+        registry.register("r3", 2, "sid2", callbacks[2], timeout=5)
+        self.assertEqual(registry.fail_session("sid1", ValueError("gone")), 2)
+        callbacks[0].on_error.assert_called_once()
+        callbacks[2].on_error.assert_not_called()
+        self.assertEqual(registry.stats()[1]["failed"], 2)
+        self.assertEqual(registry.stats()[2]["in_flight"], 1)
+
+    def test_chunked_response(self):
+        registry = PendingRequestRegistry()
+        callback = mock.Mock(spec=["on_complete", "on_error"])
+        registry.register("r1", 1, "sid1", callback, timeout=5)
+        body = b'{"code": 0, "data": {"content": "abcdef"}}'
+        self.assertTrue(registry.add_chunk("r1", 0, body[:10], False))
+        self.assertTrue(registry.add_chunk("r1", 1, body[10:], True))
+        callback.on_complete.assert_called_once_with(
+            {"code": 0, "data": {"content": "abcdef"}}
+        )
+        self.assertFalse(registry.add_chunk("r1", 2, b"", True))
+
+        stream = StreamCallback()
+        registry.register("r2", 1, "sid1", stream, timeout=5)
+        registry.add_chunk("r2", 0, b"[1,", False)
+        registry.add_chunk("r2", 1, b"2]", True)
+        chunks = []
+        while (chunk := stream.next_chunk(timeout=1)) is not None:
+            chunks.append(chunk)
+        self.assertEqual(b"".join(chunks), b"[1,2]")
+
+    def test_chunk_out_of_order(self):
+        registry = PendingRequestRegistry()
+        callback = mock.Mock(spec=["on_complete", "on_error"])
+        registry.register("r1", 1, "sid1", callback, timeout=5)
+        registry.add_chunk("r1", 1, b"x", False)
+        callback.on_error.assert_called_once()
+        self.assertEqual(len(registry), 0)
+
+
+class TestConnectionAdmission(unittest.TestCase):
+
+    def test_worker_auth_cache(self):
+        cache = WorkerAuthCache(ttl=60)
+        loader = mock.Mock(side_effect=lambda name: {"id": 1, "name": name})
+        self.assertEqual(cache.get("w1", loader)["id"], 1)
+        cache.get("w1", loader)
+        self.assertEqual(loader.call_count, 1)
+        cache.invalidate("w1")
+        cache.get("w1", loader)
+        self.assertEqual(loader.call_count, 2)
+        # Unknown workers are not cached
+        missing = mock.Mock(return_value=None)
+        cache.get("w2", missing)
+        cache.get("w2", missing)
+        self.assertEqual(missing.call_count, 2)
+
+    def test_handshake_limiter(self):
+        limiter = HandshakeLimiter(max_concurrent=2)
+        self.assertTrue(limiter.try_acquire())
+        self.assertTrue(limiter.try_acquire())
+        self.assertFalse(limiter.try_acquire())
+        limiter.release()
+        self.assertTrue(limiter.try_acquire())
+        self.assertEqual(limiter.rejected, 1)
@@ -0,0 +1,79 @@
+import logging
+import threading
+import unittest
+from configops.cluster.messages import Message, MessageType
+from configops.cluster.scatter import (
+    STATUS_ERROR,
+    STATUS_OFFLINE,
+    STATUS_OK,
+    STATUS_TIMEOUT,
+    ScatterTarget,
+    merge_sorted,
+    scatter,
+)
+from configops.utils.exception import ConfigOpsException
+
+logger = logging.getLogger(__name__)
+
+
+class _FakeController:
+    def __init__(self, answers):
+        self.answers = answers
+
+    def create_event(self):
+        return threading.Event()
+
+    def is_worker_online(self, worker_id):
+        return worker_id != "offline"
+
+    def send_query(self, worker_id, object_key, message, callback, timeout):
+        answer = self.answers.get(worker_id)
+        if answer is None:
+            return
+        if isinstance(answer, Exception):
+            callback.on_error(answer)
+        else:
+            # Responses arrive on another thread
+            threading.Thread(target=callback.on_complete, args=(answer,)).start()
+
+
+def _target(id, worker_id):
+    return ScatterTarget(id, worker_id, Message(type=MessageType.QUERY_CHANGE_LOG))
+
+
+class TestScatter(unittest.TestCase):
+
+    def test_partial_results(self):
+        controller = _FakeController(
+            {
+                "ok": {"code": 0, "data": [1]},
+                "failed": {"code": -1, "msg": "boom"},
+                "error": ConfigOpsException("broken"),
+            }
+        )
+        targets = [
+            _target(1, "ok"),
+            _target(2, "failed"),
+            _target(3, "error"),
+            _target(4, "slow"),
+            _target(5, "offline"),
+        ]
+        scatter(controller, targets, timeout=0.2)
+        self.assertEqual(
+            [target.status for target in targets],
+            [STATUS_OK, STATUS_ERROR, STATUS_ERROR, STATUS_TIMEOUT, STATUS_OFFLINE],
+        )
+        self.assertEqual(targets[0].result["data"], [1])
+        self.assertEqual(targets[1].msg, "boom")
+        self.assertEqual(targets[2].msg, "broken")
+
+    def test_merge_sorted(self):
+        lists = [
+            [{"d": "2024-01-05"}, {"d": "2024-01-01"}],
+            [{"d": "2024-01-04"}, {"d": "2024-01-03"}],
+            [],
+        ]
+        items = merge_sorted(
+            lists, key=lambda item: item["d"], offset=1, size=2, reverse=True
+        )
+        self.assertEqual([item["d"] for item in items], ["2024-01-04", "2024-01-03"])
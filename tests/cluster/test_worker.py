@@ -0,0 +1,59 @@
+import logging
+import unittest
+from unittest import mock
+from flask import Flask
+from configops.cluster.messages import Message, MessageType
+from configops.cluster.worker import (
+    RECONNECT_DELAY_MAX,
+    WorkerNamespace,
+    get_retry_delay,
+    sio,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class TestWorkerReconnect(unittest.TestCase):
+
+    def test_retry_delay(self):
+        delays = [get_retry_delay(attempt) for attempt in range(20)]
+        self.assertTrue(all(0 <= delay <= RECONNECT_DELAY_MAX for delay in delays))
+        self.assertGreater(len(set(delays)), 1)
+        # The controller's retry_after is honored
+        self.assertGreaterEqual(get_retry_delay(0, retry_after=5), 5)
+
+    def test_reconnect_on_disconnect(self):
+        namespace = WorkerNamespace(Flask(__name__), "/worker")
+        with mock.patch.object(sio, "start_background_task") as start:
+            namespace.on_disconnect(sio.reason.TRANSPORT_ERROR)
+            start.assert_called_once_with(namespace.reconnect)
+            start.reset_mock()
+            # Closed on purpose
+            namespace.on_disconnect(sio.reason.CLIENT_DISCONNECT)
+            start.assert_not_called()
+
+    def test_reconnect_honors_retry_after(self):
+        namespace = WorkerNamespace(Flask(__name__), "/worker")
+        namespace.retry_after = 5
+        namespace.connect_with_retry = mock.Mock()
+        with mock.patch("configops.cluster.worker.time.sleep") as sleep:
+            namespace.reconnect()
+        self.assertGreaterEqual(sleep.call_args.args[0], 5)
+        namespace.connect_with_retry.assert_called_once_with()
+        self.assertIsNone(namespace.retry_after)
+
+
+class TestWorkerStats(unittest.TestCase):
+
+    def test_stats_answered_inline(self):
+        namespace = WorkerNamespace(Flask(__name__), "/worker")
+        namespace.dispatcher = mock.Mock()
+        namespace.dispatcher.report.return_value = {"running": 8, "max_workers": 8}
+        sent = []
+        namespace.send_message = sent.append
+        namespace.on_message(
+            Message(type=MessageType.WORKER_STATS, data={}, request_id="r1").to_dict()
+        )
+        namespace.dispatcher.dispatch.assert_not_called()
+        self.assertEqual(sent[0].request_id, "r1")
+        self.assertEqual(sent[0].data["data"]["running"], 8)
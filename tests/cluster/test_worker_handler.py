@@ -0,0 +1,163 @@
+import datetime
+import logging
+import unittest
+from flask import Flask
+from configops.cluster.messages import Message, MessageType
+from configops.cluster.worker_handler import QueryChangelogMessageHandler
+from configops.database.db import db, ConfigOpsChangeLog
+from configops.database.search import SEARCH_FTS5, init_changelog_search
+
+logger = logging.getLogger(__name__)
+
+
+class _Namespace:
+    def __init__(self, app):
+        self.app = app
+
+
+class TestQueryChangelog(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+        db.init_app(self.app)
+        with self.app.app_context():
+            db.create_all()
+            now = datetime.datetime(2024, 1, 1)
+            for i in range(25):
+                db.session.add(
+                    ConfigOpsChangeLog(
+                        change_set_id=f"c{i:02d}",
+                        system_id="s1",
+                        system_type="NACOS",
+                        exectype="FAILED" if i % 5 == 0 else "EXECUTED",
+                        author="alice" if i % 2 == 0 else "bob",
+                        checksum=f"1:sum{i}",
+                        # Runs of rows sharing the same timestamp
+                        updated_at=now + datetime.timedelta(minutes=i // 3),
+                    )
+                )
+            db.session.commit()
+            self.search_mode = init_changelog_search(self.app, db.engine)
+        self.handler = QueryChangelogMessageHandler()
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.drop_all()
+
+    def _query(self, **data):
+        data.update({"system_id": "s1", "system_type": "NACOS"})
+        message = Message(type=MessageType.QUERY_CHANGE_LOG, data=data)
+        return self.handler.handle(message, _Namespace(self.app)).to_dict()
+
+    def test_page(self):
+        resp = self._query(page=3, size=10)
+        self.assertEqual(resp["total"], 25)
+        self.assertEqual(len(resp["data"]), 5)
+
+    def test_time_window(self):
+        resp = self._query(
+            start_time="2024-01-01 00:02:00",
+            end_time="2024-01-01 00:04:00",
+            size=50,
+            with_counts=True,
+            exectypes=["EXECUTED"],
+        )
+        # Minutes 2 to 4 hold c06 to c14, c10 failed
+        self.assertEqual(
+            sorted(item["change_set_id"] for item in resp["data"]["items"]),
+            ["c06", "c07", "c08", "c09", "c11", "c12", "c13", "c14"],
+        )
+        self.assertEqual(resp["data"]["counts"], {"EXECUTED": 8, "FAILED": 1})
+
+    def test_cursor(self):
+        seen = []
+        cursor = ""
+        while cursor is not None:
+            resp = self._query(cursor=cursor, size=7)
+            seen.extend(item["change_set_id"] for item in resp["data"]["items"])
+            cursor = resp["data"]["next_cursor"]
+        self.assertEqual(len(seen), 25)
+        self.assertEqual(len(set(seen)), 25)
+        self.assertEqual(seen[:3], ["c24", "c23", "c22"])
+
+    def test_capped_count(self):
+        from configops.cluster import worker_handler
+
+        cap = worker_handler.MAX_COUNTED_CHANGELOGS
+        worker_handler.MAX_COUNTED_CHANGELOGS = 10
+        try:
+            resp = self._query(cursor="", size=5, exectypes=["EXECUTED"])
+        finally:
+            worker_handler.MAX_COUNTED_CHANGELOGS = cap
+        self.assertEqual(resp["total"], 10)
+        self.assertFalse(resp["data"]["total_exact"])
+        resp = self._query(cursor="", size=5, count="none", with_counts=True)
+        self.assertNotIn("total", resp)
+        self.assertEqual(resp["data"]["counts"], {"EXECUTED": 20, "FAILED": 5})
+
+    def test_search(self):
+        self.assertEqual(self.search_mode, SEARCH_FTS5)
+        resp = self._query(q="lic", size=50)
+        self.assertEqual(resp["total"], 13)
+        # Too short for the trigram index
+        resp = self._query(q="c2", size=50)
+        self.assertEqual(
+            sorted(item["change_set_id"] for item in resp["data"]),
+            ["c20", "c21", "c22", "c23", "c24"],
+        )
+
+        with self.app.app_context():
+            item = db.session.query(ConfigOpsChangeLog).filter_by(change_set_id="c01")
+            item.one().author = "malice"
+            db.session.commit()
+        self.assertEqual(self._query(q="lic", size=50)["total"], 14)
+        resp = self._query(q='"c0', size=50)
+        self.assertEqual(resp["data"], [])
+        self.assertIn(resp.get("total"), (0, None))
+
+    def test_bulk_update_and_delete(self):
+        from configops.cluster import worker_handler
+
+        change_sets = [
+            {"change_set_id": f"c{i:02d}", "exec_status": "EXECUTED"}
+            for i in range(0, 25, 5)
+        ]
+        change_sets.append({"change_set_id": "c01", "exec_status": "FAILED"})
+        change_sets.append({"change_set_id": "nope", "exec_status": "FAILED"})
+        message = Message(
+            type=MessageType.EDIT_CHNAGE_LOG,
+            data={"system_id": "s1", "system_type": "NACOS", "change_sets": change_sets},
+        )
+        chunk_size = worker_handler.IN_CHUNK_SIZE
+        worker_handler.IN_CHUNK_SIZE = 2
+        try:
+            self.assertEqual(list(worker_handler._chunks([1, 2, 3])), [[1, 2], [3]])
+            resp = worker_handler.UpdateChangelogMessageHandler().handle(
+                message, _Namespace(self.app)
+            )
+        finally:
+            worker_handler.IN_CHUNK_SIZE = chunk_size
+        self.assertEqual(resp.data, {"updated": 6, "missing": ["nope"]})
+        with self.app.app_context():
+            logs = {
+                log.change_set_id: log
+                for log in db.session.query(ConfigOpsChangeLog).all()
+            }
+            self.assertEqual(logs["c05"].exectype, "EXECUTED")
+            self.assertEqual(logs["c05"].checksum, "0:sum5")
+            self.assertEqual(logs["c01"].exectype, "FAILED")
+
+        message = Message(
+            type=MessageType.DELETE_CHANGE_LOG,
+            data={
+                "system_id": "s1",
+                "system_type": "NACOS",
+                "change_set_ids": [f"c{i:02d}" for i in range(20)],
+            },
+        )
+        resp = worker_handler.DeleteChangelogMessageHandler().handle(
+            message, _Namespace(self.app)
+        )
+        self.assertEqual(resp.data, {"deleted": 20})
+        self.assertEqual(self._query(size=50)["total"], 5)
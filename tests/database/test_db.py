@@ -0,0 +1,74 @@
+import logging
+import os
+import tempfile
+import unittest
+from unittest import mock
+import sqlalchemy
+from flask import Flask
+from configops.database import db as db_module
+from configops.database.db import Base, MigrationHistory, db
+
+logger = logging.getLogger(__name__)
+
+_SQL_DIR = os.path.join(
+    os.path.dirname(__file__), os.pardir, os.pardir, "migrations", "sql"
+)
+
+
+class TestMigrations(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_uri = f"sqlite:///{self.tmp_dir.name}/configops.db"
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _init(self):
+        app = Flask(__name__)
+        app.config["SQLALCHEMY_DATABASE_URI"] = self.db_uri
+        with mock.patch.object(db_module, "_BASE_SQL_DIR", _SQL_DIR):
+            db_module.init(app, {"role": "worker"})
+        with app.app_context():
+            executed = {row.fname for row in db.session.query(MigrationHistory)}
+            indexes = {
+                index["name"]
+                for index in sqlalchemy.inspect(db.engine).get_indexes(
+                    "CONFIGOPS_CHANGE_LOG"
+                )
+            }
+            db.engine.dispose()
+        return executed, indexes
+
+    def test_migrate_existing_database(self):
+        engine = sqlalchemy.create_engine(self.db_uri)
+        Base.metadata.create_all(engine)
+        with engine.begin() as conn:
+            conn.execute(sqlalchemy.text("DROP INDEX idx_change_log_history"))
+        engine.dispose()
+
+        executed, indexes = self._init()
+        self.assertIn("0000_add_change_log_history_index.sql", executed)
+        self.assertIn("idx_change_log_history", indexes)
+
+    def test_new_database(self):
+        # Built by create_all(), the migrations are recorded but not run
+        executed, indexes = self._init()
+        self.assertIn("0000_add_change_log_history_index.sql", executed)
+        self.assertIn("idx_change_log_history", indexes)
+        self.assertEqual(self._init()[0], executed)
+
+    def test_dialect_migration_files(self):
+        worker_dir = os.path.join(_SQL_DIR, "worker")
+        files = dict(db_module._migration_files(worker_dir, "postgresql"))
+        self.assertTrue(
+            files["0000_add_change_log_history_index.sql"].endswith(
+                "0000_add_change_log_history_index.postgresql.sql"
+            )
+        )
+        files = dict(db_module._migration_files(worker_dir, "mysql"))
+        self.assertTrue(
+            files["0000_add_change_log_history_index.sql"].endswith(
+                os.sep + "0000_add_change_log_history_index.sql"
+            )
+        )
@@ -18,3 +18,31 @@ class TestConstants:
         ]
         sorted_files = sorted(files, key=constants.extract_version)
         logger.info(f"sorted files: {sorted_files}")
+
+    def test_reply_callback(self):
+        callback = constants.ReplyCallback()
+        callback.on_complete({"code": 0})
+        callback.on_error(ValueError("late"))
+        assert callback.wait(0) == {"code": 0}
+
+        callback = constants.ReplyCallback()
+        try:
+            callback.wait(0.01)
+            assert False
+        except TimeoutError:
+            pass
+
+    def test_stream_callback_bounded(self):
+        callback = constants.StreamCallback(max_buffered_chunks=2)
+        callback.on_chunk(b"[1,", False)
+        assert callback.next_chunk(0) == b"[1,"
+        callback.on_chunk(b"2,", False)
+        callback.on_chunk(b"3,", False)
+        # The client did not keep up, the stream is cancelled
+        callback.on_chunk(b"4]", True)
+        assert callback.queue.qsize() == 2
+        try:
+            callback.next_chunk(0)
+            assert False
+        except OverflowError:
+            pass
@@ -3,6 +3,7 @@
 import io
 import logging
 import json
+from unittest import mock
 from configops.utils import secret_util
 
 logger = logging.getLogger(__name__)
@@ -14,3 +15,45 @@ class TestSecretUtil:
         logger.info(f"pass: {p}")
         jsons = json.dumps("aaaa", ensure_ascii=False)
         logger.info(f"jsons: {jsons}")
+
+    def test_aws_credentials_cache(self):
+        aws_cfg = {
+            "enabled": True,
+            "access_key": "AKIDCACHE",
+            "secret_key": "secret1",
+            "region": "us-west-2",
+        }
+        creds, region = secret_util._get_aws_creds(aws_cfg)
+        assert region == "us-west-2"
+        assert creds.access_key == "AKIDCACHE"
+        headers = dict(
+            secret_util.get_aws_request_headers(
+                aws_cfg, "POST", "neptune-db", "https://h:8182/sparql", {"a": "b"}
+            )
+        )
+        assert "Authorization" in headers
+        cached = secret_util._get_cached_aws_creds(aws_cfg)
+        signer = cached.get_signer("neptune-db")
+        assert signer is cached.get_signer("neptune-db")
+
+        aws_cfg["secret_key"] = "secret2"
+        rotated = secret_util._get_cached_aws_creds(aws_cfg)
+        assert rotated is not cached
+        assert rotated.get().secret_key == "secret2"
+
+    def test_aws_credentials_refresh(self):
+        credentials = mock.Mock()
+        credentials.get_frozen_credentials.return_value = mock.Mock(
+            access_key="a", secret_key="s", token="t1"
+        )
+        credentials.refresh_needed.return_value = False
+        cached = secret_util._CachedAwsCredentials(credentials, "us-east-1")
+        signer = cached.get_signer("neptune-db")
+        assert cached.get().token == "t1"
+
+        credentials.get_frozen_credentials.return_value = mock.Mock(
+            access_key="a", secret_key="s", token="t2"
+        )
+        credentials.refresh_needed.return_value = True
+        assert cached.get().token == "t2"
+        assert cached.get_signer("neptune-db") is not signer